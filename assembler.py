@@ -0,0 +1,237 @@
+"""
+Turns the function bodies read from yaml back into code.
+
+Everything is done in one pass over the instructions: each one is parsed, encoded and appended to the code right away.
+The yaml doesn't keep where jumps go, so they're worked out from the block structure instead.
+Jumps that point forward are remembered on a stack of open blocks and filled in once the instruction they point to is written:
+    
+    If      jump_to    the next ElseIf, Else or EndIf
+    ElseIf  start_from the If,  jump_to the next ElseIf, Else or EndIf
+    Else    jump_to    the EndIf
+    Switch  jump_offset the EndSwitch
+    Case    jump_offset the next Case or EndSwitch
+    While   jump_offset the EndWhile
+
+Like every other offset in a script (labels, function code), a jump points at the word before the instruction.
+"""
+from array import array
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Any
+
+import cmds
+from functions import FunctionDef, add_local_symbols, thread_stem
+from script import Script
+from tables import table_size
+from util import SymbolIds
+
+@dataclass
+class Block:
+    inst: Any
+    offset: int
+    # the jump of the last If, ElseIf or Case, which goes to whatever comes next in the block
+    branch: list[tuple[Any, str, int]] = field(default_factory=list)
+    # jumps to the end of the block
+    ends: list[tuple[Any, str, int]] = field(default_factory=list)
+    # the function holding the body of a thread, and where the body starts (in words and in instructions)
+    thread_fn: FunctionDef | None = None
+    body_start: int = 0
+    body_index: int = 0
+
+class CodeWriter:
+    # since the last flush
+    words: array
+    instructions: list
+    blocks: list[Block]
+    # how many words were handed out by flush
+    base: int
+    # the functions started by a thread whose code was written since the last flush
+    thread_functions: list[FunctionDef]
+    
+    def __init__(self):
+        # the first word is never used by anything, the code offsets point at the word before the code
+        self.words = array('I', [0])
+        self.instructions = []
+        self.blocks = []
+        self.base = 0
+        self.thread_functions = []
+    
+    @property
+    def offset(self) -> int:
+        """Offset of the next instruction written."""
+        return self.base + len(self.words) - 1
+    
+    def patch(self, jumps: list[tuple[Any, str, int]], target: int):
+        for inst, name, position in jumps:
+            self.words[position] = target
+            setattr(inst, name, target)
+        
+        jumps.clear()
+    
+    def top(self, *types: type) -> Block:
+        assert len(self.blocks) > 0 and isinstance(self.blocks[-1].inst, types), \
+            f"No {' or '.join(t.__name__[:-len('Cmd')] for t in types)} for this to belong to"
+        return self.blocks[-1]
+    
+    def write(self, inst: Any):
+        offset = self.offset
+        
+        # instructions that are jumped to
+        match inst:
+            case cmds.ElseIfCmd() | cmds.ElseCmd():
+                block = self.top(cmds.IfCmd)
+                self.patch(block.branch, offset)
+            case cmds.EndIfCmd():
+                block = self.blocks.pop()
+                assert isinstance(block.inst, cmds.IfCmd), "No If for this EndIf to belong to"
+                self.patch(block.branch, offset)
+                self.patch(block.ends, offset)
+            case cmds.CaseEqCmd() | cmds.CaseLteCmd() | cmds.CaseRangeCmd():
+                self.patch(self.top(cmds.SwitchCmd).branch, offset)
+            case cmds.EndSwitchCmd():
+                block = self.blocks.pop()
+                assert isinstance(block.inst, cmds.SwitchCmd), "No Switch for this EndSwitch to belong to"
+                self.patch(block.branch, offset)
+                self.patch(block.ends, offset)
+            case cmds.EndWhileCmd():
+                block = self.blocks.pop()
+                assert isinstance(block.inst, cmds.WhileCmd), "No While for this EndWhile to belong to"
+                self.patch(block.ends, offset)
+            case cmds.LabelCmd(_, label):
+                inst.offset = offset
+                if label is not None:
+                    label.code_offset = offset
+        
+        jumps = [(inst, name, position) for name, position in cmds.write_cmd(inst, self.words)]
+        self.instructions.append(inst)
+        
+        # instructions that jump
+        match inst:
+            case cmds.IfCmd():
+                self.blocks.append(Block(inst, offset, jumps))
+            case cmds.ElseIfCmd():
+                start_from, jump_to = jumps
+                self.patch([start_from], self.blocks[-1].offset)
+                self.blocks[-1].branch.append(jump_to)
+            case cmds.ElseCmd():
+                self.blocks[-1].ends.extend(jumps)
+            case cmds.SwitchCmd():
+                self.blocks.append(Block(inst, offset, [], jumps))
+            case cmds.CaseEqCmd() | cmds.CaseLteCmd() | cmds.CaseRangeCmd():
+                self.blocks[-1].branch.extend(jumps)
+            case cmds.WhileCmd():
+                self.blocks.append(Block(inst, offset, [], jumps))
+            case cmds.ThreadCmd(func) | cmds.Thread2Cmd(func):
+                thread_fn = func if isinstance(func, FunctionDef) else None
+                self.blocks.append(Block(inst, offset, thread_fn=thread_fn, body_start=len(self.words), body_index=len(self.instructions)))
+            case cmds.ReturnCmd():
+                # a Return ends the thread it's in, same as when decoding
+                if len(self.blocks) > 0 and isinstance(self.blocks[-1].inst, (cmds.ThreadCmd, cmds.Thread2Cmd)):
+                    self.end_thread(self.blocks.pop())
+    
+    def end_thread(self, block: Block):
+        if block.thread_fn is not None:
+            block.thread_fn.code_offset = self.base + block.body_start - 1
+            block.thread_fn.code = self.words[block.body_start:]
+            block.thread_fn.instructions = self.instructions[block.body_index:]
+            self.thread_functions.append(block.thread_fn)
+    
+    def end_function(self):
+        # blocks left open by a body that just stops, their jumps stay at 0
+        while len(self.blocks) > 0:
+            block = self.blocks.pop()
+            if isinstance(block.inst, (cmds.ThreadCmd, cmds.Thread2Cmd)):
+                self.end_thread(block)
+    
+    def flush(self) -> array:
+        """
+        Hands out the code written since the last flush and forgets about it, for writing the code out as it's assembled.
+        Offsets keep counting from the start of the code, only whole functions can be flushed.
+        """
+        assert len(self.blocks) == 0, "Can't flush in the middle of a function"
+        
+        words = self.words
+        self.base += len(words)
+        self.words = array('I')
+        self.instructions = []
+        self.thread_functions = []
+        
+        return words
+
+class ThreadFunctions:
+    """Hands out the functions whose body is inside the function starting the thread, matching them by name."""
+    unclaimed: list[FunctionDef]
+    definitions: list[FunctionDef]
+    
+    def __init__(self, definitions: list[FunctionDef]):
+        self.unclaimed = [fn for fn in definitions if fn.instruction_strs is None]
+        self.definitions = definitions
+    
+    def claim(self, stem: str | None) -> FunctionDef:
+        def matches(fn: FunctionDef) -> bool:
+            if fn.name is None or '_' not in fn.name:
+                return fn.name == stem
+            
+            return thread_stem(fn.name) == stem
+        
+        for i, fn in enumerate(self.unclaimed):
+            if matches(fn):
+                return self.unclaimed.pop(i)
+        
+        # threads can also start a function that has a body of its own
+        fn = next((fn for fn in self.definitions if fn.instruction_strs is not None and matches(fn)), None)
+        assert fn is not None, f"There's no function for the thread {stem}"
+        return fn
+
+def assemble_function(fn: FunctionDef, writer: CodeWriter, symbol_ids: SymbolIds, threads: ThreadFunctions):
+    assert fn.instruction_strs is not None
+    
+    start = len(writer.words)
+    start_index = len(writer.instructions)
+    
+    with symbol_ids.scope():
+        add_local_symbols(fn, symbol_ids)
+        
+        for line in fn.instruction_strs:
+            inst = cmds.cmd_from_string(line, fn, symbol_ids, threads.claim)
+            writer.write(inst)
+            
+            # same as what analyze_function_def does when it decodes a Thread or Thread2
+            match inst:
+                case cmds.ThreadCmd(func):
+                    if isinstance(func, FunctionDef) and func is not fn:
+                        func.thread_references.append(fn)
+                case cmds.Thread2Cmd(func):
+                    if isinstance(func, FunctionDef) and func is not fn:
+                        func.thread2_references.append(fn)
+        
+        writer.end_function()
+    
+    fn.code_offset = writer.base + start - 1
+    fn.code = writer.words[start:]
+    fn.instructions = writer.instructions[start_index:]
+
+def place_tables(script: Script, offset: int):
+    """Lays out the data of every table one after the other, starting at offset in the code section."""
+    for table in chain(script.tables, (table for fn in script.definitions for table in fn.tables)):
+        table.start_offset = offset
+        offset += table_size(table)
+
+def assemble_script(script: Script, symbol_ids: SymbolIds):
+    """
+    Generates the code of every function read from yaml, and places the table data after it.
+    symbol_ids has to hold everything defined at script level.
+    """
+    writer = CodeWriter()
+    threads = ThreadFunctions(script.definitions)
+    
+    for fn in script.definitions:
+        if fn.instruction_strs is not None:
+            assemble_function(fn, writer, symbol_ids, threads)
+    
+    # functions without a body that no thread claimed
+    for fn in threads.unclaimed:
+        fn.code_offset = writer.offset
+        fn.code = array('I')
+    
+    place_tables(script, len(writer.words))
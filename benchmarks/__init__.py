@@ -0,0 +1,5 @@
+"""
+Benchmarks for the script dumper.
+
+Run them from the repository root, e.g. `python -m benchmarks.string_index`.
+"""
@@ -0,0 +1,333 @@
+"""
+Generates synthetic scripts for the benchmarks, written as KSM containers the same way the tool writes them.
+
+    python -m benchmarks.corpus out_dir --scripts 10 --functions 500
+
+Function bodies are a random mix of statements (see DEFAULT_MIX) nested a few levels deep,
+so everything real scripts make the decoder and printer do gets exercised:
+expressions with calls in them, jumps, labels, switches, table reads and threads with captured variables.
+"""
+from argparse import ArgumentParser
+from array import array
+from dataclasses import dataclass, field
+import os
+from random import Random
+
+import main # makes sure the circular imports between the modules resolve
+import cmds
+from assembler import CodeWriter, place_tables
+from container import write_ksm_container
+from functions import FunctionDef
+from other_types import EXPR_SYMBOLS, Expr, ImportType, Label, ScriptImport
+from script import Script, script_to_sections
+from tables import Table, TableDataType
+from variables import Var, VarCategory
+
+# how often each kind of statement shows up relative to the others
+DEFAULT_MIX = {
+    'set': 10,
+    'set_const': 4,
+    'call': 8,
+    'call_const': 3,
+    'if': 3,
+    'while': 1,
+    'switch': 1,
+    'wait': 2,
+    'table': 1,
+    'label': 1,
+    'thread': 1,
+}
+
+@dataclass
+class CorpusOptions:
+    functions: int = 100
+    statics: int = 10
+    constants: int = 50
+    globals: int = 100
+    imports: int = 40
+    tables: int = 8
+    table_length: int = 16
+    # per function
+    locals: int = 4
+    labels: int = 2
+    statements: int = 40
+    mix: dict[str, int] = field(default_factory=lambda: dict(DEFAULT_MIX))
+    seed: int = 0
+
+ARITHMETIC = [EXPR_SYMBOLS[code] for code in (0x53, 0x54, 0x55, 0x56, 0x52)]
+COMPARISONS = [EXPR_SYMBOLS[code] for code in (0x4a, 0x4b, 0x4c, 0x4d, 0x4e, 0x4f)]
+LOGIC = [EXPR_SYMBOLS[code] for code in (0x43, 0x44)]
+OPEN, CLOSE = EXPR_SYMBOLS[0x41], EXPR_SYMBOLS[0x42]
+
+# how deep blocks (If, While, Switch) get nested
+MAX_DEPTH = 3
+
+class BodyGenerator:
+    """Generates the statements of one function, and the functions for the threads it starts."""
+    def __init__(self, rnd: Random, options: CorpusOptions, fn: FunctionDef, script: Script, next_id):
+        self.rnd = rnd
+        self.options = options
+        self.fn = fn
+        self.script = script
+        self.next_id = next_id
+        
+        self.temps = [Var(None, f"{i:X}", VarCategory.TempVar, 0x10000100 | i, 0, 0, 0) for i in range(8)]
+        self.writable = self.temps + fn.vars + script.global_variables + script.static_variables
+        self.readable = self.writable + script.constants
+        self.callees = script.imports + script.definitions
+        
+        self.kinds = list(options.mix)
+        self.weights = [options.mix[kind] for kind in self.kinds]
+        self.unplaced_labels = list(fn.labels)
+        self.placed_labels: list[Label] = []
+        self.threads: list[FunctionDef] = []
+        self.out: list = []
+    
+    def value(self):
+        return self.rnd.choice(self.readable)
+    
+    def destination(self):
+        return self.rnd.choice(self.writable)
+    
+    def expression(self, operators: list, length: int | None = None) -> Expr:
+        rnd = self.rnd
+        if length is None:
+            length = rnd.choice([1, 1, 2, 3])
+        
+        elements = []
+        for i in range(length):
+            if i > 0:
+                elements.append(rnd.choice(operators))
+            
+            roll = rnd.random()
+            if roll < 0.05:
+                elements.append(cmds.CallCmd(False, rnd.choice(self.script.imports), [Expr([self.value()])]))
+            elif roll < 0.15:
+                elements.extend([OPEN, self.value(), rnd.choice(ARITHMETIC), self.value(), CLOSE])
+            else:
+                elements.append(self.value())
+        
+        return Expr(elements)
+    
+    def condition(self) -> Expr:
+        condition = self.expression(ARITHMETIC, 1)
+        condition.elements += [self.rnd.choice(COMPARISONS), self.value()]
+        
+        if self.rnd.random() < 0.2:
+            condition.elements += [self.rnd.choice(LOGIC), self.value(), self.rnd.choice(COMPARISONS), self.value()]
+        
+        return condition
+    
+    def block(self, depth: int):
+        for _ in range(self.rnd.randint(1, 3)):
+            self.statement(depth + 1)
+    
+    def statement(self, depth: int):
+        rnd = self.rnd
+        out = self.out
+        kind = rnd.choices(self.kinds, self.weights)[0]
+        
+        if kind in ('if', 'while', 'switch') and depth >= MAX_DEPTH:
+            kind = 'set'
+        if kind == 'thread' and depth > 0:
+            # threads aren't started from inside blocks or other threads
+            kind = 'set'
+        
+        match kind:
+            case 'set':
+                out.append(cmds.SetCmd(False, self.destination(), self.expression(ARITHMETIC)))
+            case 'set_const':
+                out.append(cmds.SetCmd(True, self.destination(), self.value()))
+            case 'call':
+                args = [self.expression(ARITHMETIC) for _ in range(rnd.randint(0, 4))]
+                out.append(cmds.CallCmd(False, rnd.choice(self.callees), args))
+            case 'call_const':
+                args = [self.value() for _ in range(rnd.randint(0, 4))]
+                out.append(cmds.CallCmd(True, rnd.choice(self.callees), args))
+            case 'if':
+                out.append(cmds.IfCmd(self.condition(), 0, 0, 0))
+                self.block(depth)
+                
+                if rnd.random() < 0.3:
+                    out.append(cmds.ElseIfCmd(0, 0, self.condition(), 0, 0, 0))
+                    self.block(depth)
+                if rnd.random() < 0.5:
+                    out.append(cmds.ElseCmd(0))
+                    self.block(depth)
+                
+                out.append(cmds.EndIfCmd())
+            case 'while':
+                out.append(cmds.WhileCmd(False, self.condition(), 0))
+                self.block(depth)
+                
+                if rnd.random() < 0.3:
+                    out.append(cmds.BreakCmd())
+                
+                out.append(cmds.EndWhileCmd())
+            case 'switch':
+                out.append(cmds.SwitchCmd(self.destination(), 0, 0))
+                
+                for _ in range(rnd.randint(1, 4)):
+                    if rnd.random() < 0.2:
+                        out.append(cmds.CaseRangeCmd(False, self.value(), self.value(), 0))
+                    else:
+                        out.append(cmds.CaseEqCmd(False, self.value(), 0))
+                    
+                    self.block(depth)
+                    out.append(cmds.BreakSwitchCmd())
+                
+                out.append(cmds.EndSwitchCmd())
+            case 'wait':
+                if rnd.random() < 0.5:
+                    out.append(cmds.WaitCmd(True, rnd.choice(self.script.constants)))
+                else:
+                    out.append(cmds.WaitCmd(False, self.expression(ARITHMETIC)))
+            case 'table':
+                table = rnd.choice(self.script.tables)
+                
+                if rnd.random() < 0.3:
+                    out.append(cmds.ReadTableLengthCmd(False, table))
+                else:
+                    out.append(cmds.ReadTableEntryToVarCmd(False, table, self.value(), self.destination()))
+            case 'label':
+                if len(self.unplaced_labels) > 0:
+                    label = self.unplaced_labels.pop(0)
+                    self.placed_labels.append(label)
+                    out.append(cmds.LabelCmd(0, label))
+                elif len(self.placed_labels) > 0:
+                    out.append(cmds.GotoLabelCmd(rnd.choice(self.placed_labels)))
+            case 'thread':
+                self.thread(depth)
+    
+    def thread(self, depth: int):
+        # the body is part of the function starting the thread, the thread function only points into it
+        thread_fn = FunctionDef(f"_{self.fn.name}_{len(self.threads) + 1}", self.next_id(), 0, 0, 0, 0,
+                                array('I'), 0, None, None, [], [], [])
+        self.threads.append(thread_fn)
+        
+        captured = self.rnd.sample(self.temps, self.rnd.randint(0, 2))
+        thread_class = cmds.ThreadCmd if self.rnd.random() < 0.7 else cmds.Thread2Cmd
+        
+        self.out.append(thread_class(thread_fn, [var.id for var in captured], captured))
+        self.block(depth)
+        self.out.append(cmds.ReturnCmd())
+    
+    def generate(self) -> list:
+        params = self.fn.vars[:self.rnd.randint(0, len(self.fn.vars))]
+        if len(params) > 0:
+            self.out.append(cmds.GetArgsCmd(self.fn, params))
+        
+        for _ in range(self.options.statements):
+            self.statement(0)
+        
+        # every label has to point somewhere
+        for label in self.unplaced_labels:
+            self.out.append(cmds.LabelCmd(0, label))
+        
+        if self.rnd.random() < 0.5:
+            self.out.append(cmds.ReturnValCmd(False, self.expression(ARITHMETIC)))
+        self.out.append(cmds.ReturnCmd())
+        
+        return self.out
+
+def generate_script(options: CorpusOptions) -> Script:
+    rnd = Random(options.seed)
+    ids = iter(range(0x100, 0x10000000))
+    next_id = lambda: next(ids)
+    
+    def name(prefix: str, i: int) -> str | None:
+        # like in real scripts, some symbols don't have a name
+        return f"{prefix}_{i}" if i % 4 != 3 else None
+    
+    statics = [Var(name('static', i), None, VarCategory.Static, next_id(), 1, 0, 0) for i in range(options.statics)]
+    global_variables = [Var(name('global', i), None, VarCategory.Global, next_id(), 1, 0, 0) for i in range(options.globals)]
+    
+    constants = []
+    for i in range(options.constants):
+        # unnamed constants are written as their value, so the values have to be unique
+        match i % 3:
+            case 0:
+                constants.append(Var(None, None, VarCategory.Const, next_id(), 1, 0, i))
+            case 1:
+                constants.append(Var(None, None, VarCategory.Const, next_id(), 0, 0, i + 0.5))
+            case 2:
+                constants.append(Var(None, None, VarCategory.Const, next_id(), 3, 0, f"text {i}"))
+    
+    imports = [ScriptImport(f"import_{i}", 0, ImportType.Func, next_id()) for i in range(options.imports)]
+    
+    tables = []
+    for i in range(options.tables):
+        if i % 2 == 0:
+            values = [rnd.randrange(-1000, 1000) for _ in range(options.table_length)]
+            tables.append(Table(name('table', i), next_id(), TableDataType.Int, options.table_length, 0, 0, values))
+        else:
+            values = [rnd.randrange(-1000, 1000) / 4 for _ in range(options.table_length)]
+            tables.append(Table(name('table', i), next_id(), TableDataType.Float, options.table_length, 0, 0, values))
+    
+    definitions = []
+    for i in range(options.functions):
+        local_vars = [Var(f"local_{j}", None, VarCategory.LocalVar, next_id(), 1, 0, 0) for j in range(options.locals)]
+        labels = [Label(name('label', j), None, next_id(), 0) for j in range(options.labels)]
+        definitions.append(FunctionDef(f"function_{i}", next_id(), 1, 0, 0, 0, array('I'), 0, None, None, local_vars, [], labels))
+    
+    script = Script(0x1234, statics, constants, global_variables, imports, tables, definitions)
+    
+    writer = CodeWriter()
+    all_definitions = []
+    
+    for fn in definitions:
+        generator = BodyGenerator(rnd, options, fn, script, next_id)
+        start = len(writer.words)
+        
+        for inst in generator.generate():
+            writer.write(inst)
+        writer.end_function()
+        
+        fn.code_offset = start - 1
+        fn.code = writer.words[start:]
+        
+        all_definitions.append(fn)
+        all_definitions.extend(generator.threads)
+    
+    script.definitions = all_definitions
+    place_tables(script, len(writer.words))
+    
+    return script
+
+def generate(options: CorpusOptions) -> bytes:
+    """A whole KSM container."""
+    return write_ksm_container(script_to_sections(generate_script(options)))
+
+def main():
+    parser = ArgumentParser(description="Writes synthetic KSM scripts for the benchmarks")
+    parser.add_argument('out_dir')
+    parser.add_argument('--scripts', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first script, the others use the ones after it")
+    
+    defaults = CorpusOptions()
+    for option in ['functions', 'statics', 'constants', 'globals', 'imports', 'tables', 'table_length', 'locals', 'labels', 'statements']:
+        parser.add_argument(f"--{option.replace('_', '-')}", type=int, default=getattr(defaults, option))
+    
+    parser.add_argument('--mix', default=None, metavar='KIND=WEIGHT,...',
+                        help=f"weights of the kinds of statements, the others keep their default ({', '.join(DEFAULT_MIX)})")
+    
+    args = parser.parse_args()
+    
+    mix = dict(DEFAULT_MIX)
+    if args.mix is not None:
+        for item in args.mix.split(','):
+            kind, weight = item.split('=')
+            assert kind in DEFAULT_MIX, f"Unknown kind of statement {kind}"
+            mix[kind] = int(weight)
+    
+    os.makedirs(args.out_dir, exist_ok=True)
+    
+    for i in range(args.scripts):
+        options = CorpusOptions(args.functions, args.statics, args.constants, args.globals, args.imports, args.tables,
+                                args.table_length, args.locals, args.labels, args.statements, mix, args.seed + i)
+        
+        with open(os.path.join(args.out_dir, f"corpus_{i}.bin"), 'wb') as f:
+            f.write(generate(options))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Compares the decoders generated from the instruction layouts against the hand-written readers they replaced.
+
+The hand-written readers below are what cmds used to have for the instructions the synthetic code is made of,
+they took a ReadCmdOptions built for every instruction and checked the type of every symbol they read.
+"""
+from dataclasses import dataclass
+from time import perf_counter
+
+import main # makes sure the circular imports between the modules resolve
+import cmds
+from cmds import CallCmd, ElseCmd, EndIfCmd, EndWhileCmd, IfCmd, SetCmd, WaitCmd, WhileCmd, write_cmd
+import functions
+from other_types import EXPR_SYMBOLS, Expr, ImportType, ScriptImport, read_expr
+from util import SymbolIds
+from variables import Var, VarCategory
+
+@dataclass
+class ReadCmdOptions:
+    opcode: int
+    is_const: bool
+    cmd_offset: int | None = None
+
+def read_call_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallCmd:
+    func_int = next(arr)[1]
+    func = symbol_ids.get(func_int)
+    assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
+    
+    args = []
+    for _, value in arr:
+        if value == 0x11:
+            break
+        
+        if options.is_const:
+            var = symbol_ids.get(value)
+            args.append(var)
+        else:
+            args.append(read_expr(value, arr, symbol_ids))
+    
+    return CallCmd(options.is_const, func, args)
+
+def read_set_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetCmd:
+    destination_int = next(arr)[1]
+    destination = symbol_ids.get(destination_int)
+    assert isinstance(destination, Var) or isinstance(destination, int)
+    
+    if options.is_const:
+        value_int = next(arr)[1]
+        value = symbol_ids.get(value_int)
+        assert isinstance(value, Var) or isinstance(value, int)
+        if value == 0x40:
+            value = Expr()
+    else:
+        value = read_expr(None, arr, symbol_ids)
+    
+    return SetCmd(options.is_const, destination, value)
+
+def read_if_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfCmd:
+    assert not options.is_const
+    
+    condition = read_expr(None, arr, symbol_ids)
+    unused1 = next(arr)[1]
+    jump_to = next(arr)[1]
+    unused2 = next(arr)[1]
+    
+    return IfCmd(condition, unused1, jump_to, unused2)
+
+def read_else_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseCmd:
+    assert not options.is_const
+    
+    jump_to = next(arr)[1]
+    
+    return ElseCmd(jump_to)
+
+def read_endif_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndIfCmd:
+    assert not options.is_const
+    
+    return EndIfCmd()
+
+def read_wait_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCmd:
+    if options.is_const:
+        duration_int = next(arr)[1]
+        duration = symbol_ids.get(duration_int)
+        assert isinstance(duration, Var) or isinstance(duration, int)
+    else:
+        duration = read_expr(None, arr, symbol_ids)
+    
+    return WaitCmd(options.is_const, duration)
+
+def read_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WhileCmd:
+    if options.is_const:
+        value_int = next(arr)[1]
+        value = symbol_ids.get(value_int)
+        assert isinstance(value, Var) or isinstance(value, int)
+    else:
+        value = read_expr(None, arr, symbol_ids)
+    
+    jump_offset = next(arr)[1]
+    
+    return WhileCmd(options.is_const, value, jump_offset)
+
+def read_end_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndWhileCmd:
+    assert not options.is_const
+    
+    return EndWhileCmd()
+
+INSTRUCTIONS = {
+    0xc: read_call_cmd,
+    0x16: read_wait_cmd,
+    0x18: read_if_cmd,
+    0x26: read_else_cmd,
+    0x28: read_endif_cmd,
+    0x39: read_while_cmd,
+    0x3c: read_end_while_cmd,
+    0x3d: read_set_cmd,
+}
+
+def decode_hand_written(code: list[int], symbol_ids: SymbolIds) -> list:
+    # the loop analyze_function_def used to run
+    arr = enumerate(code)
+    instructions = []
+    
+    for i, value in arr:
+        options = ReadCmdOptions(value & 0xfffffeff, value & 0x100 != 0, i)
+        instructions.append(INSTRUCTIONS[options.opcode](arr, symbol_ids, options))
+    
+    return instructions
+
+def decode_generated(code: list[int], symbol_ids: SymbolIds) -> list:
+    arr = enumerate(code)
+    decoders = cmds.DECODERS
+    instructions = []
+    
+    for i, value in arr:
+        instructions.append(decoders[value](arr, symbol_ids, i))
+    
+    return instructions
+
+def make_code(blocks: int, symbol_ids: SymbolIds) -> list[int]:
+    """Code looking roughly like that of a real script: mostly Sets and Calls, some Ifs and loops."""
+    temps = [Var(None, None, VarCategory.TempVar, 0x50 + i, 1, 0, 0) for i in range(16)]
+    consts = [Var(None, None, VarCategory.Const, 0x1000 + i, 1, 0, i) for i in range(16)]
+    imports = [ScriptImport(f"import_{i}", 0, ImportType.Func, 0x2000 + i) for i in range(16)]
+    
+    for symbol in temps + consts + imports:
+        symbol_ids.add(symbol)
+    
+    plus, equals = EXPR_SYMBOLS[0x53], EXPR_SYMBOLS[0x4a]
+    out = []
+    
+    for i in range(blocks):
+        a, b, c = temps[i % 16], temps[(i + 5) % 16], consts[i % 16]
+        
+        for inst in [
+            SetCmd(False, a, Expr([b, plus, c])),
+            SetCmd(True, b, c),
+            CallCmd(False, imports[i % 16], [Expr([a]), Expr([b, plus, c]), Expr([c])]),
+            CallCmd(True, imports[(i + 1) % 16], [a, c]),
+            IfCmd(Expr([a, equals, c]), 0, 0, 0),
+            WaitCmd(False, Expr([c])),
+            ElseCmd(0),
+            WhileCmd(False, Expr([b]), 0),
+            SetCmd(False, b, Expr([b, plus, c])),
+            EndWhileCmd(),
+            EndIfCmd(),
+        ]:
+            write_cmd(inst, out)
+    
+    return out
+
+def best_of(function, code: list[int], symbol_ids: SymbolIds, repeat: int = 9) -> float:
+    times = []
+    
+    for _ in range(repeat):
+        start = perf_counter()
+        function(code, symbol_ids)
+        times.append(perf_counter() - start)
+    
+    return min(times)
+
+def main():
+    symbol_ids = SymbolIds()
+    code = make_code(20000, symbol_ids)
+    count = len(decode_generated(code, symbol_ids))
+    
+    assert decode_hand_written(code, symbol_ids) == decode_generated(code, symbol_ids)
+    
+    print(f"{count} instructions, {len(code)} words")
+    print(f"{'decoders':>14} {'ms':>8} {'instructions/s':>16}")
+    
+    for name, function in [('hand-written', decode_hand_written), ('generated', decode_generated)]:
+        time = best_of(function, code, symbol_ids)
+        print(f"{name:>14} {time * 1e3:>8.1f} {count / time:>16,.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Measures how much memory the decoded model of a synthetic corpus takes, for keeping many scripts decoded at once.
+
+    python -m benchmarks.memory --scripts 20 --functions 300
+
+The scripts are generated and read into their sections first, so only what read_script builds from them gets counted.
+"""
+from argparse import ArgumentParser
+from array import array
+from collections import Counter
+import gc
+import sys
+from time import perf_counter
+import tracemalloc
+
+import main # makes sure the circular imports between the modules resolve
+from benchmarks.corpus import CorpusOptions, generate
+from container import read_ksm_container
+from script import Script, read_script
+
+def model_objects(scripts: list[Script]) -> tuple[Counter[type], dict[type, object]]:
+    """How many of each type of object the scripts are made of, counting shared objects once, and one object of each type."""
+    seen: set[int] = set()
+    counts: Counter[type] = Counter()
+    examples: dict[type, object] = {}
+    pending: list = [scripts]
+    
+    while len(pending) > 0:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        
+        seen.add(id(obj))
+        counts[type(obj)] += 1
+        examples.setdefault(type(obj), obj)
+        pending.extend(referent for referent in gc.get_referents(obj) if not isinstance(referent, type))
+    
+    return counts, examples
+
+def instance_size(obj) -> int:
+    """The size of an object, with the dict its attributes are kept in if it has one."""
+    size = sys.getsizeof(obj)
+    
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    
+    return size
+
+def main():
+    parser = ArgumentParser(description="Measures the memory taken by decoded synthetic scripts")
+    parser.add_argument('--scripts', type=int, default=20)
+    parser.add_argument('--functions', type=int, default=300)
+    parser.add_argument('--types', type=int, default=12, help="how many of the most common types to list")
+    args = parser.parse_args()
+    
+    sections = [read_ksm_container(generate(CorpusOptions(functions=args.functions, seed=i))) for i in range(args.scripts)]
+    
+    gc.collect()
+    tracemalloc.start()
+    start = perf_counter()
+    
+    scripts = [read_script(script_sections) for script_sections in sections]
+    
+    elapsed = perf_counter() - start
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    instructions = sum(len(fn.instructions or []) for script in scripts for fn in script.definitions)
+    print(f"{args.scripts} scripts, {instructions} instructions decoded in {elapsed:.2f}s")
+    print(f"{allocated / 2**20:.1f} MiB, {allocated / instructions:.0f} bytes per instruction")
+    
+    counts, examples = model_objects(scripts)
+    print(f"\n{'type':<28} {'objects':>10} {'bytes each':>11}")
+    
+    for obj_type, count in counts.most_common(args.types):
+        # the size of lists and strings depends on what's in them
+        size = '' if obj_type in (list, str, array) else instance_size(examples[obj_type])
+        print(f"{obj_type.__name__:<28} {count:>10} {size:>11}")
+
+if __name__ == '__main__':
+    main()
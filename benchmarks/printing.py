@@ -0,0 +1,45 @@
+"""
+Times printing the bodies of decoded functions of a synthetic corpus, with and without cached_symbol_texts.
+
+    python -m benchmarks.printing --scripts 5 --functions 300
+
+The scripts are decoded first, so only instruction_lines and print_expr_or_var get timed.
+"""
+from argparse import ArgumentParser
+from contextlib import nullcontext
+from time import perf_counter
+
+import main # makes sure the circular imports between the modules resolve
+from benchmarks.corpus import CorpusOptions, generate
+from container import read_ksm_container
+from functions import FunctionDef, print_function_body
+from other_types import cached_symbol_texts
+from script import read_script
+
+def print_bodies(definitions: list[FunctionDef], cached: bool) -> float:
+    start = perf_counter()
+    
+    with cached_symbol_texts() if cached else nullcontext():
+        for fn in definitions:
+            print_function_body(fn)
+    
+    return perf_counter() - start
+
+def main():
+    parser = ArgumentParser(description="Times printing the bodies of decoded synthetic scripts")
+    parser.add_argument('--scripts', type=int, default=5)
+    parser.add_argument('--functions', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    scripts = [read_script(read_ksm_container(generate(CorpusOptions(functions=args.functions, seed=i)))) for i in range(args.scripts)]
+    definitions = [fn for script in scripts for fn in script.definitions if fn.instructions]
+    instructions = sum(len(fn.instructions) for fn in definitions)
+    
+    for cached in [False, True]:
+        seconds = min(print_bodies(definitions, cached) for _ in range(args.repeat))
+        print(f"{'cached' if cached else 'uncached':<9} {instructions} instructions in {seconds:.2f}s, "
+              f"{seconds / instructions * 1e6:.2f} µs per instruction")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares answering corpus-wide questions (how often each opcode is used, what every Set writes to)
+from the instruction columns against decoding every instruction into objects.
+    
+    python -m benchmarks.queries --scripts 5 --functions 300
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from time import perf_counter
+
+import main # makes sure the circular imports between the modules resolve
+import cmds
+import columns
+from benchmarks.corpus import CorpusOptions, generate
+from container import read_ksm_container
+from functions import add_local_symbols, decode_function_def, nested_code_ranges, own_instructions
+from script import read_script
+from util import SymbolIds
+
+def with_objects(sections: list) -> tuple[Counter, int]:
+    opcodes: Counter = Counter()
+    destinations = 0
+    
+    for script_sections in sections:
+        symbol_ids = SymbolIds()
+        script = read_script(script_sections, symbol_ids, analyze=False)
+        
+        for fn, nested in zip(script.definitions, nested_code_ranges(script.definitions)):
+            offsets: list[int] = []
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                instructions, _, _ = decode_function_def(fn, symbol_ids, offsets)
+            
+            for n in own_instructions(offsets, nested):
+                inst = instructions[n]
+                opcodes[type(inst)] += 1
+                if type(inst) is cmds.SetCmd:
+                    destinations += 1
+    
+    return opcodes, destinations
+
+def with_columns(sections: list) -> tuple[Counter, int]:
+    opcodes: Counter = Counter()
+    destinations = 0
+    
+    for script_sections in sections:
+        symbol_ids = SymbolIds()
+        table = columns.InstructionColumns.from_script(read_script(script_sections, symbol_ids, analyze=False), symbol_ids)
+        
+        opcodes.update(table.opcode_histogram())
+        destinations += len(table.operand_words(cmds.SetCmd, 'destination'))
+    
+    return opcodes, destinations
+
+def main():
+    parser = ArgumentParser(description="Compares corpus queries on instruction columns against decoded instructions")
+    parser.add_argument('--scripts', type=int, default=5)
+    parser.add_argument('--functions', type=int, default=300)
+    args = parser.parse_args()
+    
+    sections = [read_ksm_container(generate(CorpusOptions(functions=args.functions, seed=i))) for i in range(args.scripts)]
+    
+    start = perf_counter()
+    object_opcodes, object_destinations = with_objects(sections)
+    objects = perf_counter() - start
+    
+    start = perf_counter()
+    column_opcodes, column_destinations = with_columns(sections)
+    elapsed = perf_counter() - start
+    
+    assert sum(object_opcodes.values()) == sum(column_opcodes.values()), "The instruction counts disagree"
+    assert object_destinations == column_destinations, "The Set counts disagree"
+    
+    print(f"{sum(column_opcodes.values())} instructions, {column_destinations} Sets, NumPy {'on' if columns.numpy is not None else 'off'}")
+    print(f"objects {objects * 1e3:>8.0f} ms")
+    print(f"columns {elapsed * 1e3:>8.0f} ms")
+
+if __name__ == '__main__':
+    main()
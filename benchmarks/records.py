@@ -0,0 +1,113 @@
+"""
+Compares decoding import and label records through their RecordLayout against reading them word by word.
+
+The word by word readers are what read_function_imports and read_label used to do.
+"""
+from array import array
+from time import perf_counter
+
+import main # makes sure the circular imports between the modules resolve
+from other_types import IMPORT_RECORD, LABEL_RECORD, ImportType, Label, ScriptImport, read_function_imports, read_labels, write_import
+from util import RecordReader, StringTable, words, write_string
+
+def read_imports_per_word(section: bytes) -> list[ScriptImport]:
+    arr = enumerate(words(section))
+    strings = StringTable(section)
+    
+    count = next(arr)[1]
+    imports = []
+    
+    for i, value in arr:
+        field_0x4 = next(arr)[1] & 0xFFFF
+        type = next(arr)[1]
+        next(arr)
+        
+        id = next(arr)[1]
+        next(arr)
+        next(arr)
+        
+        if value == 0xFFFFFFFF:
+            name = strings.get(i + 8)
+            
+            for _ in range(next(arr)[1]):
+                next(arr)
+        else:
+            name = None
+        
+        imports.append(ScriptImport(name, field_0x4, ImportType(type), id))
+    
+    assert len(imports) == count
+    return imports
+
+def read_labels_per_word(section: bytes) -> list[Label]:
+    arr = enumerate(words(section))
+    strings = StringTable(section)
+    labels = []
+    
+    for _ in range(next(arr)[1]):
+        offset, value = next(arr)
+        id = next(arr)[1]
+        code_offset = next(arr)[1]
+        
+        if value == 0xFFFFFFFF:
+            name = strings.get(offset + 4)
+            
+            for _ in range(next(arr)[1]):
+                next(arr)
+        else:
+            name = None
+        
+        labels.append(Label(name, None, id, code_offset))
+    
+    return labels
+
+def read_labels_by_layout(section: bytes):
+    reader = RecordReader(section)
+    return read_labels(reader, reader.word())
+
+def make_import_section(count: int, named_every: int) -> bytes:
+    out = array('I', [count])
+    
+    for i in range(count):
+        name = f"import_{i}" if i % named_every == 0 else None
+        out.extend(write_import(ScriptImport(name, 1, ImportType.Func, i)))
+    
+    return out.tobytes()
+
+def make_label_section(count: int, named_every: int) -> bytes:
+    out = array('I', [count])
+    
+    for i in range(count):
+        if i % named_every == 0:
+            out.extend([0xFFFFFFFF, i, i * 4])
+            out.extend(write_string(f"label_{i}"))
+        else:
+            out.extend([0, i, i * 4])
+    
+    return out.tobytes()
+
+def best_of(function, section: bytes, repeat: int = 9) -> float:
+    times = []
+    
+    for _ in range(repeat):
+        start = perf_counter()
+        function(section)
+        times.append(perf_counter() - start)
+    
+    return min(times)
+
+def main():
+    count = 50000
+    print(f"{count} records, {IMPORT_RECORD.size} words per import, {LABEL_RECORD.size} words per label")
+    print(f"{'section':>8} {'named':>8} {'per word ms':>12} {'layout ms':>10}")
+    
+    for named_every in [1, 10, 1000]:
+        section = make_import_section(count, named_every)
+        print(f"{'imports':>8} {f'1/{named_every}':>8} {best_of(read_imports_per_word, section) * 1e3:>12.1f} {best_of(read_function_imports, section) * 1e3:>10.1f}")
+    
+    for named_every in [1, 10, 1000]:
+        section = make_label_section(count, named_every)
+        print(f"{'labels':>8} {f'1/{named_every}':>8} {best_of(read_labels_per_word, section) * 1e3:>12.1f} {best_of(read_labels_by_layout, section) * 1e3:>10.1f}")
+
+if __name__ == '__main__':
+    main()
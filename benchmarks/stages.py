@@ -0,0 +1,144 @@
+"""
+Times every stage of converting a script both ways, on a script made by benchmarks.corpus.
+
+    python -m benchmarks.stages --functions 500 --json results.json
+
+Each stage runs --repeat times on fresh input (preparing it isn't timed), the fastest run is what's shown.
+The JSON file also has every run, the corpus options and the commit, so results can be compared between commits.
+"""
+from argparse import ArgumentParser
+from dataclasses import asdict
+import json
+import os
+import platform
+import subprocess
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import yaml
+
+import main # makes sure the circular imports between the modules resolve
+from assembler import assemble_script
+from benchmarks.corpus import CorpusOptions, generate
+from container import read_ksm_container, write_ksm_container
+from functions import analyze_function_defs, print_function_definitions, print_function_imports
+from script import read_script, script_from_yaml, script_to_sections, write_script_yaml
+from tables import print_tables
+from util import SymbolIds
+from variables import print_variables
+
+def read(data: bytes):
+    symbol_ids = SymbolIds()
+    return read_script(read_ksm_container(data), symbol_ids, analyze=False), symbol_ids
+
+def analyzed(data: bytes):
+    script, symbol_ids = read(data)
+    analyze_function_defs(script.definitions, symbol_ids)
+    return script, symbol_ids
+
+def from_yaml(texts: tuple[str, str]):
+    symbol_ids = SymbolIds()
+    return script_from_yaml(yaml.safe_load(texts[0]), yaml.safe_load(texts[1]), symbol_ids), symbol_ids
+
+def assembled(texts: tuple[str, str]):
+    script, symbol_ids = from_yaml(texts)
+    assemble_script(script, symbol_ids)
+    return script
+
+# (name, what the stage gets from the container and the yaml, the stage itself)
+STAGES = [
+    ('read_container', lambda data, texts: data, read_ksm_container),
+    ('read_script', lambda data, texts: read_ksm_container(data),
+        lambda sections: read_script(sections, SymbolIds(), analyze=False)),
+    ('print_variables', lambda data, texts: read(data)[0],
+        lambda script: ''.join(print_variables(script.static_variables, script.constants, script.global_variables))),
+    ('print_function_imports', lambda data, texts: read(data)[0], lambda script: ''.join(print_function_imports(script.imports))),
+    ('print_tables', lambda data, texts: read(data)[0], lambda script: ''.join(print_tables(script.tables))),
+    ('analyze_function_def', lambda data, texts: read(data),
+        lambda decoded: analyze_function_defs(decoded[0].definitions, decoded[1])),
+    ('print_function_def', lambda data, texts: analyzed(data),
+        lambda decoded: ''.join(print_function_definitions(decoded[0].definitions, decoded[1]))),
+    ('yaml_load', lambda data, texts: texts, lambda texts: (yaml.safe_load(texts[0]), yaml.safe_load(texts[1]))),
+    ('script_from_yaml', lambda data, texts: (yaml.safe_load(texts[0]), yaml.safe_load(texts[1])),
+        lambda loaded: script_from_yaml(loaded[0], loaded[1], SymbolIds())),
+    ('assemble_script', lambda data, texts: from_yaml(texts),
+        lambda parsed: assemble_script(parsed[0], parsed[1])),
+    ('write_container', lambda data, texts: assembled(texts),
+        lambda script: write_ksm_container(script_to_sections(script))),
+]
+
+def yaml_texts(data: bytes) -> tuple[str, str]:
+    """The yaml files the tool writes for the script, as (script, variables)."""
+    script, symbol_ids = read(data)
+    
+    with TemporaryDirectory() as directory:
+        out_filename = os.path.join(directory, 'script.bin.yaml')
+        var_filename = os.path.join(directory, 'script.bin.variables.yaml')
+        write_script_yaml(script, out_filename, var_filename, symbol_ids)
+        
+        with open(out_filename) as f, open(var_filename, encoding='utf-8') as var_f:
+            return f.read(), var_f.read()
+
+def current_commit() -> str | None:
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    except OSError:
+        return None
+    
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def run_stages(options: CorpusOptions, repeat: int, names: list[str] | None = None) -> dict:
+    data = generate(options)
+    texts = yaml_texts(data)
+    stages = {}
+    
+    for name, prepare, stage in STAGES:
+        if names is not None and name not in names:
+            continue
+        
+        times = []
+        for _ in range(repeat):
+            value = prepare(data, texts)
+            
+            start = perf_counter()
+            stage(value)
+            times.append(perf_counter() - start)
+        
+        stages[name] = {'best': min(times), 'mean': sum(times) / len(times), 'runs': times}
+    
+    return {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'corpus': asdict(options),
+        'container_bytes': len(data),
+        'yaml_bytes': len(texts[0]) + len(texts[1]),
+        'stages': stages,
+    }
+
+def main():
+    parser = ArgumentParser(description="Times each stage of converting a synthetic script")
+    parser.add_argument('--functions', type=int, default=CorpusOptions.functions)
+    parser.add_argument('--statements', type=int, default=CorpusOptions.statements, help="per function")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--stage', action='append', dest='stages', choices=[name for name, _, _ in STAGES],
+                        help="only run this stage (can be given more than once)")
+    parser.add_argument('--json', metavar='FILE', help="also write the results to FILE")
+    
+    args = parser.parse_args()
+    options = CorpusOptions(functions=args.functions, statements=args.statements, seed=args.seed)
+    results = run_stages(options, args.repeat, args.stages)
+    
+    print(f"{results['container_bytes'] / 1024:.0f} KiB script, {results['yaml_bytes'] / 1024:.0f} KiB yaml")
+    print(f"{'stage':>24} {'best ms':>10} {'mean ms':>10}")
+    
+    for name, times in results['stages'].items():
+        print(f"{name:>24} {times['best'] * 1e3:>10.2f} {times['mean'] * 1e3:>10.2f}")
+    
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
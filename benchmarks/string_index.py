@@ -0,0 +1,56 @@
+"""
+Shows that decoding the names of a section scales linearly with the section's size.
+
+The tail-slicing reader is what util.read_string used to do: copy the rest of
+the section for every name it decodes, which makes name-heavy sections quadratic.
+"""
+from array import array
+from time import perf_counter
+
+from util import RecordReader, StringTable, byte_view
+from variables import Var, VarCategory, read_variable, write_variable
+
+class TailSlicingStrings:
+    def __init__(self, section: bytes | memoryview):
+        self.section = bytes(byte_view(section))
+    
+    def get(self, offset_words: int) -> str:
+        buffer = self.section[offset_words * 4:]
+        bytelen = buffer.index(0)
+        return str(buffer[:bytelen], 'utf-8')
+
+def make_variable_section(count: int) -> bytes:
+    out = array('I', [count])
+    
+    for i in range(count):
+        out.extend(write_variable(Var(f"some_reasonably_long_variable_name_{i}", None, VarCategory.Global, i, 1, 0, 0)))
+    
+    return out.tobytes()
+
+def read_names(section: bytes, strings_type) -> list[str | None]:
+    reader = RecordReader(section)
+    reader.strings = strings_type(section)
+    count = reader.word()
+    
+    return [read_variable(reader, VarCategory.Global).name for _ in range(count)]
+
+def time_per_name(section: bytes, count: int, strings_type) -> float:
+    start = perf_counter()
+    names = read_names(section, strings_type)
+    elapsed = perf_counter() - start
+    
+    assert len(names) == count
+    return elapsed / count
+
+def main():
+    print(f"{'names':>8} {'section KiB':>12} {'StringTable us/name':>20} {'tail slicing us/name':>21}")
+    
+    for count in [1000, 2000, 4000, 8000, 16000]:
+        section = make_variable_section(count)
+        indexed = time_per_name(section, count, StringTable)
+        sliced = time_per_name(section, count, TailSlicingStrings)
+        
+        print(f"{count:>8} {len(section) / 1024:>12.0f} {indexed * 1e6:>20.2f} {sliced * 1e6:>21.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Compares util.SymbolIds against the layered implementation it replaced,
+going through the same motions as print_function_definitions does for every function:
+enter a scope with the function's locals, look up the ids in its code, push and pop a thread scope.
+"""
+from random import Random
+from time import perf_counter
+from typing import Any
+
+from util import SymbolIds
+
+class LayeredSymbolIds:
+    """The previous implementation, a dict per scope that gets copied for every function."""
+    layers: list[dict]
+    
+    def __init__(self, *, layers: list[dict] | None = None):
+        self.layers = layers if layers is not None else [{}]
+    
+    def get(self, id: int) -> Any:
+        for layer in reversed(self.layers):
+            if id in layer:
+                return layer[id]
+        
+        return id
+    
+    def add(self, value, *, id = None):
+        self.layers[-1][id if id is not None else value.id] = value
+    
+    def push(self):
+        self.layers.append({})
+    
+    def pop(self):
+        if len(self.layers) > 1:
+            self.layers.pop()
+    
+    def copy(self):
+        return LayeredSymbolIds(layers=[layer.copy() for layer in self.layers])
+
+class Symbol:
+    def __init__(self, id: int):
+        self.id = id
+
+def make_functions(global_count: int, function_count: int, seed: int = 0) -> list[tuple[list[Symbol], list[int]]]:
+    random = Random(seed)
+    functions = []
+    
+    for i in range(function_count):
+        locals = [Symbol(0x10000000 + i * 0x100 + j) for j in range(10)]
+        # mostly globals, some locals and a few words that aren't symbols at all
+        lookups = [random.randrange(global_count) for _ in range(150)]
+        lookups += [local.id for local in locals] * 4
+        lookups += [0x40, 0x11, 0x53] * 3
+        functions.append((locals, lookups))
+    
+    return functions
+
+def run_layered(global_count: int, functions) -> float:
+    symbol_ids = LayeredSymbolIds()
+    for id in range(global_count):
+        symbol_ids.add(Symbol(id))
+    
+    start = perf_counter()
+    
+    for locals, lookups in functions:
+        local_symbol_ids = symbol_ids.copy()
+        for local in locals:
+            local_symbol_ids.add(local)
+        
+        for id in lookups:
+            local_symbol_ids.get(id)
+        
+        local_symbol_ids.push()
+        local_symbol_ids.add(Symbol(0x10000103))
+        for id in lookups[:20]:
+            local_symbol_ids.get(id)
+        local_symbol_ids.pop()
+    
+    return perf_counter() - start
+
+def run_scoped(global_count: int, functions) -> float:
+    symbol_ids = SymbolIds()
+    for id in range(global_count):
+        symbol_ids.add(Symbol(id))
+    
+    start = perf_counter()
+    
+    for locals, lookups in functions:
+        with symbol_ids.scope():
+            for local in locals:
+                symbol_ids.add(local)
+            
+            for id in lookups:
+                symbol_ids.get(id)
+            
+            symbol_ids.push()
+            symbol_ids.add(Symbol(0x10000103))
+            for id in lookups[:20]:
+                symbol_ids.get(id)
+            symbol_ids.pop()
+    
+    return perf_counter() - start
+
+def main():
+    print(f"{'globals':>8} {'functions':>10} {'layered ms':>11} {'scoped ms':>10}")
+    
+    for global_count, function_count in [(1000, 100), (1000, 500), (5000, 500), (20000, 500), (20000, 2000)]:
+        functions = make_functions(global_count, function_count)
+        layered = min(run_layered(global_count, functions) for _ in range(3))
+        scoped = min(run_scoped(global_count, functions) for _ in range(3))
+        
+        print(f"{global_count:>8} {function_count:>10} {layered * 1e3:>11.1f} {scoped * 1e3:>10.1f}")
+
+if __name__ == '__main__':
+    main()
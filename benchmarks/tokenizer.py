@@ -0,0 +1,116 @@
+"""
+Compares the regex tokenizer of code_parser against the one it replaced, on expression lines of growing length.
+
+The old tokenizer below sliced the rest of the line off after every token, which made it quadratic in the length of the line.
+"""
+from time import perf_counter
+
+import main # makes sure the circular imports between the modules resolve
+from code_parser import TokenStream, is_identifier, tokenize
+
+OPERATORS = ['||', '&&', '<<', '>>', '==', '!=', '>=', '<=']
+
+def string_end(code: str) -> int:
+    quote = code[0]
+    i = 1
+    
+    while i < len(code) and code[i] != quote:
+        i += 2 if code[i] == '\\' else 1
+    
+    assert i < len(code), f"Unterminated string {code}"
+    return i + 1
+
+def number_end(code: str) -> int:
+    i = 1
+    is_hex = code[:2].lower() == '0x' or code[:3].lower() == '-0x'
+    
+    while i < len(code):
+        c = code[i]
+        
+        if is_identifier(c) or c == '.':
+            i += 1
+        elif c in '+-' and code[i - 1] in 'eE' and not is_hex:
+            i += 1
+        else:
+            break
+    
+    return i
+
+def tokenize_sliced(code: str) -> list[str]:
+    tokens: list[str] = []
+    
+    while len(code) > 0:
+        if code[0] == ' ':
+            code = code[1:]
+            continue
+        
+        if code[0] in '\'"':
+            token_end = string_end(code)
+        elif code[0].isdigit() or code[0] == '-' and code[1:2].isdigit():
+            token_end = number_end(code)
+        elif is_identifier(code[0]):
+            token_end = next((i + 1 for i, c in enumerate(code[1:]) if not is_identifier(c)), len(code))
+        elif code[:2] in OPERATORS:
+            token_end = 2
+        else:
+            token_end = 1
+        
+        token, code = code[:token_end], code[token_end:]
+        tokens.append(token)
+    
+    return tokens
+
+def expression_line(terms: int) -> str:
+    """A Set with a long expression, mixing the kinds of tokens an expression can have."""
+    parts = []
+    
+    for i in range(terms):
+        match i % 4:
+            case 0:
+                parts.append(f"Global:global_{i}")
+            case 1:
+                parts.append(f"{i}`")
+            case 2:
+                parts.append(f"( LocalVar:{i % 16} * -1.5e-05` )")
+            case 3:
+                parts.append(f"Call func_{i} ( TempVar:{i % 8:X}, 'text {i}' )")
+    
+    return f"Set Global:result ( {' + '.join(parts)} )"
+
+def consume(code: str) -> int:
+    tokens = TokenStream(code)
+    count = 0
+    
+    while not tokens.at_end():
+        tokens.advance()
+        count += 1
+    
+    return count
+
+def best_of(function, line: str, repeat: int = 5) -> float:
+    times = []
+    
+    for _ in range(repeat):
+        start = perf_counter()
+        function(line)
+        times.append(perf_counter() - start)
+    
+    return min(times)
+
+def main():
+    print(f"{'terms':>7} {'chars':>8} {'sliced ms':>10} {'regex ms':>10} {'stream ms':>10}")
+    
+    for terms in [10, 100, 1000, 10000]:
+        line = expression_line(terms)
+        
+        # the new tokens only differ in keeping references (Global:foo) and constants (5`) together
+        joined = ''.join(tokenize_sliced(line))
+        assert joined == ''.join(token.text for token in tokenize(line)), "The tokenizers disagree"
+        
+        sliced = best_of(tokenize_sliced, line)
+        regex = best_of(lambda line: list(tokenize(line)), line)
+        stream = best_of(consume, line)
+        print(f"{terms:>7} {len(line):>8} {sliced * 1e3:>10.2f} {regex * 1e3:>10.2f} {stream * 1e3:>10.2f}")
+
+if __name__ == '__main__':
+    main()
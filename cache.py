@@ -0,0 +1,125 @@
+from hashlib import sha256
+import os
+import shutil
+from tempfile import mkstemp
+from typing import Any, Callable
+
+# bump this whenever the generated output changes,
+# so entries written by older versions of the tool stop matching
+TOOL_VERSION = 4
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'scriptstuff')
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+class Cache:
+    """
+    Content-addressed on-disk file store.
+    
+    Entries are evicted least recently used first once the total size exceeds max_size.
+    Every access touches the entry's mtime, which is what the eviction order is based on,
+    so several processes can share one cache directory without any extra bookkeeping.
+    """
+    directory: str
+    max_size: int
+    
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stored_since_eviction = 0
+    
+    def key(self, data: bytes) -> str:
+        hash = sha256(f"scriptstuff {TOOL_VERSION}\0".encode())
+        hash.update(data)
+        return hash.hexdigest()
+    
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name[:2], name)
+    
+    def fetch(self, name: str, out_filename: str) -> bool:
+        path = self.path(name)
+        
+        try:
+            shutil.copyfile(path, out_filename)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        
+        return True
+    
+    def read(self, name: str) -> bytes | None:
+        path = self.path(name)
+        
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        
+        return data
+    
+    def store(self, name: str, in_filename: str):
+        self.put(name, lambda tmp_path: shutil.copyfile(in_filename, tmp_path))
+    
+    def write(self, name: str, data: bytes):
+        def write_data(tmp_path: str):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        
+        self.put(name, write_data)
+    
+    def put(self, name: str, write_entry: Callable[[str], Any]):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # write to a temporary file first so other processes never see a half-written entry
+        fd, tmp_path = mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        
+        try:
+            write_entry(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        
+        # scanning the whole cache is not free, so only do it once in a while
+        self.stored_since_eviction += os.path.getsize(path)
+        if self.stored_since_eviction > self.max_size // 16:
+            self.evict()
+    
+    def evict(self):
+        self.stored_since_eviction = 0
+        entries = []
+        
+        if not os.path.isdir(self.directory):
+            return
+        
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            
+            for entry in os.scandir(subdir.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total_size = sum(size for _, size, _ in entries)
+        entries.sort()
+        
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass # another process got to it first
+            
+            total_size -= size
@@ -1,214 +1,82 @@
-from dataclasses import dataclass, replace
-from typing import Any
+from array import array
+from dataclasses import dataclass, field, fields, replace
+from enum import Enum, auto
+import json
+import re
+from typing import Any, Callable
 
 import functions
-from other_types import EXPR_SYMBOLS, Expr, Label, ScriptImport, read_expr
+from other_types import EXPR_SYMBOL_CODES, EXPR_SYMBOLS, Expr, ExprSymbol, Label, ScriptImport
 from tables import Table
-from code_parser import TokenStream, get_func_from_name, is_identifier, read_function_id
+from code_parser import (TokenStream, read_args, read_callee, read_const_or_expression, read_expression, read_function_id, read_label,
+                         read_list, read_unknown_arg, read_value)
 from util import SymbolIds
 from variables import Var, VarCategory
 
-@dataclass
-class ReadCmdOptions:
-    opcode: int
-    is_const: bool
-    cmd_offset: int | None = None
-
-@dataclass
+@dataclass(slots=True)
 class ReturnValCmd:
     is_const: bool
     value: Expr | Var | int
 
-def read_returnval_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnValCmd:
-    value_int = next(arr)[1]
-    if options.is_const:
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-        if value == 0x40:
-            value = Expr()
-    else:
-        value = read_expr(value_int, arr, symbol_ids)
-    
-    return ReturnValCmd(options.is_const, value)
-
-@dataclass 
+@dataclass(slots=True)
 class CallCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallCmd:
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
-    
-    args = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        if options.is_const:
-            var = symbol_ids.get(value)
-            args.append(var)
-        else:
-            args.append(read_expr(value, arr, symbol_ids))
-    
-    return CallCmd(options.is_const, func, args)
-
-@dataclass
+@dataclass(slots=True)
 class CallAsThreadCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_as_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsThreadCmd:
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
-    
-    args = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        if options.is_const:
-            var = symbol_ids.get(value)
-            args.append(var)
-        else:
-            args.append(read_expr(value, arr, symbol_ids))
-    
-    return CallAsThreadCmd(options.is_const, func, args)
-
 # Same as CallAsThread but sets the original thread as the new thread's parent
 # This might mean that the parent thread waits for the child to be done before it continues
 # TODO: But idk if that's true
-@dataclass
+@dataclass(slots=True)
 class CallAsChildThreadCmd:
     is_const: bool
     func: 'ScriptImport | functions.FunctionDef | int'
     args: list[Expr | Var | int]
 
-def read_call_as_child_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallAsChildThreadCmd:
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, ScriptImport) or isinstance(func, functions.FunctionDef) or isinstance(func, int)
-    
-    args = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        if options.is_const:
-            var = symbol_ids.get(value)
-            args.append(var)
-        else:
-            args.append(read_expr(value, arr, symbol_ids))
-    
-    return CallAsChildThreadCmd(options.is_const, func, args)
-
-@dataclass 
+@dataclass(slots=True)
 class CallVarCmd:
     is_const: bool
     func: Var | int
     args: list[Expr | Var | int]
 
-def read_call_var_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CallVarCmd:
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, Var) or isinstance(func, int)
-    
-    args = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        if options.is_const:
-            var = symbol_ids.get(value)
-            args.append(var)
-        else:
-            args.append(read_expr(value, arr, symbol_ids))
-    
-    return CallVarCmd(options.is_const, func, args)
-
-@dataclass
+@dataclass(slots=True)
 class SetCmd:
     is_const: bool
     destination: Var | int
     value: Expr | Var | int
 
-def read_set_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetCmd:
-    destination_int = next(arr)[1]
-    destination = symbol_ids.get(destination_int)
-    assert isinstance(destination, Var) or isinstance(destination, int)
-    
-    if options.is_const:
-        value_int = next(arr)[1]
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-        if value == 0x40:
-            value = Expr()
-    else:
-        value = read_expr(None, arr, symbol_ids)
-    
-    return SetCmd(options.is_const, destination, value)
-
-@dataclass
+@dataclass(slots=True)
 class ReadTableLengthCmd:
     is_const: bool
     arrayt: Table
 
-def read_read_table_length_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableLengthCmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    
-    return ReadTableLengthCmd(options.is_const, arrayt)
-
 # returns the value to FuncVar0 by default (but other variables can be set to whatever it returns directly)
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntryCmd:
     is_const: bool
     arrayt: Table
     index: Expr | Var | int
 
-def read_read_table_entry_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryCmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
-    index = symbol_ids.get(index_int)
-    
-    return ReadTableEntryCmd(options.is_const, arrayt, index)
-
 # this is just like ReadTableEntryCmd, 
 # but the variable that the value returned to is specified in the parameters of this instruction
 # instead of being determined by a SetCmd directly before it
 # so ReadTableEntryToVarCmd and ReadTableEntryCmd are used interchangably
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntryToVarCmd:
     is_const: bool
     arrayt: Table
     index: Expr | Var | int
     var: Var
 
-def read_read_table_entry_to_var_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntryToVarCmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
-    index = symbol_ids.get(index_int)    
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    assert isinstance(var, Var)
-    
-    return ReadTableEntryToVarCmd(options.is_const, arrayt, index, var)
-
 # read 2 entries starting from the specified index and save those values to 2 specified variables. 
 # Used to read 2d vector values without having to call ReadTableEntry 2 times.
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntriesVec2Cmd:
     is_const: bool
     arrayt: Table
@@ -216,27 +84,9 @@ class ReadTableEntriesVec2Cmd:
     x: Var
     y: Var
 
-def read_read_table_entries_vec2_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec2Cmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
-    index = symbol_ids.get(index_int)    
-    
-    x_int = next(arr)[1]
-    x = symbol_ids.get(x_int)
-    y_int = next(arr)[1]
-    y = symbol_ids.get(y_int)
-    
-    assert isinstance(x, Var)
-    assert isinstance(y, Var)
-    
-    return ReadTableEntriesVec2Cmd(options.is_const, arrayt, index, x, y)
-
 # read 3 entries starting from the specified index and save those values to 3 specified variables. 
 # Used to read 3d vector values without having to call ReadTableEntry 3 times.
-@dataclass
+@dataclass(slots=True)
 class ReadTableEntriesVec3Cmd:
     is_const: bool
     arrayt: Table
@@ -245,137 +95,44 @@ class ReadTableEntriesVec3Cmd:
     y: Var
     z: Var
 
-def read_read_table_entries_vec3_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReadTableEntriesVec3Cmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    index_int = next(arr)[1]
-    index = symbol_ids.get(index_int)    
-    
-    x_int = next(arr)[1]
-    x = symbol_ids.get(x_int)
-    y_int = next(arr)[1]
-    y = symbol_ids.get(y_int)
-    z_int = next(arr)[1]
-    z = symbol_ids.get(z_int)
-    
-    assert isinstance(x, Var)
-    assert isinstance(y, Var)
-    assert isinstance(z, Var)
-    
-    return ReadTableEntriesVec3Cmd(options.is_const, arrayt, index, x, y, z)
-
-@dataclass
+@dataclass(slots=True)
 class TableGetIndexCmd:
     is_const: bool
     arrayt: Table
     occurance: Expr | Var | int
     var: Var
 
-def read_table_get_index_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> TableGetIndexCmd:
-    assert not options.is_const
-    
-    arrayt_int = next(arr)[1]
-    arrayt = symbol_ids.get(arrayt_int)
-    occurance_int = next(arr)[1]
-    occurance = symbol_ids.get(occurance_int)    
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    assert isinstance(var, Var)
-    
-    return TableGetIndexCmd(options.is_const, arrayt, occurance, var)
-
-@dataclass
+@dataclass(slots=True)
 class ReturnCmd:
     pass
 
-def read_return_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ReturnCmd:
-    assert not options.is_const
-    
-    # A new layer gets pushed to in child threads (Thread and Thread2) for captured vars
-    # Return ends a thread so it gets popped again
-    symbol_ids.pop()
-    
-    return ReturnCmd()
-
-@dataclass
+@dataclass(slots=True)
 class GetArgsCmd:
     func: 'functions.FunctionDef'
     args: list[Var | int]
 
-def read_get_args_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgsCmd:
-    assert not options.is_const
-    
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, functions.FunctionDef)
-    
-    args = []
-    for _, value in arr:
-        if value == 0x8:
-            break
-        
-        var = symbol_ids.get(value)
-        assert isinstance(var, Var) or isinstance(var, int)
-        args.append(var)
-        
-    return GetArgsCmd(func, args)
-
-@dataclass
+@dataclass(slots=True)
 class IfCmd:
     condition: Expr
     unused1: int
     jump_to: int
     unused2: int
 
-def read_if_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfCmd:
-    assert not options.is_const
-    
-    condition = read_expr(None, arr, symbol_ids)
-    unused1 = next(arr)[1]
-    jump_to = next(arr)[1]
-    unused2 = next(arr)[1]
-    
-    return IfCmd(condition, unused1, jump_to, unused2)
-
 # these appear in Script/Map/MAC/mac_1_30.bin
 # TODO: Find other use cases to confirm whether these are what they appear to be.
-@dataclass
+@dataclass(slots=True)
 class IfEqualCmd:
     var1: Expr | Var | int
     var2: Expr | Var | int
     jump_to: int # TODO: ensure that jump_to always points to an Else, ElseIf or EndIf
 
-def read_ifequal_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfEqualCmd:
-    assert not options.is_const
-    
-    var1_int = next(arr)[1]
-    var1 = symbol_ids.get(var1_int)
-    var2_int = next(arr)[1]
-    var2 = symbol_ids.get(var2_int)
-    jump_to = next(arr)[1]
-    
-    return IfEqualCmd(var1, var2, jump_to)
-
-@dataclass
+@dataclass(slots=True)
 class IfNotEqualCmd:
     var1: Expr | Var | int
     var2: Expr | Var | int
     jump_to: int
 
-def read_ifnotequal_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> IfNotEqualCmd:
-    assert not options.is_const
-    
-    var1_int = next(arr)[1]
-    var1 = symbol_ids.get(var1_int)
-    var2_int = next(arr)[1]
-    var2 = symbol_ids.get(var2_int)
-    jump_to = next(arr)[1]
-    
-    return IfNotEqualCmd(var1, var2, jump_to)
-
-@dataclass
+@dataclass(slots=True)
 class ElseIfCmd:
     start_from: int
     unused1: int
@@ -384,100 +141,28 @@ class ElseIfCmd:
     jump_to: int
     unused3: int
 
-def read_else_if_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseIfCmd:
-    assert not options.is_const
-    
-    start_from = next(arr)[1]
-    unused1 = next(arr)[1]
-    condition = read_expr(None, arr, symbol_ids)
-    unused2 = next(arr)[1]
-    jump_to = next(arr)[1]
-    unused3 = next(arr)[1]
-    
-    return ElseIfCmd(start_from, unused1, condition, unused2, jump_to, unused3)
-
-@dataclass
+@dataclass(slots=True)
 class ElseCmd:
     jump_to: int
 
-def read_else_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ElseCmd:
-    assert not options.is_const
-    
-    jump_to = next(arr)[1]
-    
-    return ElseCmd(jump_to)
-
-@dataclass
+@dataclass(slots=True)
 class GotoLabelCmd:
     label: Label | int
 
-def read_goto_label_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GotoLabelCmd:
-    assert not options.is_const
-    
-    label_int = next(arr)[1]
-    label = symbol_ids.get(label_int)
-    assert isinstance(label, Label) or isinstance(label, int)
-    
-    return GotoLabelCmd(label)
-
-@dataclass
+@dataclass(slots=True)
 class NoopCmd:
     opcode: int
 
-def read_noop_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> NoopCmd:
-    assert not options.is_const
-    
-    return NoopCmd(options.opcode)
-
-@dataclass
+@dataclass(slots=True)
 class LabelCmd:
     offset: int
     label: Label | None
 
-def read_label_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LabelCmd:
-    assert not options.is_const
-    assert options.cmd_offset is not None
-    
-    return LabelCmd(options.cmd_offset, None)
-
-@dataclass
+@dataclass(slots=True)
 class EndIfCmd:
     pass
 
-def read_endif_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndIfCmd:
-    assert not options.is_const
-    
-    return EndIfCmd()
-
-@dataclass
-class ThreadCmd:
-    func: 'functions.FunctionDef | ScriptImport | int'
-    take_args: list[int]
-    give_args: list[Var | int]
-
-def read_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ThreadCmd:
-    assert not options.is_const
-    
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, functions.FunctionDef)
-    
-    take_args: list[int] = []
-    for _, value in arr:
-        if value == 0x8:
-            break
-        
-        take_args.append(value)
-    
-    give_args: list[Var | int] = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        var = symbol_ids.get(value)
-        assert isinstance(var, Var) or isinstance(var, int)
-        give_args.append(var)
-    
+def push_captures(symbol_ids: SymbolIds, take_args: list[int], give_args: list[Var | int], outer_temp_vars: bool):
     # Thread and Thread2 are always ended by a Return
     # this will make sure the thread body has access to the captured vars
     # and that they won't leak out of this thread
@@ -490,341 +175,133 @@ def read_thread_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmd
         
         copy = replace(give)
         copy.id = take
-        if copy.category == VarCategory.TempVar:
+        if outer_temp_vars and copy.category == VarCategory.TempVar:
             copy.category = VarCategory.OuterTempVar
         symbol_ids.add(copy)
-        
-    return ThreadCmd(func, take_args, give_args)
 
-@dataclass
-class Thread2Cmd:
+def enter_thread(cmd: 'ThreadCmd | Thread2Cmd', symbol_ids: SymbolIds):
+    push_captures(symbol_ids, cmd.take_args, cmd.give_args, isinstance(cmd, ThreadCmd))
+
+def leave_thread(cmd: 'ReturnCmd', symbol_ids: SymbolIds):
+    # Return ends a thread so the layer pushed for its captured vars gets popped again
+    symbol_ids.pop()
+
+@dataclass(slots=True)
+class ThreadCmd:
     func: 'functions.FunctionDef | ScriptImport | int'
     take_args: list[int]
     give_args: list[Var | int]
 
-def read_thread2_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> Thread2Cmd:
-    assert not options.is_const
-    
-    func_int = next(arr)[1]
-    func = symbol_ids.get(func_int)
-    assert isinstance(func, functions.FunctionDef)
-    
-    take_args: list[int] = []
-    for _, value in arr:
-        if value == 0x8:
-            break
-        
-        take_args.append(value)
-        
-    give_args: list[Var | int] = []
-    for _, value in arr:
-        if value == 0x11:
-            break
-        
-        var = symbol_ids.get(value)
-        assert isinstance(var, Var) or isinstance(var, int)
-        give_args.append(var)
-    
-    # Thread and Thread2 are always ended by a Return
-    # this will make sure the thread body has access to the captured vars
-    # and that they won't leak out of this thread
-    symbol_ids.push()
-    
-    assert len(give_args) == len(take_args)
-    for give, take in zip(give_args, take_args):
-        if not isinstance(give, Var):
-            continue
-        
-        copy = replace(give)
-        copy.id = take
-        symbol_ids.add(copy)
-    
-    return Thread2Cmd(func, take_args, give_args)
+@dataclass(slots=True)
+class Thread2Cmd:
+    func: 'functions.FunctionDef | ScriptImport | int'
+    take_args: list[int]
+    give_args: list[Var | int]
 
-@dataclass
+@dataclass(slots=True)
 class DeleteRuntimeCmd:
     is_const: bool
     var: Expr | Var | int
 
-def read_delete_runtime_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> DeleteRuntimeCmd:
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    if options.is_const:
-        assert isinstance(var, Var) or isinstance(var, int)
-    
-    return DeleteRuntimeCmd(options.is_const, var)
-
-@dataclass
+@dataclass(slots=True)
 class WaitCmd:
     is_const: bool
     duration: Expr | Var | int
 
-def read_wait_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCmd:
-    if options.is_const:
-        duration_int = next(arr)[1]
-        duration = symbol_ids.get(duration_int)
-        assert isinstance(duration, Var) or isinstance(duration, int)
-    else:
-        duration = read_expr(None, arr, symbol_ids)
-    
-    return WaitCmd(options.is_const, duration)
-
-@dataclass
+@dataclass(slots=True)
 class WaitMsCmd:
     is_const: bool
     duration: Expr | Var | int
 
-def read_wait_ms_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitMsCmd:
-    if options.is_const:
-        duration_int = next(arr)[1]
-        duration = symbol_ids.get(duration_int)
-        assert isinstance(duration, Var) or isinstance(duration, int)
-    else:
-        duration = read_expr(None, arr, symbol_ids)
-    
-    return WaitMsCmd(options.is_const, duration)
-
-@dataclass
+@dataclass(slots=True)
 class SwitchCmd:
     var: Var | int
     unused: int
     jump_offset: int
 
-def read_switch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SwitchCmd:
-    assert not options.is_const
-
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    assert isinstance(var, Var) or isinstance(var, int)
-    
-    unused = next(arr)[1]
-    jump_offset = next(arr)[1]
-    
-    return SwitchCmd(var, unused, jump_offset)
-
-@dataclass
+@dataclass(slots=True)
 class CaseEqCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_case_eq_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseEqCmd:
-    value_int = next(arr)[1]
-    if options.is_const:
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-    else:
-        value = symbol_ids.get(value_int)
-    
-    jump_offset = next(arr)[1]
-    
-    return CaseEqCmd(options.is_const, value, jump_offset)
-
 # A variant of the switch instruction that seems to also take two floating point values...
 # It being a check as to whether the match value is within this range is just a guess.
-@dataclass
+@dataclass(slots=True)
 class CaseRangeCmd:
     is_const: bool
     lower: Expr | Var | int
     upper: Expr | Var | int
     jump_offset: int
 
-def read_case_range_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseRangeCmd:
-    lower_int = next(arr)[1]
-    if options.is_const:
-        lower = symbol_ids.get(lower_int)
-        assert isinstance(lower, Var) or isinstance(lower, int)
-    else:
-        lower = symbol_ids.get(lower_int)
-        
-    upper_int = next(arr)[1]
-    if options.is_const:
-        upper = symbol_ids.get(upper_int)
-        assert isinstance(upper, Var) or isinstance(upper, int)
-    else:
-        upper = symbol_ids.get(upper_int)
-    
-    jump_offset = next(arr)[1]
-    
-    return CaseRangeCmd(options.is_const, lower, upper, jump_offset)
-
-@dataclass
+@dataclass(slots=True)
 class BreakSwitchCmd:
     pass
 
-def read_breakswitch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakSwitchCmd:
-    assert not options.is_const
-    
-    return BreakSwitchCmd()
-
-@dataclass
+@dataclass(slots=True)
 class EndSwitchCmd:
     pass
 
-def read_endswitch_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndSwitchCmd:
-    assert not options.is_const
-    
-    return EndSwitchCmd()
-
-@dataclass
+@dataclass(slots=True)
 class WhileCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WhileCmd:
-    if options.is_const:
-        value_int = next(arr)[1]
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-    else:
-        value = read_expr(None, arr, symbol_ids)
-    
-    jump_offset = next(arr)[1]
-    
-    return WhileCmd(options.is_const, value, jump_offset)
-
-@dataclass
+@dataclass(slots=True)
 class BreakCmd:
     pass
 
-def read_break_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> BreakCmd:
-    assert not options.is_const
-    
-    return BreakCmd()
-
-@dataclass
+@dataclass(slots=True)
 class EndWhileCmd:
     pass
 
-def read_end_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> EndWhileCmd:
-    assert not options.is_const
-    
-    return EndWhileCmd()
-
-@dataclass
+@dataclass(slots=True)
 class WaitCompletedCmd:
     is_const: bool
     runtime: Expr | Var | int
 
-def read_wait_completed_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitCompletedCmd:
-    if options.is_const:
-        runtime_int = next(arr)[1]
-        runtime = symbol_ids.get(runtime_int)
-        assert isinstance(runtime, Var) or isinstance(runtime, int)
-    else:
-        runtime = read_expr(None, arr, symbol_ids)
-    
-    return WaitCompletedCmd(options.is_const, runtime)
-
-@dataclass
+@dataclass(slots=True)
 class WaitWhileCmd:
     condition: Expr
     unused1: int
     unused2: int
 
-def read_wait_while_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> WaitWhileCmd:
-    assert not options.is_const
-    
-    condition = read_expr(None, arr, symbol_ids)
-    unused1 = next(arr)[1]
-    unused2 = next(arr)[1]
-    
-    return WaitWhileCmd(condition, unused1, unused2)
-
-@dataclass
+@dataclass(slots=True)
 class ToIntCmd:
     variable: Var | int
 
-def read_to_int_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToIntCmd:
-    assert not options.is_const
-    
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    
-    return ToIntCmd(var)
-
-@dataclass
+@dataclass(slots=True)
 class ToFloatCmd:
     variable: Var | int
 
-def read_to_float_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> ToFloatCmd:
-    assert not options.is_const
-    
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    
-    return ToFloatCmd(var)
-
-@dataclass
+@dataclass(slots=True)
 class LoadKSMCmd:
     variable: Var | int
 
-def read_load_ksm_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> LoadKSMCmd:
-    assert not options.is_const
-    
-    var_int = next(arr)[1]
-    var = symbol_ids.get(var_int)
-    
-    return LoadKSMCmd(var)
-
-@dataclass
+@dataclass(slots=True)
 class GetArgCountCmd:
     pass
 
-def read_get_arg_count_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> GetArgCountCmd:
-    assert not options.is_const
-    
-    return GetArgCountCmd()
-
-@dataclass
+@dataclass(slots=True)
 class CaseLteCmd:
     is_const: bool
     value: Expr | Var | int
     jump_offset: int
 
-def read_case_lte_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> CaseLteCmd:
-    
-    value_int = next(arr)[1]
-    if options.is_const:
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-    else:
-        value = symbol_ids.get(value_int)
-    
-    jump_offset = next(arr)[1]
-    
-    return CaseLteCmd(options.is_const, value, jump_offset)
-
-@dataclass
+@dataclass(slots=True)
 class SetKSMUnkCmd:
     is_const: bool
     runtime: Var | int
     value: Expr | Var | int
 
-def read_set_ksm_unk_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> SetKSMUnkCmd:
-    runtime_int = next(arr)[1]
-    runtime = symbol_ids.get(runtime_int)
-    assert isinstance(runtime, Var) or isinstance(runtime, int)
-    
-    if options.is_const:
-        value_int = next(arr)[1]
-        value = symbol_ids.get(value_int)
-        assert isinstance(value, Var) or isinstance(value, int)
-        if value == 0x40:
-            value = Expr()
-    else:
-        value = read_expr(None, arr, symbol_ids)
-    
-    return SetKSMUnkCmd(options.is_const, runtime, value)
-
-@dataclass
+@dataclass(slots=True)
 class UnknownCmd:
     opcode: int
     is_const: bool
     args: list[Expr | Var | int]
 
-def read_unknown_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCmdOptions) -> UnknownCmd:
+def read_unknown_cmd(arr: enumerate[int], symbol_ids: SymbolIds, opcode: int, is_const: bool) -> UnknownCmd:
     args = []
     for _, value in arr:
         if value == 0x11:
@@ -836,110 +313,549 @@ def read_unknown_cmd(arr: enumerate[int], symbol_ids: SymbolIds, options: ReadCm
             var = symbol_ids.get(value)
         args.append(var)
     
-    return UnknownCmd(options.opcode, options.is_const, args)
+    return UnknownCmd(opcode, is_const, args)
+
+class Operand(Enum):
+    """How an operand of an instruction is stored in the code, and how it's written in the yaml."""
+    # a single word naming a variable, table, label, function... (or just the word if nothing has that id)
+    Symbol = auto()
+    # the function that gets called, written with its bare name
+    Function = auto()
+    # written as fn:name or fn:self
+    FunctionRef = auto()
+    # the function generated for the body of a thread, written with the middle part of its name
+    ThreadFunction = auto()
+    # an expression (ended by 0x40), or a single symbol when the instruction is const
+    Value = auto()
+    # an expression, even when the instruction is const
+    Expression = auto()
+    # Values ended by 0x11
+    Args = auto()
+    # symbols ended by 0x8
+    Params = auto()
+    # ids ended by 0x8, not written in the yaml
+    Takes = auto()
+    # symbols ended by 0x11
+    Captures = auto()
+    # a word that isn't written in the yaml
+    Word = auto()
+    # the offset of another instruction, not written in the yaml either (see assembler.CodeWriter)
+    Jump = auto()
+    # where the instruction itself is, which isn't stored
+    Offset = auto()
+    # the opcode the instruction was read from, for instructions with several
+    Opcode = auto()
+
+# {name} is where an operand goes, {name:braced} an expression that's wrapped in ( ) and {*} where the * of const instructions goes
+SYNTAX_PART = re.compile(r"\{(\*|\w+)(:braced)?\}|([^\s{}]+)")
+
+@dataclass(slots=True)
+class Layout:
+    cmd: type
+    # how print_function_body writes the instruction
+    syntax: str
+    # in the order they're stored in
+    operands: list[tuple[str, Operand]]
+    # what the instruction does to the symbols in scope, when it's read or assembled
+    effect: Callable[[Any, SymbolIds], None] | None = None
+    
+    mnemonic: str = field(init=False)
+    has_star: bool = field(init=False)
+    has_const: bool = field(init=False)
+    # (operand name, ':braced' or '', literal token) for everything after the mnemonic
+    parts: list[tuple[str, str, str]] = field(init=False)
+    
+    def __post_init__(self):
+        parts = SYNTAX_PART.findall(self.syntax)
+        
+        self.mnemonic = parts[0][2]
+        self.has_star = len(parts) > 1 and parts[1][0] == '*'
+        self.has_const = any(f.name == 'is_const' for f in fields(self.cmd))
+        self.parts = parts[2:] if self.has_star else parts[1:]
 
-INSTRUCTIONS = {
+LAYOUTS = {
     # TODO: some of the noops return 1, some 3, might be worth looking into
-    0x2: read_noop_cmd,
-    0x3: read_returnval_cmd,
-    0x4: read_label_cmd,
-    0x5: read_get_args_cmd,
-    0x6: read_thread_cmd,
-    0x7: read_thread2_cmd,
-    0x9: read_return_cmd,
-    0xa: read_goto_label_cmd,
-    0xc: read_call_cmd,
-    0xd: read_call_as_thread_cmd,
-    0xe: read_call_as_child_thread_cmd,
-    0x12: read_delete_runtime_cmd,
-    0x16: read_wait_cmd,
-    0x17: read_wait_ms_cmd,
-    0x18: read_if_cmd,
+    # Noop, Label and Unk are written differently from the rest (see cmd_from_string)
+    0x2: Layout(NoopCmd, "Noop", [('opcode', Operand.Opcode)]),
+    0x3: Layout(ReturnValCmd, "ReturnVal{*} {value}", [('value', Operand.Value)]),
+    0x4: Layout(LabelCmd, "Label", [('offset', Operand.Offset)]),
+    0x5: Layout(GetArgsCmd, "GetArgs {func} {args}", [('func', Operand.FunctionRef), ('args', Operand.Params)]),
+    0x6: Layout(ThreadCmd, "Thread1 {func} Capture {give_args}",
+                [('func', Operand.ThreadFunction), ('take_args', Operand.Takes), ('give_args', Operand.Captures)], enter_thread),
+    0x7: Layout(Thread2Cmd, "Thread2 {func} Capture {give_args}",
+                [('func', Operand.ThreadFunction), ('take_args', Operand.Takes), ('give_args', Operand.Captures)], enter_thread),
+    0x9: Layout(ReturnCmd, "Return", [], leave_thread),
+    0xa: Layout(GotoLabelCmd, "GotoLabel {label}", [('label', Operand.Symbol)]),
+    0xc: Layout(CallCmd, "Call{*} {func} {args}", [('func', Operand.Function), ('args', Operand.Args)]),
+    0xd: Layout(CallAsThreadCmd, "CallAsThread{*} {func} {args}", [('func', Operand.Function), ('args', Operand.Args)]),
+    0xe: Layout(CallAsChildThreadCmd, "CallAsChildThread{*} {func} {args}",
+                [('func', Operand.Function), ('args', Operand.Args)]),
+    0x12: Layout(DeleteRuntimeCmd, "DeleteRuntime{*} {var}", [('var', Operand.Symbol)]),
+    0x16: Layout(WaitCmd, "Wait{*} {duration}", [('duration', Operand.Value)]),
+    0x17: Layout(WaitMsCmd, "WaitMs{*} {duration}", [('duration', Operand.Value)]),
+    0x18: Layout(IfCmd, "If {condition}",
+                 [('condition', Operand.Expression), ('unused1', Operand.Word), ('jump_to', Operand.Jump), ('unused2', Operand.Word)]),
     
     # Unusual If Instructions (experimental)
-    #0x19: read_ifequal_cmd,
-    #0x1d: read_ifnotequal_cmd,
+    #0x19: Layout(IfEqualCmd, "IfEqual ( {var1}, {var2} )", [('var1', Operand.Symbol), ('var2', Operand.Symbol), ('jump_to', Operand.Jump)]),
+    #0x1d: Layout(IfNotEqualCmd, "IfNotEqual ( {var1}, {var2} )", [('var1', Operand.Symbol), ('var2', Operand.Symbol), ('jump_to', Operand.Jump)]),
     
     # Switch, Case Instructions
-    0x26: read_else_cmd,
-    0x27: read_else_if_cmd,
-    0x28: read_endif_cmd,
-    0x29: read_switch_cmd,
-    0x2a: read_case_eq_cmd,
-    0x2f: read_case_lte_cmd,
-    0x30: read_case_range_cmd,
-    0x37: read_breakswitch_cmd,
-    0x38: read_endswitch_cmd,
+    0x26: Layout(ElseCmd, "Else", [('jump_to', Operand.Jump)]),
+    0x27: Layout(ElseIfCmd, "ElseIf {condition}",
+                 [('start_from', Operand.Jump), ('unused1', Operand.Word), ('condition', Operand.Expression),
+                  ('unused2', Operand.Word), ('jump_to', Operand.Jump), ('unused3', Operand.Word)]),
+    0x28: Layout(EndIfCmd, "EndIf", []),
+    0x29: Layout(SwitchCmd, "Switch {var}", [('var', Operand.Symbol), ('unused', Operand.Word), ('jump_offset', Operand.Jump)]),
+    0x2a: Layout(CaseEqCmd, "Case{*} == {value}", [('value', Operand.Symbol), ('jump_offset', Operand.Jump)]),
+    0x2f: Layout(CaseLteCmd, "Case{*} <= {value}", [('value', Operand.Symbol), ('jump_offset', Operand.Jump)]),
+    0x30: Layout(CaseRangeCmd, "CaseRange{*} ( {lower} to {upper} )",
+                 [('lower', Operand.Symbol), ('upper', Operand.Symbol), ('jump_offset', Operand.Jump)]),
+    0x37: Layout(BreakSwitchCmd, "BreakSwitch", []),
+    0x38: Layout(EndSwitchCmd, "EndSwitch", []),
     
     # While Instructions
-    0x39: read_while_cmd,
-    0x3a: read_break_cmd,
-    0x3c: read_end_while_cmd,
+    0x39: Layout(WhileCmd, "While{*} {value}", [('value', Operand.Value), ('jump_offset', Operand.Jump)]),
+    0x3a: Layout(BreakCmd, "Break", []),
+    0x3c: Layout(EndWhileCmd, "EndWhile", []),
     
-    0x3d: read_set_cmd,
+    0x3d: Layout(SetCmd, "Set{*} {destination} {value:braced}", [('destination', Operand.Symbol), ('value', Operand.Value)]),
     
     # Array Instructions 
-    0x67: read_read_table_length_cmd,
-    0x68: read_read_table_entry_cmd,
-    0x69: read_read_table_entry_to_var_cmd,
-    0x6a: read_read_table_entries_vec2_cmd,
-    0x6b: read_read_table_entries_vec3_cmd,
-    0x6d: read_table_get_index_cmd,
-    
-    0x75: read_load_ksm_cmd,
-    0x76: read_set_ksm_unk_cmd,
-    0x77: read_get_arg_count_cmd,
+    0x67: Layout(ReadTableLengthCmd, "ReadTableLength ( {arrayt} )", [('arrayt', Operand.Symbol)]),
+    0x68: Layout(ReadTableEntryCmd, "ReadTableEntry ( {arrayt}, {index} )",
+                 [('arrayt', Operand.Symbol), ('index', Operand.Symbol)]),
+    0x69: Layout(ReadTableEntryToVarCmd, "ReadTableEntryToVar ( {arrayt}, {index}, {var} )",
+                 [('arrayt', Operand.Symbol), ('index', Operand.Symbol), ('var', Operand.Symbol)]),
+    0x6a: Layout(ReadTableEntriesVec2Cmd, "ReadTableEntriesVec2 ( {arrayt}, {index}, {x}, {y} )",
+                 [('arrayt', Operand.Symbol), ('index', Operand.Symbol), ('x', Operand.Symbol), ('y', Operand.Symbol)]),
+    0x6b: Layout(ReadTableEntriesVec3Cmd, "ReadTableEntriesVec3 ( {arrayt}, {index}, {x}, {y}, {z} )",
+                 [('arrayt', Operand.Symbol), ('index', Operand.Symbol), ('x', Operand.Symbol), ('y', Operand.Symbol), ('z', Operand.Symbol)]),
+    0x6d: Layout(TableGetIndexCmd, "TableGetIndex ( {arrayt}, {occurance}, {var} )",
+                 [('arrayt', Operand.Symbol), ('occurance', Operand.Symbol), ('var', Operand.Symbol)]),
+    
+    0x75: Layout(LoadKSMCmd, "LoadKSM {variable}", [('variable', Operand.Symbol)]),
+    0x76: Layout(SetKSMUnkCmd, "SetKSMUnk{*} {runtime} {value:braced}", [('runtime', Operand.Symbol), ('value', Operand.Value)]),
+    0x77: Layout(GetArgCountCmd, "GetArgCount", []),
     
     # TODO: are these noops?
-    0x7c: read_noop_cmd,
-    0x7d: read_noop_cmd,
+    0x7c: Layout(NoopCmd, "Noop", [('opcode', Operand.Opcode)]),
+    0x7d: Layout(NoopCmd, "Noop", [('opcode', Operand.Opcode)]),
     
-    0x80: read_call_var_cmd,
+    0x80: Layout(CallVarCmd, "CallVar{*} {func} {args}", [('func', Operand.Symbol), ('args', Operand.Args)]),
     # 0x81: read_call_var_as_thread,
     # 0x82: read_call_var_as_child_thread,
-    0x85: read_to_int_cmd,
-    0x86: read_to_float_cmd,
-    0x89: read_wait_completed_cmd,
-    0x9f: read_wait_while_cmd,
+    0x85: Layout(ToIntCmd, "ToInt {variable}", [('variable', Operand.Symbol)]),
+    0x86: Layout(ToFloatCmd, "ToFloat {variable}", [('variable', Operand.Symbol)]),
+    0x89: Layout(WaitCompletedCmd, "WaitCompleted{*} {runtime}", [('runtime', Operand.Value)]),
+    0x9f: Layout(WaitWhileCmd, "WaitWhile {condition}",
+                 [('condition', Operand.Expression), ('unused1', Operand.Word), ('unused2', Operand.Word)]),
 }
 
-def cmd_from_string(code: str, current_func: functions.FunctionDef, symbol_ids: SymbolIds) -> Any:
-    tokens = TokenStream(code)
+# Noop is the only command with several opcodes, and it remembers which one it was read from
+CMD_OPCODES = {layout.cmd: opcode for opcode, layout in LAYOUTS.items()}
+
+LAYOUTS_BY_MNEMONIC: dict[str, list[Layout]] = {}
+for layout in LAYOUTS.values():
+    if layout not in LAYOUTS_BY_MNEMONIC.setdefault(layout.mnemonic, []):
+        LAYOUTS_BY_MNEMONIC[layout.mnemonic].append(layout)
+
+# decoding
+# every layout gets a decoder function generated from its operands (two for instructions with a const form),
+# so reading an instruction is a single call that reads the operands inline
+Decoder = Callable[[enumerate[int], SymbolIds, int], Any]
+
+def expr_source(target: str, indent: str) -> list[str]:
+    # the same as read_expr, inlined since nearly every instruction has an expression
+    # word holds the first word of the expression
+    return [
+        f"{indent}elements = []",
+        f"{indent}while word != 0x40:",
+        f"{indent}    if word == 0xc:",
+        f"{indent}        elements.append(decode_call(arr, symbol_ids, 0))",
+        f"{indent}    else:",
+        f"{indent}        elements.append(EXPR_SYMBOLS.get(word) or get(word, word))",
+        f"{indent}    word = next(arr)[1]",
+        f"{indent}{target} = Expr(elements)",
+    ]
+
+def decoder_source(name: str, layout: Layout, opcode: int, is_const: bool) -> str:
+    # symbol_ids.get without the call in between
+    lines = [f"def {name}(arr, symbol_ids, offset):", "    get = symbol_ids.symbols.get"]
+    
+    for field_name, kind in layout.operands:
+        match kind:
+            case Operand.Symbol | Operand.Function:
+                lines.append(f"    word = next(arr)[1]")
+                lines.append(f"    {field_name} = get(word, word)")
+            case Operand.FunctionRef | Operand.ThreadFunction:
+                # printing and the thread analysis rely on these being functions of the script
+                lines.append(f"    word = next(arr)[1]")
+                lines.append(f"    {field_name} = get(word, word)")
+                lines.append(f"    assert isinstance({field_name}, functions.FunctionDef)")
+            case Operand.Value if is_const:
+                # the const form of an empty expression is a lone 0x40
+                lines.append(f"    word = next(arr)[1]")
+                lines.append(f"    {field_name} = Expr() if word == 0x40 else get(word, word)")
+            case Operand.Value | Operand.Expression:
+                lines.append(f"    word = next(arr)[1]")
+                lines.extend(expr_source(field_name, "    "))
+            case Operand.Args if not is_const:
+                lines.append(f"    {field_name} = []")
+                lines.append(f"    for _, word in arr:")
+                lines.append(f"        if word == 0x11:")
+                lines.append(f"            break")
+                lines.extend(expr_source("arg", "        "))
+                lines.append(f"        {field_name}.append(arg)")
+            case Operand.Args | Operand.Params | Operand.Takes | Operand.Captures:
+                end = 0x8 if kind in (Operand.Params, Operand.Takes) else 0x11
+                item = "word" if kind == Operand.Takes else "get(word, word)"
+                
+                lines.append(f"    {field_name} = []")
+                lines.append(f"    for _, word in arr:")
+                lines.append(f"        if word == {end:#x}:")
+                lines.append(f"            break")
+                lines.append(f"        {field_name}.append({item})")
+            case Operand.Word | Operand.Jump:
+                lines.append(f"    {field_name} = next(arr)[1]")
+            case Operand.Offset:
+                lines.append(f"    {field_name} = offset")
+            case Operand.Opcode:
+                lines.append(f"    {field_name} = {opcode:#x}")
+    
+    operand_names = {name for name, _ in layout.operands}
+    args = []
     
-    match tokens.advance():
-        case 'GetArgs':
+    for cmd_field in fields(layout.cmd):
+        if cmd_field.name == 'is_const':
+            args.append(repr(is_const))
+        elif cmd_field.name in operand_names:
+            args.append(cmd_field.name)
+        else:
+            # filled in after reading, like the label of a LabelCmd
+            args.append("None")
+    
+    construct = f"{layout.cmd.__name__}({', '.join(args)})"
+    if layout.effect is not None:
+        lines.append(f"    cmd = {construct}")
+        lines.append(f"    {layout.effect.__name__}(cmd, symbol_ids)")
+        lines.append("    return cmd")
+    else:
+        lines.append(f"    return {construct}")
+    
+    return '\n'.join(lines) + '\n'
+
+def generate_decoders() -> dict[int, Decoder]:
+    """The decoders by the first word of the instruction, i.e. the opcode with 0x100 set for the const form."""
+    decoders = {}
+    namespace = globals()
+    
+    for opcode, layout in LAYOUTS.items():
+        for is_const in [False, True] if layout.has_star else [False]:
+            # e.g. decode_set_const, the module is where they end up so they can be found in tracebacks and profiles
+            name = 'decode_' + re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', layout.cmd.__name__[:-len('Cmd')]).lower()
+            if is_const:
+                name += '_const'
+            if name in namespace:
+                name += f"_{opcode:x}"
+            
+            exec(compile(decoder_source(name, layout, opcode, is_const), f"<{name}>", 'exec'), namespace)
+            decoders[opcode | 0x100 if is_const else opcode] = namespace[name]
+    
+    return decoders
+
+DECODERS = generate_decoders()
+
+# scanning
+# finding where instructions end without decoding them, by the words that end operands (0x40, 0x11, 0x8)
+# and the operands that are always a single word
+
+# how the words of each kind of operand are found, ints instead of an enum since they're compared for every operand
+WORD = 0
+NOTHING = 1
+EXPRESSION = 2
+# expressions ended by 0x11
+EXPRESSIONS = 3
+UNTIL_ARGS_END = 4
+UNTIL_PARAMS_END = 5
+
+def operand_step(kind: Operand, is_const: bool) -> int:
+    match kind:
+        case Operand.Value if is_const:
+            # a symbol, or the 0x40 of an empty expression
+            return WORD
+        case Operand.Value | Operand.Expression:
+            return EXPRESSION
+        case Operand.Args if not is_const:
+            return EXPRESSIONS
+        case Operand.Args | Operand.Captures:
+            return UNTIL_ARGS_END
+        case Operand.Params | Operand.Takes:
+            return UNTIL_PARAMS_END
+        case Operand.Offset | Operand.Opcode:
+            return NOTHING
+        case _:
+            return WORD
+
+# by the first word of the instruction like DECODERS, unknown instructions are words ended by 0x11
+OPERAND_STEPS: dict[int, tuple[int, ...]] = {
+    opcode | 0x100 if is_const else opcode: tuple(operand_step(kind, is_const) for _, kind in layout.operands)
+    for opcode, layout in LAYOUTS.items()
+    for is_const in ([False, True] if layout.has_star else [False])
+}
+UNKNOWN_STEPS = (UNTIL_ARGS_END,)
+
+# how many words the instructions that only have single word operands take, by their first word
+FIXED_LENGTHS = {first: 1 + steps.count(WORD) for first, steps in OPERAND_STEPS.items() if set(steps) <= {WORD, NOTHING}}
+
+def expression_end(words: array, i: int) -> int:
+    """Where the 0x40 that ends the expression starting at i is, raises IndexError if there's none."""
+    # expressions are mostly a few words, which a plain loop gets through faster than array.index
+    while True:
+        word = words[i]
+        if word == 0x40:
+            return i
+        
+        i = call_end(words, i + 1) if word == 0xc else i + 1
+
+def call_end(words: array, i: int) -> int:
+    """Just past the 0x11 that ends a call inside an expression, i being where the called function is."""
+    i += 1
+    while words[i] != 0x11:
+        i = expression_end(words, i) + 1
+    
+    return i + 1
+
+def list_end(words: array, i: int, end: int) -> int:
+    """Where the word end that ends a list starting at i is, or the end of the code if it ends first like the decoders allow."""
+    try:
+        return words.index(end, i)
+    except ValueError:
+        return len(words)
+
+def instruction_end(words: array, i: int) -> int:
+    """
+    Just past the instruction starting at i, words being the code of a function.
+    Raises IndexError when the code ends in the middle of the instruction.
+    """
+    first = words[i]
+    length = len(words)
+    fixed = FIXED_LENGTHS.get(first)
+    
+    if fixed is not None:
+        if i + fixed > length:
+            raise IndexError("Code ends in the middle of an instruction")
+        return i + fixed
+    
+    position = i + 1
+    
+    for step in OPERAND_STEPS.get(first, UNKNOWN_STEPS):
+        if step == WORD:
+            if position >= length:
+                raise IndexError("Code ends in the middle of an instruction")
+            position += 1
+        elif step == EXPRESSION:
+            position = expression_end(words, position) + 1
+        elif step == EXPRESSIONS:
+            while position < length and words[position] != 0x11:
+                position = expression_end(words, position) + 1
+            position += 1
+        elif step != NOTHING:
+            position = list_end(words, position, 0x11 if step == UNTIL_ARGS_END else 0x8) + 1
+    
+    return min(position, length)
+
+# encoding
+def symbol_word(value: Any) -> int:
+    match value:
+        case int():
+            return value & 0xFFFFFFFF
+        case Expr(elements):
+            # only empty expressions stand in for a symbol, as the 0x40 that ends them
+            assert len(elements) == 0, "Const instructions can't take an expression"
+            return 0x40
+        case ExprSymbol(label):
+            return EXPR_SYMBOL_CODES[label]
+        case _:
+            return value.id
+
+def write_expr(expr: Expr, out: array):
+    for element in expr.elements:
+        if isinstance(element, CallCmd):
+            out.append(0xc)
+            out.append(symbol_word(element.func))
+            for arg in element.args:
+                write_expr(arg, out)
+            out.append(0x11)
+        else:
+            out.append(symbol_word(element))
+    
+    out.append(0x40)
+
+def write_cmd(inst: Any, out: array) -> list[tuple[str, int]]:
+    """
+    Appends the words of an instruction to out.
+    Returns the operand name and position of each Jump, as they can only be filled in once the code they point to is written.
+    """
+    match inst:
+        case NoopCmd(opcode):
+            out.append(opcode)
+            return []
+        case UnknownCmd(opcode, is_const, args):
+            out.append(opcode | 0x100 if is_const else opcode)
+            out.extend(symbol_word(arg) for arg in args)
+            out.append(0x11)
+            return []
+    
+    opcode = CMD_OPCODES[type(inst)]
+    is_const = getattr(inst, 'is_const', False)
+    
+    out.append(opcode | 0x100 if is_const else opcode)
+    jumps = []
+    
+    for name, kind in LAYOUTS[opcode].operands:
+        value = getattr(inst, name)
+        
+        match kind:
+            case Operand.Symbol | Operand.Function | Operand.FunctionRef | Operand.ThreadFunction:
+                out.append(symbol_word(value))
+            case Operand.Value:
+                if is_const:
+                    out.append(symbol_word(value))
+                else:
+                    write_expr(value, out)
+            case Operand.Expression:
+                write_expr(value, out)
+            case Operand.Args:
+                for arg in value:
+                    if is_const:
+                        out.append(symbol_word(arg))
+                    else:
+                        write_expr(arg, out)
+                out.append(0x11)
+            case Operand.Params | Operand.Takes:
+                out.extend(symbol_word(x) for x in value)
+                out.append(0x8)
+            case Operand.Captures:
+                out.extend(symbol_word(x) for x in value)
+                out.append(0x11)
+            case Operand.Word:
+                out.append(value & 0xFFFFFFFF)
+            case Operand.Jump:
+                jumps.append((name, len(out)))
+                out.append(value & 0xFFFFFFFF)
+            case Operand.Offset | Operand.Opcode:
+                pass
+    
+    return jumps
+
+# parsing
+ThreadClaimer = Callable[[str | None], 'functions.FunctionDef']
+
+def read_operand(tokens: TokenStream, kind: Operand, braced: bool, is_const: bool, current_func: functions.FunctionDef,
+                 symbol_ids: SymbolIds, claim_thread: ThreadClaimer | None) -> Any:
+    match kind:
+        case Operand.Symbol:
+            return read_value(tokens, current_func, symbol_ids)
+        case Operand.Function:
+            return read_callee(tokens, symbol_ids)
+        case Operand.FunctionRef:
             func = read_function_id(tokens, current_func, symbol_ids)
             assert func is not None, "Expected reference to function"
             assert isinstance(func, functions.FunctionDef), "Expected reference to locally defined function"
+            return func
+        case Operand.ThreadFunction:
+            token = tokens.peek()
+            if token[:1] != '"' and token != 'null':
+                return read_value(tokens, current_func, symbol_ids)
             
-            tokens.expect('(')
-            
-            while tokens.peek() != ')':
-                raise NotImplementedError("TODO")
-            
-            result = GetArgsCmd(func, [])
-        case 'Return':
-            result = ReturnCmd()
-        case 'Call':
-            if tokens.peek() == '*':
-                is_const = True
-                tokens.advance()
-            else:
-                is_const = False
+            tokens.advance()
+            assert claim_thread is not None, "Threads can only be read as part of a whole script"
+            return claim_thread(json.loads(token))
+        case Operand.Value:
+            if braced and not is_const:
+                tokens.expect('(')
+                value = read_expression(tokens, current_func, symbol_ids)
+                tokens.expect(')')
+                return value
             
-            func_name = tokens.advance()
-            assert is_identifier(func_name), "Expected function name"
-            func = get_func_from_name(func_name, symbol_ids)
-            
-            tokens.expect('(')
-            
-            while tokens.peek() != ')':
-                # TODO
-                tokens.advance()
-            
-            result = CallCmd(is_const, func, [])
+            return read_const_or_expression(tokens, is_const, current_func, symbol_ids)
+        case Operand.Expression:
+            return read_expression(tokens, current_func, symbol_ids)
+        case Operand.Args:
+            return read_args(tokens, is_const, current_func, symbol_ids)
+        case Operand.Params | Operand.Captures:
+            return read_list(tokens, lambda tokens: read_value(tokens, current_func, symbol_ids))
+        case _:
+            raise AssertionError(f"{kind.name} operands aren't written out")
+
+def read_layout_cmd(tokens: TokenStream, mnemonic: str, current_func: functions.FunctionDef,
+                    symbol_ids: SymbolIds, claim_thread: ThreadClaimer | None) -> Any:
+    layouts = LAYOUTS_BY_MNEMONIC.get(mnemonic)
+    assert layouts is not None, f"Unknown instruction {mnemonic}"
+    
+    is_const = tokens.peek() == '*' and layouts[0].has_star
+    if is_const:
+        tokens.advance()
+    
+    # instructions sharing a mnemonic (Case == and Case <=) differ in the token after it
+    layout = next((layout for layout in layouts if len(layouts) == 1 or layout.parts[0][2] == tokens.peek()), None)
+    assert layout is not None, f"Unknown form of {mnemonic} instruction"
+    
+    kinds = dict(layout.operands)
+    values = {}
+    
+    for name, braced, literal in layout.parts:
+        if literal:
+            tokens.expect(literal)
+        else:
+            values[name] = read_operand(tokens, kinds[name], braced != '', is_const, current_func, symbol_ids, claim_thread)
+    
+    for name, kind in layout.operands:
+        if name in values:
+            continue
         
-        case default:
-            raise NotImplementedError(f"Instruction {default} not supported yet")
+        if kind == Operand.Takes:
+            # the ids captured variables get inside the thread aren't written out,
+            # so the thread gets them under the same ids as outside
+            captures = next(values[name] for name, kind in layout.operands if kind == Operand.Captures)
+            values[name] = [symbol_word(x) for x in captures]
+        else:
+            values[name] = 0
+    
+    if layout.has_const:
+        values['is_const'] = is_const
+    
+    return layout.cmd(**values)
+
+def cmd_from_string(code: str, current_func: functions.FunctionDef, symbol_ids: SymbolIds,
+                    claim_thread: ThreadClaimer | None = None) -> Any:
+    """
+    Reads an instruction the way print_function_body writes it, and updates symbol_ids like decoding it would.
+    claim_thread gets the name a Thread was written with and returns the function holding its body.
+    Jumps are left at 0, the assembler fills them in.
+    """
+    tokens = TokenStream(code)
+    mnemonic = tokens.advance()
+    
+    if mnemonic.startswith('Noop_'):
+        result = NoopCmd(int(mnemonic[len('Noop_'):], 16))
+    elif mnemonic.startswith('Unk_'):
+        is_const = tokens.peek() == '*'
+        if is_const:
+            tokens.advance()
+        
+        args = read_list(tokens, lambda tokens: read_unknown_arg(tokens, current_func, symbol_ids))
+        result = UnknownCmd(int(mnemonic[len('Unk_'):], 16), is_const, args)
+    elif mnemonic == 'Label':
+        result = LabelCmd(0, read_label(tokens, symbol_ids))
+    else:
+        result = read_layout_cmd(tokens, mnemonic, current_func, symbol_ids, claim_thread)
+    
+    assert tokens.at_end(), f"Unexpected '{tokens.peek()}' after {mnemonic} instruction"
+    
+    layout = LAYOUTS.get(CMD_OPCODES.get(type(result), -1))
+    if layout is not None and layout.effect is not None:
+        layout.effect(result, symbol_ids)
     
     return result
@@ -1,68 +1,294 @@
+from ast import literal_eval
+from dataclasses import dataclass
+from enum import Enum, auto
+import re
+from typing import Iterator
+
+import cmds
 import functions
-from other_types import ScriptImport
+from other_types import EXPR_SYMBOLS, Expr, ExprSymbol, Label, ScriptImport
+from tables import Table, TableDataType
 from util import SymbolIds
+from variables import VarCategory
 
 # tokenization
+class TokenKind(Enum):
+    Identifier = auto()
+    Number = auto()
+    String = auto()
+    # Category:name, fn:name, label:name or table:name
+    Reference = auto()
+    # a number constant written with a backtick, like 5`
+    Const = auto()
+    # operators, brackets, commas, *, ?...
+    Punctuation = auto()
+    # what's returned after the last token
+    End = auto()
+
+@dataclass
+class Token:
+    kind: TokenKind
+    text: str
+    # where the token starts in the line
+    position: int
+    # the two halves of a Reference, or the number of a Const
+    prefix: str = ''
+    name: str = ''
+
+# numbers can't be told apart from names by their first few characters alone, so hex comes first,
+# and a + or - only continues a decimal number right after its exponent's e (1e-05)
+NUMBER = r"-?0[xX][\w.]*|-?\d(?:[eE][+-]|[\w.])*"
+
+TOKEN = re.compile(rf"""\s*(?:
+    (?P<Reference>(?P<prefix>[A-Za-z_]\w*):(?P<name>{NUMBER}|\w+))
+    | (?P<Const>(?P<number>{NUMBER}))`
+    | (?P<Number>{NUMBER})
+    | (?P<String>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<unterminated>['"])
+    | (?P<Identifier>\w+)
+    | (?P<Punctuation>\|\||&&|<<|>>|==|!=|>=|<=|\S)
+)""", re.VERBOSE)
+
+# by the name of their group in TOKEN
+TOKEN_KINDS = {kind.name: kind for kind in TokenKind}
+
 def is_identifier(string: str) -> bool:
     return all(c == '_' or c.isalnum() for c in string)
 
-def tokenize(code: str) -> list[str]:
-    tokens: list[str] = []
-    
-    while len(code) > 0:
-        if code[0] == ' ':
-            code = code[1:]
-            continue
+def tokenize(code: str) -> Iterator[Token]:
+    """Splits a line into tokens in a single pass, ending with an End token."""
+    for match in TOKEN.finditer(code):
+        kind = match.lastgroup
         
-        if is_identifier(code[0]):
-            token_end = next((i + 1 for i, c in enumerate(code[1:]) if not is_identifier(c)), len(code))
+        if kind == 'Reference':
+            yield Token(TokenKind.Reference, match['Reference'], match.start(kind), match['prefix'], match['name'])
+        elif kind == 'Const':
+            yield Token(TokenKind.Const, match['Const'] + '`', match.start(kind), name=match['number'])
+        elif kind == 'unterminated':
+            raise AssertionError(f"Unterminated string {code[match.start(kind):]}")
         else:
-            token_end = 1
-        
-        token, code = code[:token_end], code[token_end:]
-        tokens.append(token)
+            yield Token(TOKEN_KINDS[kind], match[kind], match.start(kind))
     
-    return tokens
+    yield Token(TokenKind.End, '', len(code))
 
 class TokenStream:
+    """The tokens of a line, read one at a time as the parser asks for them."""
+    tokens: Iterator[Token]
+    token: Token
+    
     def __init__(self, code: str):
-        self.tokens = iter(tokenize(code))
-        self.current = ""
-        
-        self.advance()
+        self.tokens = tokenize(code)
+        self.token = next(self.tokens)
     
     def peek(self) -> str:
-        return self.current
+        return self.token.text
+    
+    def peek_token(self) -> Token:
+        return self.token
+    
+    def next_token(self) -> Token:
+        token = self.token
+        
+        if token.kind != TokenKind.End:
+            self.token = next(self.tokens)
+        
+        return token
     
     def advance(self) -> str:
-        current, self.current = self.current, next(self.tokens, "")
-        return current
+        return self.next_token().text
     
     def expect(self, token: str) -> str:
-        assert self.advance() == token
+        actual = self.next_token()
+        assert actual.text == token, f"Expected '{token}', got '{actual.text}' at column {actual.position + 1}"
         return token
+    
+    def at_end(self) -> bool:
+        return self.token.kind == TokenKind.End
 
 # parsing
+EXPR_SYMBOLS_BY_LABEL = {symbol.label: symbol for symbol in EXPR_SYMBOLS.values()}
+
 def get_func_from_name(name: str, symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport:
-    func = None
-    for value in symbol_ids.flat().values():
-        if isinstance(value, (functions.FunctionDef, ScriptImport)) and value.name == name:
-            func = value
+    func = symbol_ids.find('fn', name)
     
     assert func is not None, f"Could not find function with name {name}"
     return func
 
 def read_function_id(tokens: TokenStream, current_func: functions.FunctionDef, symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport | None:
-    if tokens.peek() != 'fn':
+    token = tokens.peek_token()
+    if token.kind != TokenKind.Reference or token.prefix != 'fn':
         return None
     
-    tokens.advance()
-    tokens.expect(':')
-    name = tokens.advance()
+    tokens.next_token()
+    assert is_identifier(token.name), "Function name (fn:...) has to be an alphanumeric identifier"
     
-    assert is_identifier(name), "Function name (fn:...) has to be an alphanumeric identifier"
-    
-    if name == 'self':
+    if token.name == 'self':
         return current_func
     
-    return get_func_from_name(name, symbol_ids)
+    return get_func_from_name(token.name, symbol_ids)
+
+def parse_number(token: str) -> int | float:
+    try:
+        return int(token, 0)
+    except ValueError:
+        return float(token)
+
+def read_value(tokens: TokenStream, current_func: functions.FunctionDef, symbol_ids: SymbolIds):
+    """
+    Reads a single symbol written the way print_expr_or_var writes it (Global:foo, 5`, 'text', fn:foo, ?0x1f, ...)
+    and returns what it refers to, or the id itself if it's not defined.
+    """
+    token = tokens.peek_token()
+    assert token.kind != TokenKind.End, "Expected a value"
+    
+    if token.kind == TokenKind.Reference and token.prefix == 'fn':
+        return read_function_id(tokens, current_func, symbol_ids)
+    
+    tokens.next_token()
+    
+    if token.text == '?':
+        return int(tokens.advance(), 16)
+    
+    if token.kind == TokenKind.String:
+        # unnamed string constant
+        value = literal_eval(token.text)
+        var = symbol_ids.find(VarCategory.Const, (str, value))
+        assert var is not None, f"There's no constant with the value {token.text}"
+        return var
+    
+    if token.kind == TokenKind.Const:
+        # unnamed number constant
+        value = parse_number(token.name)
+        var = symbol_ids.find(VarCategory.Const, (type(value), value))
+        assert var is not None, f"There's no constant with the value {token.text}"
+        return var
+    
+    assert token.kind == TokenKind.Reference, \
+        f"Expected a variable, constant or other symbol, got '{token.text}' at column {token.position + 1}"
+    
+    if token.prefix in ('label', 'table'):
+        kind = token.prefix
+    else:
+        assert token.prefix in VarCategory.__members__, f"Unknown kind of symbol '{token.prefix}'"
+        kind = VarCategory[token.prefix]
+    
+    symbol = symbol_ids.find(kind, token.name)
+    if symbol is not None:
+        return symbol
+    
+    # symbols without a name are written with their id
+    assert token.name.lower().startswith('0x'), f"{token.text} isn't defined"
+    return symbol_ids.get(int(token.name, 16))
+
+def read_expression(tokens: TokenStream, current_func: functions.FunctionDef, symbol_ids: SymbolIds) -> Expr:
+    """Reads the elements of an expression up to the end of the line, or a ',' or ')' that isn't part of it."""
+    elements = []
+    depth = 0
+    
+    while not tokens.at_end():
+        token = tokens.peek()
+        
+        if token == ',' and depth == 0:
+            break
+        if token == ')':
+            if depth == 0:
+                break
+            depth -= 1
+        elif token == '(':
+            depth += 1
+        
+        if token in EXPR_SYMBOLS_BY_LABEL:
+            tokens.advance()
+            elements.append(EXPR_SYMBOLS_BY_LABEL[token])
+        elif token == 'Call':
+            tokens.advance()
+            func = read_callee(tokens, symbol_ids)
+            elements.append(cmds.CallCmd(False, func, read_args(tokens, False, current_func, symbol_ids)))
+        else:
+            elements.append(read_value(tokens, current_func, symbol_ids))
+    
+    return Expr(elements)
+
+def read_const_or_expression(tokens: TokenStream, is_const: bool, current_func: functions.FunctionDef, symbol_ids: SymbolIds):
+    if not is_const:
+        return read_expression(tokens, current_func, symbol_ids)
+    
+    if tokens.at_end() or tokens.peek() in (',', ')'):
+        # the const form of an empty expression is a lone 0x40
+        return Expr()
+    
+    if tokens.peek() == '(':
+        tokens.advance()
+        tokens.expect(')')
+        return Expr()
+    
+    return read_value(tokens, current_func, symbol_ids)
+
+def read_list(tokens: TokenStream, read_item) -> list:
+    """Reads '( a, b, ... )'."""
+    tokens.expect('(')
+    items = []
+    
+    while tokens.peek() != ')':
+        items.append(read_item(tokens))
+        
+        if tokens.peek() != ')':
+            tokens.expect(',')
+    
+    tokens.expect(')')
+    return items
+
+def read_args(tokens: TokenStream, is_const: bool, current_func: functions.FunctionDef, symbol_ids: SymbolIds) -> list:
+    return read_list(tokens, lambda tokens: read_const_or_expression(tokens, is_const, current_func, symbol_ids))
+
+def read_callee(tokens: TokenStream, symbol_ids: SymbolIds) -> functions.FunctionDef | ScriptImport | int:
+    # calls write the bare name of the function, or its id if it's not defined
+    token = tokens.next_token()
+    
+    if token.kind == TokenKind.Number:
+        return symbol_ids.get(int(token.text))
+    
+    assert token.kind == TokenKind.Identifier, f"Expected function name, got '{token.text}' at column {token.position + 1}"
+    return get_func_from_name(token.text, symbol_ids)
+
+def read_unknown_arg(tokens: TokenStream, current_func: functions.FunctionDef, symbol_ids: SymbolIds) -> ExprSymbol | object:
+    if tokens.peek() in EXPR_SYMBOLS_BY_LABEL:
+        return EXPR_SYMBOLS_BY_LABEL[tokens.advance()]
+    
+    return read_value(tokens, current_func, symbol_ids)
+
+def read_label(tokens: TokenStream, symbol_ids: SymbolIds) -> Label | None:
+    # Label instructions write the bare name of their label
+    if tokens.peek() == '?':
+        # no label points at this one, what follows is just where it was
+        while not tokens.at_end():
+            tokens.advance()
+        
+        return None
+    
+    token = tokens.next_token()
+    
+    if token.kind == TokenKind.Reference and token.prefix == 'label':
+        # neither a name nor an alias, written with its id
+        label = symbol_ids.get(int(token.name, 16))
+    else:
+        label = symbol_ids.find('label', token.text)
+    
+    assert isinstance(label, Label), f"Label {token.text} isn't defined"
+    return label
+
+def parse_symbol(code: str, symbol_ids: SymbolIds):
+    """Reads a whole string holding a single symbol, as written by print_var in tables."""
+    tokens = TokenStream(code)
+    value = read_value(tokens, None, symbol_ids)
+    
+    assert tokens.at_end(), f"Expected a single symbol, got {code}"
+    return value
+
+def parse_table_values(table: Table, symbol_ids: SymbolIds):
+    """Looks up the symbols in a Var table read with table_from_yaml."""
+    if table.data_type != TableDataType.Var:
+        return
+    
+    # undefined ids get written as plain numbers
+    table.values = [parse_symbol(val, symbol_ids) if isinstance(val, str) else val for val in table.values]
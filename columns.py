@@ -0,0 +1,239 @@
+"""
+Struct-of-arrays form of the code of a script, for analysis over a whole corpus that doesn't need an object per instruction:
+    
+    import cmds, columns
+    
+    table = columns.file_columns('script.bin')
+    histogram = table.opcode_histogram()
+    destinations = table.operand_words(cmds.SetCmd, 'destination')
+
+Scanning the code only finds where every instruction and operand starts and ends, without looking anything up or creating objects.
+Instruction i has its opcode (without the const bit), flags and offset in the code section, and the operands
+operand_starts[i] up to operand_starts[i + 1], one for every operand of its layout, in the same order.
+Operand j is words[word_starts[j]:word_ends[j]], words being the code of all the functions one after the other.
+That's without whatever ends the operand (0x40, 0x11 or 0x8), so a symbol is the single word that's its id,
+and an expression every word of it including the calls in it.
+Unknown instructions have a single operand with all their words.
+The bodies of Threads that have a function record of their own (_function_N_M) are only scanned as part of that function,
+so every instruction is in the innermost function its code is in.
+
+The columns are arrays, and the queries use NumPy on them (without copying) when it's installed.
+Instruction objects are only made by instruction(), which decodes the function the instruction is in.
+"""
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import Any
+
+from cmds import (EXPRESSION, EXPRESSIONS, LAYOUTS, NOTHING, OPERAND_STEPS, UNKNOWN_STEPS, UNTIL_ARGS_END, WORD, expression_end,
+                  list_end)
+from container import read_input_file, read_ksm_container
+from functions import FunctionDef, add_local_symbols, decode_function_def, nested_code_ranges
+from script import Script, read_script
+from util import SymbolIds, byte_view
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# instruction flags
+CONST = 1
+UNKNOWN = 2
+
+# (opcode, flags, operand steps) by the first word of the instruction
+SCANNERS: dict[int, tuple[int, int, tuple[int, ...]]] = {
+    first: (first & 0xfffffeff, CONST if first & 0x100 else 0, steps) for first, steps in OPERAND_STEPS.items()
+}
+
+class InstructionColumns:
+    functions: list[FunctionDef]
+    # the instructions of function f are function_starts[f] up to function_starts[f + 1]
+    function_starts: array
+    opcodes: array
+    flags: array
+    offsets: array
+    operand_starts: array
+    # operand j is words[word_starts[j]:word_ends[j]]
+    word_starts: array
+    word_ends: array
+    # the code of every function, one after the other
+    words: array
+    # script level symbols, for decoding functions in instruction()
+    symbol_ids: SymbolIds
+    # instructions of the functions instruction() decoded by their offset, by function index
+    decoded: dict[int, dict[int, Any]]
+    
+    def __init__(self, functions: list[FunctionDef], symbol_ids: SymbolIds):
+        self.functions = functions
+        self.symbol_ids = symbol_ids
+        self.decoded = {}
+        
+        self.function_starts = array('I', [0])
+        self.opcodes = array('I')
+        self.flags = array('B')
+        self.offsets = array('I')
+        self.operand_starts = array('I', [0])
+        self.word_starts = array('I')
+        self.word_ends = array('I')
+        self.words = array('I')
+        
+        for fn, nested in zip(functions, nested_code_ranges(functions)):
+            self.scan(fn.code, fn.code_offset, nested)
+            self.function_starts.append(len(self.opcodes))
+    
+    @classmethod
+    def from_script(cls, script: Script, symbol_ids: SymbolIds) -> 'InstructionColumns':
+        """The code of every function of the script, symbol_ids being what read_script defined the script's symbols in."""
+        return cls(script.definitions, symbol_ids)
+    
+    def scan(self, code: Any, code_offset: int, nested: list[tuple[int, int]]):
+        words = self.words
+        base = len(words)
+        words.frombytes(byte_view(code))
+        length = base + len(code)
+        
+        # filled in as lists, which is a lot faster than appending to the arrays one by one
+        opcodes, flags, offsets, operand_starts, word_starts, word_ends = [], [], [], [], [], []
+        operand_count = len(self.word_starts)
+        scanners = SCANNERS
+        # the code of the functions inside this one that's still ahead, the next one last
+        ahead = nested[::-1]
+        
+        i = base
+        while i < length:
+            if len(ahead) > 0 and code_offset + i - base >= ahead[-1][0]:
+                # their instructions belong to them, the code continues after them
+                i = base + ahead.pop()[1] - code_offset
+                continue
+            
+            first = words[i]
+            scanner = scanners.get(first)
+            
+            if scanner is None:
+                opcode, flag, steps = first & 0xfffffeff, UNKNOWN | (CONST if first & 0x100 else 0), UNKNOWN_STEPS
+            else:
+                opcode, flag, steps = scanner
+            
+            position = i + 1
+            operands = len(word_starts)
+            
+            try:
+                for step in steps:
+                    word_starts.append(position)
+                    
+                    if step == WORD:
+                        if position == length:
+                            raise IndexError
+                        position += 1
+                        word_ends.append(position)
+                        continue
+                    elif step == NOTHING:
+                        word_ends.append(position)
+                        continue
+                    elif step == EXPRESSION:
+                        position = expression_end(words, position)
+                    elif step == EXPRESSIONS:
+                        # like the decoders, lists may run until the end of the code
+                        while position < length and words[position] != 0x11:
+                            position = expression_end(words, position) + 1
+                    else:
+                        position = list_end(words, position, 0x11 if step == UNTIL_ARGS_END else 0x8)
+                    
+                    word_ends.append(position)
+                    # past what ended the operand
+                    position += 1
+            except IndexError:
+                # the code ends in the middle of an instruction, which decode_function_def leaves out too
+                del word_starts[operands:], word_ends[operands:]
+                break
+            
+            opcodes.append(opcode)
+            flags.append(flag)
+            offsets.append(code_offset + i - base)
+            operand_starts.append(operand_count + len(word_starts))
+            
+            i = position
+        
+        self.opcodes.extend(opcodes)
+        self.flags.extend(flags)
+        self.offsets.extend(offsets)
+        self.operand_starts.extend(operand_starts)
+        self.word_starts.extend(word_starts)
+        self.word_ends.extend(word_ends)
+    
+    def __len__(self) -> int:
+        return len(self.opcodes)
+    
+    def function_of(self, i: int) -> int:
+        """The index in functions of the function instruction i is in."""
+        return bisect_right(self.function_starts, i) - 1
+    
+    def operand(self, i: int, position: int) -> array:
+        """The words of the operand at position (in the instruction's layout) of instruction i."""
+        j = self.operand_starts[i] + position
+        return self.words[self.word_starts[j]:self.word_ends[j]]
+    
+    def instruction(self, i: int) -> Any:
+        """Instruction i as an object, decoding the function it's in the first time one of its instructions is asked for."""
+        f = self.function_of(i)
+        instructions = self.decoded.get(f)
+        
+        if instructions is None:
+            fn = self.functions[f]
+            offsets: list[int] = []
+            
+            with self.symbol_ids.scope():
+                add_local_symbols(fn, self.symbol_ids)
+                decoded, _, _ = decode_function_def(fn, self.symbol_ids, offsets)
+            
+            # which includes the instructions of the functions inside it, which aren't among its columns
+            instructions = self.decoded[f] = dict(zip(offsets, decoded))
+        
+        return instructions[self.offsets[i]]
+    
+    def opcode_histogram(self) -> dict[int, int]:
+        """How many instructions there are of each opcode."""
+        if numpy is not None:
+            opcodes, counts = numpy.unique(numpy.frombuffer(self.opcodes, numpy.uint32), return_counts=True)
+            return dict(zip(opcodes.tolist(), counts.tolist()))
+        
+        return dict(Counter(self.opcodes))
+    
+    def select(self, cmd: type) -> Any:
+        """The indices of the instructions of type cmd, ascending."""
+        opcodes = [opcode for opcode, layout in LAYOUTS.items() if layout.cmd is cmd]
+        assert len(opcodes) > 0, f"{cmd.__name__} isn't an instruction"
+        
+        if numpy is not None:
+            return numpy.flatnonzero(numpy.isin(numpy.frombuffer(self.opcodes, numpy.uint32), opcodes))
+        
+        return array('I', [i for i, opcode in enumerate(self.opcodes) if opcode in opcodes])
+    
+    def operand_words(self, cmd: type, name: str) -> Any:
+        """
+        The word of the operand called name of every instruction of type cmd, for operands that are a single word
+        (symbols, functions, jumps, the values of const instructions).
+        """
+        layout = next(layout for layout in LAYOUTS.values() if layout.cmd is cmd)
+        names = [operand_name for operand_name, _ in layout.operands]
+        assert name in names, f"{cmd.__name__} has no operand {name}"
+        position = names.index(name)
+        
+        steps = {steps[position] for opcode, _, steps in SCANNERS.values() if LAYOUTS[opcode].cmd is cmd}
+        assert steps == {WORD}, f"{name} of {cmd.__name__} isn't a single word"
+        
+        selected = self.select(cmd)
+        
+        if numpy is not None:
+            operands = numpy.frombuffer(self.operand_starts, numpy.uint32)[selected] + position
+            return numpy.frombuffer(self.words, numpy.uint32)[numpy.frombuffer(self.word_starts, numpy.uint32)[operands]]
+        
+        operand_starts, word_starts, words = self.operand_starts, self.word_starts, self.words
+        return array('I', [words[word_starts[operand_starts[i] + position]] for i in selected])
+
+def file_columns(filename: str) -> InstructionColumns:
+    symbol_ids = SymbolIds()
+    script = read_script(read_ksm_container(read_input_file(filename, use_mmap=True)), symbol_ids, analyze=False)
+    
+    return InstructionColumns.from_script(script, symbol_ids)
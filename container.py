@@ -0,0 +1,75 @@
+"""
+Reading and writing the container a script (.bin file) is stored in: the magic b'KSMR', the version
+and where each section starts, followed by the sections themselves.
+"""
+from array import array
+from mmap import ACCESS_READ, mmap
+import os
+from shutil import copyfileobj
+from struct import unpack_from
+from typing import BinaryIO
+
+def map_file(filename: str) -> memoryview:
+    with open(filename, 'rb') as f:
+        # the view keeps the mapping alive after the file is closed
+        return memoryview(mmap(f.fileno(), 0, access=ACCESS_READ))
+
+def read_ksm_container(file: bytes | memoryview) -> list[bytes] | list[memoryview]:
+    header = list(unpack_from('4siiiiiiiiii', file))
+    assert header[0] == b'KSMR'
+    assert header[1] == 0x10300
+    assert header[10] == 0
+    
+    header[10] = len(file) // 4
+    
+    # god python can be so beautiful
+    sections = [file[start * 4:end * 4] for start, end in zip(header[2:], header[3:])]
+    
+    if isinstance(file, memoryview):
+        # slicing a view doesn't copy anything, so with a mapped file
+        # nothing gets read until a section actually gets decoded
+        sections = [section.cast('I') for section in sections]
+    
+    return sections
+
+def read_input_file(filename: str, use_mmap: bool) -> bytes | memoryview:
+    if use_mmap:
+        return map_file(filename)
+    
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def ksm_header(section_sizes: list[int]) -> array:
+    # the header is the magic, the version and where each section starts, terminated by a 0
+    section_indices = [2 + len(section_sizes) + 1]
+    for size in section_sizes[:-1]:
+        assert size % 4 == 0
+        section_indices.append(section_indices[-1] + size // 4)
+    
+    section_indices.append(0)
+    
+    out_arr = array('I', b'KSMR\0\x03\x01\0')
+    out_arr.extend(section_indices)
+    
+    return out_arr
+
+def write_ksm_container(sections: list[bytearray]) -> bytes:
+    out = bytearray(ksm_header([len(section) for section in sections]))
+    for section in sections:
+        out.extend(section)
+    
+    return bytes(out)
+
+def write_ksm_file(out_filename: str, sections: list[bytearray | BinaryIO]):
+    """Writes a container of sections some of which are (temporary) files, without reading those into memory."""
+    sizes = [len(section) if isinstance(section, bytearray) else section.seek(0, os.SEEK_END) for section in sections]
+    
+    with open(out_filename, 'wb') as f:
+        f.write(ksm_header(sizes))
+        
+        for section in sections:
+            if isinstance(section, bytearray):
+                f.write(section)
+            else:
+                section.seek(0)
+                copyfileobj(section, f)
@@ -1,16 +1,25 @@
 from array import array
-from dataclasses import dataclass, field
+from bisect import bisect_left
+from dataclasses import asdict, dataclass, field
+from hashlib import sha256
+from itertools import chain
 import json
+import os
 from string import ascii_lowercase
+from sys import intern
+from typing import Any, Callable, Iterable, Iterator
 
+from cache import Cache
 import cmds
-from other_types import Label, print_expr_or_var, print_function_import, print_label, read_function_imports, read_label
-from tables import Table, print_table, read_table
-from util import SymbolIds, read_string, write_string
+import profiling
+from other_types import (Label, ScriptImport, label_from_yaml, print_expr_or_var, print_function_import, print_label, read_labels,
+                         write_label)
+from tables import Table, print_table, read_tables, table_from_yaml, write_table
+from util import RecordLayout, RecordReader, SymbolIds, byte_view, symbol_keys, words, write_string
 from variables import Var, VarCategory, print_var, read_variable, var_from_yaml, write_variable
 
 # function definitions
-@dataclass
+@dataclass(slots=True)
 class FunctionDef:
     name: str | None
     id: int
@@ -19,7 +28,8 @@ class FunctionDef:
     return_var: int
     field_0x34: int
     
-    code: array
+    # a view into the code section when read from a script
+    code: array | memoryview
     code_offset: int
     instructions: list | None
     instruction_strs: list[str] | None
@@ -31,54 +41,38 @@ class FunctionDef:
     # analysis
     thread_references: list['FunctionDef'] = field(default_factory=list)
     thread2_references: list['FunctionDef'] = field(default_factory=list)
+    # where the instruction the code ends in the middle of starts (in the code section, like label offsets), if it does
+    truncated_at: int | None = None
+    
+    symbol_kind = 'fn'
 
-def read_function_definitions(section: bytes, code_section: bytes) -> list[FunctionDef]:
-    arr = enumerate(array('I', section))
-    code_section_arr = array('I', code_section)
+FUNCTION_RECORD = RecordLayout('is_named', 'id', 'is_public', 'field_0xc', 'code_offset', 'code_end', 'return_var', 'field_0x34')
+
+def read_function_definitions(section: bytes | memoryview, code_section: bytes | memoryview) -> list[FunctionDef]:
+    reader = RecordReader(section)
+    code_section_arr = words(code_section)
     
-    count = next(arr)[1]
+    count = reader.word()
     definitions = []
     
-    for i, value in arr:
-        id = next(arr)[1]
-        is_public = next(arr)[1]
-        field_0xc = next(arr)[1]
-        code_offset = next(arr)[1]
-        code_end = next(arr)[1]
-        return_var = next(arr)[1]
-        field_0x34 = next(arr)[1]
+    for _ in range(count):
+        (_, id, is_public, field_0xc, code_offset, code_end, return_var, field_0x34), name = reader.record(FUNCTION_RECORD)
         
         code = code_section_arr[code_offset + 1:code_end + 1]
         
-        if value == 0xFFFFFFFF:
-            name = read_string(section, i + 9)
-            
-            for _ in range(next(arr)[1]):
-                next(arr)
-        else:
-            assert value == 0
-            name = None
-        
         variables: list[Var] = []
-        for i in range(next(arr)[1]):
-            var = read_variable(arr, section, VarCategory.LocalVar)
+        for i in range(reader.word()):
+            var = read_variable(reader, VarCategory.LocalVar)
             
             if var.name == None:
                 assert (var.id & 0xFF) == 0
-                var.alias = str((var.id >> 8) & 0xFF) # TODO: make this more exact
+                var.alias = intern(str((var.id >> 8) & 0xFF)) # TODO: make this more exact
             
             variables.append(var)
         
         # TODO: table values don't work yet here
-        tables: list[Table] = []
-        for _ in range(next(arr)[1]):
-            tables.append(read_table(arr, section))
-        
-        labels: list[Label] = []
-        for _ in range(next(arr)[1]):
-            label = read_label(arr, section)
-            
-            labels.append(label)
+        tables = read_tables(reader, reader.word())
+        labels = read_labels(reader, reader.word())
         
         # assign aliases to labels
         alphabet = iter(ascii_lowercase)
@@ -88,51 +82,244 @@ def read_function_definitions(section: bytes, code_section: bytes) -> list[Funct
         
         definitions.append(FunctionDef(name, id, is_public, field_0xc, return_var, field_0x34, code, code_offset, None, None, variables, tables, labels))
     
-    assert len(definitions) == count
+    assert reader.at_end()
     return definitions
 
-def analyze_function_def(fn: FunctionDef, symbol_ids: SymbolIds):
+# the first words of the instructions that start a thread body, and of the Return that ends it
+THREAD_WORDS = {0x6, 0x7}
+RETURN_WORD = 0x9
+
+@dataclass
+class CodeIndex:
+    """Where the instructions of a function's code start, found without decoding them (see index_code)."""
+    # in words from the start of the code
+    starts: array
+    # by instruction, the innermost Thread or Thread2 whose body it's in (as an index into starts), or -1
+    threads: array
+    # where the instruction the code ends in the middle of starts, if it does
+    truncated_at: int | None
+    
+    def __len__(self) -> int:
+        return len(self.starts)
+    
+    def thread_starts(self, n: int) -> list[int]:
+        """Where the Threads instruction n is in the body of start, outermost first."""
+        starts = []
+        thread = self.threads[n]
+        
+        while thread != -1:
+            starts.append(self.starts[thread])
+            thread = self.threads[thread]
+        
+        return starts[::-1]
+    
+    def stop(self, n: int) -> int | None:
+        """Where instruction n ends, None for the last one (which runs until the end of the code)."""
+        return self.starts[n + 1] if n + 1 < len(self.starts) else None
+
+def index_code(code: array | memoryview) -> CodeIndex:
+    """Finds where every instruction starts by the words that end their operands, which is a lot faster than decoding them."""
+    words = array('I')
+    words.frombytes(byte_view(code))
+    
+    fixed_lengths = cmds.FIXED_LENGTHS
+    instruction_end = cmds.instruction_end
+    starts: list[int] = []
+    threads: list[int] = []
+    open_threads: list[int] = []
+    truncated_at = None
+    
+    i = 0
+    length = len(words)
+    
+    while i < length:
+        first = words[i]
+        end = i + fixed_lengths.get(first, 0)
+        
+        if end == i or end > length:
+            try:
+                end = instruction_end(words, i)
+            except IndexError:
+                truncated_at = i
+                break
+        
+        threads.append(open_threads[-1] if len(open_threads) > 0 else -1)
+        
+        if first in THREAD_WORDS:
+            open_threads.append(len(starts))
+        elif first == RETURN_WORD and len(open_threads) > 0:
+            open_threads.pop()
+        
+        starts.append(i)
+        i = end
+    
+    return CodeIndex(array('I', starts), array('i', threads), truncated_at)
+
+@dataclass
+class DecodedCode:
+    instructions: list
+    # ids of the functions started as Thread and Thread2
+    thread_ids: list[int]
+    thread2_ids: list[int]
+    # where the instruction the code ends in the middle of starts, in the code section
+    truncated_at: int | None
+
+def decode_code_range(fn: FunctionDef, symbol_ids: SymbolIds, start: int = 0, stop: int | None = None, threads: Iterable[int] = (),
+                      offsets: list[int] | None = None) -> DecodedCode:
+    """
+    Decodes the instructions of fn's code from word start up to word stop, which have to be where instructions start
+    (see index_code), without changing fn or anything else. The Threads starting at the words in threads,
+    the ones whose bodies the first instruction is in, are decoded first so their captured variables are in scope.
+    The offset of every instruction (in the code section, like label offsets) gets appended to offsets if it's given.
+    """
     # cache labels by their offset
     labels: dict[int, Label] = {}
     
     for label in fn.labels:
         labels[label.code_offset] = label
     
+    if profiling.active is None:
+        decoders = cmds.DECODERS
+        read_unknown_cmd = cmds.read_unknown_cmd
+    else:
+        decoders = profiling.active.decoders
+        read_unknown_cmd = profiling.active.read_unknown_cmd
+    
+    for thread in threads:
+        decoders[fn.code[thread]](enumerate(fn.code[thread + 1:], thread + 1), symbol_ids, fn.code_offset + thread)
+    
     # parse instructions
-    arr = enumerate(fn.code)
+    arr = enumerate(fn.code if start == 0 and stop is None else fn.code[start:stop], start)
     instructions = []
+    thread_ids = []
+    thread2_ids = []
+    truncated_at = None
     
     for i, value in arr:
         try:
-            options = cmds.ReadCmdOptions(value & 0xfffffeff, value & 0x100 != 0, fn.code_offset + i)
+            decoder = decoders.get(value)
             
-            if value & 0xfffffeff in cmds.INSTRUCTIONS:
-                instruction = cmds.INSTRUCTIONS[value & 0xfffffeff](arr, symbol_ids, options)
+            if decoder is not None:
+                instruction = decoder(arr, symbol_ids, fn.code_offset + i)
                 
                 match instruction:
                     case cmds.ThreadCmd(func):
-                        if isinstance(func, FunctionDef) and func is not fn:
-                            func.thread_references.append(fn)
+                        thread_ids.append(func.id)
                     case cmds.Thread2Cmd(func):
-                        if isinstance(func, FunctionDef) and func is not fn:
-                            func.thread2_references.append(fn)
+                        thread2_ids.append(func.id)
                     case cmds.LabelCmd(offset):
                         if offset in labels:
                             instruction.label = labels[offset]
                 
                 instructions.append(instruction)
             else:
-                instructions.append(cmds.read_unknown_cmd(arr, symbol_ids, options))
+                instructions.append(read_unknown_cmd(arr, symbol_ids, value & 0xfffffeff, value & 0x100 != 0))
+            
+            if offsets is not None:
+                offsets.append(fn.code_offset + i)
         except StopIteration:
-            pass
+            # the code ends in the middle of this instruction
+            truncated_at = fn.code_offset + i
     
-    fn.instructions = instructions
+    return DecodedCode(instructions, thread_ids, thread2_ids, truncated_at)
 
-def print_function_def(fn: FunctionDef) -> str:
+def decode_function_def(fn: FunctionDef, symbol_ids: SymbolIds, offsets: list[int] | None = None) -> tuple[list, list[int], list[int]]:
+    """
+    Decodes the function's code without changing fn or anything else,
+    returning the instructions and the ids of the functions started as Thread and Thread2.
+    The offset of every instruction (in the code section, like label offsets) gets appended to offsets if it's given.
+    """
+    decoded = decode_code_range(fn, symbol_ids, offsets=offsets)
+    return decoded.instructions, decoded.thread_ids, decoded.thread2_ids
+
+def decode_instruction(fn: FunctionDef, symbol_ids: SymbolIds, index: CodeIndex, n: int) -> Any:
+    """Instruction n of fn, without decoding the ones before it except for the Threads it's in the body of."""
+    with symbol_ids.scope():
+        return decode_code_range(fn, symbol_ids, index.starts[n], index.stop(n), index.thread_starts(n)).instructions[0]
+
+def split_code(index: CodeIndex, chunk_words: int) -> list[tuple[int, int | None, list[int]]]:
+    """
+    (start, stop, thread starts) for decode_code_range of pieces of the code of about chunk_words words each,
+    the last one running until the end of the code.
+    """
+    pieces = []
+    n = 0
+    
+    while n < len(index):
+        # the first instruction of the next piece
+        next_n = max(n + 1, bisect_left(index.starts, index.starts[n] + chunk_words))
+        stop = index.starts[next_n] if next_n < len(index) else None
+        
+        pieces.append((index.starts[n], stop, index.thread_starts(n)))
+        n = next_n
+    
+    return pieces
+
+def nested_code_ranges(definitions: list[FunctionDef]) -> list[list[tuple[int, int]]]:
+    """
+    By function, (start, end) of the code of every function directly inside its own code (in the code section, like label offsets),
+    ascending. Those are the bodies of its Threads that have a record of their own (_function_N_M),
+    so their instructions get decoded with both functions but only belong to the innermost one.
+    """
+    nested: list[list[tuple[int, int]]] = [[] for _ in definitions]
+    # the functions the code of the next one can be inside of, innermost last
+    enclosing: list[tuple[int, int]] = []
+    
+    # outer functions come before the ones inside them, and of two with the same code the first one is the outer one
+    for i in sorted(range(len(definitions)), key=lambda i: (definitions[i].code_offset, -len(definitions[i].code), i)):
+        fn = definitions[i]
+        if len(fn.code) == 0:
+            continue
+        
+        end = fn.code_offset + len(fn.code)
+        
+        while len(enclosing) > 0 and enclosing[-1][1] < end:
+            enclosing.pop()
+        
+        if len(enclosing) > 0:
+            nested[enclosing[-1][0]].append((fn.code_offset, end))
+        
+        enclosing.append((i, end))
+    
+    return nested
+
+def own_instructions(offsets: list[int], nested: list[tuple[int, int]]) -> Iterator[int]:
+    """The indices of the instructions at offsets (ascending) that aren't inside one of the nested ranges of nested_code_ranges."""
+    ranges = iter(nested)
+    start, end = next(ranges, (None, None))
+    
+    for n, offset in enumerate(offsets):
+        while end is not None and offset >= end:
+            start, end = next(ranges, (None, None))
+        
+        if start is None or offset < start:
+            yield n
+
+def add_thread_references(fn: FunctionDef, thread_ids: list[int], thread2_ids: list[int], symbol_ids: SymbolIds):
+    """Marks the functions fn starts as Thread or Thread2 as used by it, for the comments in the yaml."""
+    for id in thread_ids:
+        func = symbol_ids.get(id)
+        if isinstance(func, FunctionDef) and func is not fn:
+            func.thread_references.append(fn)
+    
+    for id in thread2_ids:
+        func = symbol_ids.get(id)
+        if isinstance(func, FunctionDef) and func is not fn:
+            func.thread2_references.append(fn)
+
+def analyze_function_def(fn: FunctionDef, symbol_ids: SymbolIds):
+    decoded = decode_code_range(fn, symbol_ids)
+    fn.instructions, fn.truncated_at = decoded.instructions, decoded.truncated_at
+    add_thread_references(fn, decoded.thread_ids, decoded.thread2_ids, symbol_ids)
+
+def print_function_def(fn: FunctionDef, body: str | None = None) -> Iterator[str]:
+    if body is None and (fn.instructions or fn.truncated_at is not None):
+        body = print_function_body(fn)
+    
     return_var_var = next((var for var in fn.vars if var.id == fn.return_var), None)
     return_var = print_expr_or_var(return_var_var) if return_var_var is not None else hex(fn.return_var)
     
-    result = f"""  - name: {fn.name if fn.name != None else 'null'}
+    yield f"""  - name: {fn.name if fn.name != None else 'null'}
     id: 0x{fn.id:x}
     is_public: {fn.is_public}
     field_0xc: 0x{fn.field_0xc:x}
@@ -140,239 +327,390 @@ def print_function_def(fn: FunctionDef) -> str:
     field_0x34: 0x{fn.field_0x34:x}\n"""
     
     if fn.vars and len(fn.vars) > 0:
-        result += "    \n    variables:\n"
+        yield "    \n    variables:\n"
         for var in fn.vars:
-            result += print_var(var, 3)
+            yield print_var(var, 3)
     if fn.tables and len(fn.tables) > 0:
-        result += "    \n    tables:\n"
+        yield "    \n    tables:\n"
         for table in fn.tables:
-            result += print_table(table, 3)
+            yield print_table(table, 3)
     if fn.labels and len(fn.labels) > 0:
-        result += "    \n    labels:\n"
+        yield "    \n    labels:\n"
         for var in fn.labels:
-            result += print_label(var)
+            yield print_label(var)
     
     if len(fn.thread_references) == 1 and len(fn.thread2_references) == 0:
-        result += f"    \n    generated_from_thread: true # used by fn:{fn.thread_references[0].name}\n"
+        yield f"    \n    generated_from_thread: true # used by fn:{fn.thread_references[0].name}\n"
     elif len(fn.thread_references) == 0 and len(fn.thread2_references) == 1:
-        result += f"    \n    generated_from_thread2: true # used by fn:{fn.thread2_references[0].name}\n"
-    elif fn.instructions and len(fn.instructions) > 0:
-        result += "    \n    "
+        yield f"    \n    generated_from_thread2: true # used by fn:{fn.thread2_references[0].name}\n"
+    elif body:
+        yield "    \n    "
         
         if len(fn.thread_references) >= 1:
             thread_references = ', '.join(print_expr_or_var(x) for x in fn.thread_references)
-            result += f"# used by Threads: {thread_references}\n    "
+            yield f"# used by Threads: {thread_references}\n    "
         if len(fn.thread2_references) >= 1:
             thread2_references = ', '.join(print_expr_or_var(x) for x in fn.thread2_references)
-            result += f"# used by Thread2s: {thread2_references}\n    "
+            yield f"# used by Thread2s: {thread2_references}\n    "
         
-        result += "body:\n"
-        start_indented_block = False
-        indentation = 0
+        yield "body:\n"
+        yield body
+
+def thread_stem(name: str | None) -> str | None:
+    # functions generated for threads are named like _name_1
+    if name is None:
+        return None
+    
+    name_start = 1 if name.startswith('_') else 0
+    return name[name_start:name.rindex('_')]
+
+# how a line of a function body changes the indentation: DEDENT for itself and the lines after it (down to none at all),
+# OPENS_BLOCK for the lines after it
+DEDENT = 1
+OPENS_BLOCK = 2
+
+def print_callee(func: 'FunctionDef | ScriptImport | int') -> str | int:
+    return func if isinstance(func, int) else func.name
+
+def print_args(args: list) -> str:
+    return ', '.join([print_expr_or_var(x) for x in args])
+
+def print_label_cmd(fn: FunctionDef, inst: 'cmds.LabelCmd') -> str:
+    label = inst.label
+    
+    if label is None:
+        label_name = f"? (at {hex(inst.offset)})"
+    elif not isinstance(label, Label):
+        label_name = print_expr_or_var(label)
+    elif label.name is not None:
+        label_name = label.name
+    elif label.alias is not None:
+        label_name = label.alias
+    else:
+        label_name = print_expr_or_var(label)
+    
+    return f"Label {label_name}"
+
+def print_thread_cmd(opcode: str) -> 'InstructionPrinter':
+    def print_thread(fn: FunctionDef, inst: 'cmds.ThreadCmd | cmds.Thread2Cmd') -> str:
+        if isinstance(inst.func, FunctionDef):
+            label_or_func = json.dumps(thread_stem(inst.func.name))
+        else:
+            label_or_func = print_expr_or_var(inst.func)
+        captures = ', '.join([print_expr_or_var(var) for var in inst.give_args])
         
-        for inst in fn.instructions:
-            if start_indented_block:
-                start_indented_block = False
-                indentation += 1
-            
-            match inst:
-                case cmds.ReturnValCmd(is_const, var):
-                    value = f"ReturnVal{'*' if is_const else ' '} {print_expr_or_var(var)}"
-                case cmds.SetCmd(is_const, destination, source):
-                    value = f"Set{'*' if is_const else ' '}  {print_expr_or_var(destination)} {print_expr_or_var(source, True)}"
-                case cmds.CallCmd(is_const, func, args):
-                    value = f"Call{'*' if is_const else ' '} {func if isinstance(func, int) else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-                case cmds.CallAsThreadCmd(is_const, func, args):
-                    value = f"CallAsThread{'*' if is_const else ' '} {func if isinstance(func, int) else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-                case cmds.CallAsChildThreadCmd(is_const, func, args):
-                    value = f"CallAsChildThread{'*' if is_const else ' '} {func if isinstance(func, int) else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-                case cmds.CallVarCmd(is_const, func, args):
-                    value = f"CallVar{'*' if is_const else '' } {func if isinstance(func, int) else func.name} {args}"
-                case cmds.ReturnCmd():
-                    if indentation > 0:
-                        indentation -= 1
-                    
-                    value = f"Return"
-                case cmds.GetArgsCmd(func, args):
-                    value = f"GetArgs fn:{'self' if func.name == fn.name else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-                case cmds.IfCmd(condition, unused1, jump_to, unused2):
-                    start_indented_block = True
-                    value = f"If {print_expr_or_var(condition)}" # , {hex(unused1)}, {hex(jump_to)}, {hex(unused2)}
-                case cmds.IfEqualCmd(var1, var2, jump_to):
-                    start_indented_block = True
-                    value = f"IfEqual ( {print_expr_or_var(var1)}, {print_expr_or_var(var2)} )" # , {hex(jump_to)}
-                case cmds.IfNotEqualCmd(var1, var2, jump_to):
-                    start_indented_block = True
-                    value = f"IfNotEqual ( {print_expr_or_var(var1)}, {print_expr_or_var(var2)} )" # , {hex(jump_to)}
-                case cmds.ElseCmd(jump_to):
-                    if indentation > 0:
-                        indentation -= 1
-                    start_indented_block = True
-                    value = f"Else" #  ( {hex(jump_to)} )
-                case cmds.ElseIfCmd(start_from, unused1, condition, unused2, jump_to, unused3):
-                    if indentation > 0:
-                        indentation -= 1
-                    start_indented_block = True
-                    # value = f"ElseIf ( {hex(start_from)}, {hex(unused1)}, {print_expr_or_var(condition)}, {hex(unused2)}, {hex(jump_to)}, {hex(unused3)} )"
-                    value = f"ElseIf {print_expr_or_var(condition)}"
-                case cmds.EndIfCmd():
-                    if indentation > 0:
-                        indentation -= 1
-                    value = f"EndIf"
-                case cmds.GotoLabelCmd(label):
-                    value = f"GotoLabel {print_expr_or_var(label)}"
-                case cmds.NoopCmd(opcode):
-                    value = f"Noop_{hex(opcode)}"
-                case cmds.LabelCmd(offset, label):
-                    if label is None:
-                        label_name = f"? (at {hex(offset)})"
-                    elif not isinstance(label, Label):
-                        label_name = print_expr_or_var(label)
-                    elif label.name is not None:
-                        label_name = label.name
-                    elif label.alias is not None:
-                        label_name = label.alias
-                    else:
-                        label_name = print_expr_or_var(label)
-                    
-                    value = f"Label {label_name}"
-                case cmds.ThreadCmd(func, take_args, give_args) | cmds.Thread2Cmd(func, take_args, give_args):
-                    start_indented_block = True
-                    
-                    opcode = "Thread1" if isinstance(inst, cmds.ThreadCmd) else "Thread2"
-                    if isinstance(func, FunctionDef):
-                        name_start = 1 if func.name is not None and func.name.startswith('_') else 0
-                        label_or_func = json.dumps(func.name[name_start:func.name.rindex('_')] if func.name is not None else func.name)
-                    else:
-                        label_or_func = print_expr_or_var(func)
-                    captures = ', '.join(print_expr_or_var(var) for var in give_args)
-                    
-                    value = f"{opcode} {label_or_func} Capture ( {captures} )"
-                case cmds.DeleteRuntimeCmd(is_const, duration):
-                    value = f"DeleteRuntime{'*' if is_const else '' } {print_expr_or_var(duration)}"                
-                case cmds.WaitCmd(is_const, duration):
-                    value = f"Wait{'*' if is_const else '' } {print_expr_or_var(duration)}"
-                case cmds.WaitMsCmd(is_const, duration):
-                    value = f"WaitMs{'*' if is_const else '' } {print_expr_or_var(duration)}"
-                case cmds.SwitchCmd(var, unused, jump_offset):
-                    start_indented_block = True
-                    value = f"Switch {print_expr_or_var(var)}" # , {hex(unused)}, {hex(jump_offset)}                
-                case cmds.CaseEqCmd(is_const, var, jump_offset):
-                    start_indented_block = True
-                    value = f"Case{'*' if is_const else '' } == {print_expr_or_var(var)}" # , {hex(jump_offset)}       
-                case cmds.CaseLteCmd(is_const, var, jump_offset):
-                    start_indented_block = True
-                    value = f"Case{'*' if is_const else '' } <= {print_expr_or_var(var)}" # , {hex(jump_offset)}
-                case cmds.CaseRangeCmd(is_const, lower, upper, jump_offset):
-                    start_indented_block = True
-                    value = f"CaseRange{'*' if is_const else '' } ( {print_expr_or_var(lower)} to {print_expr_or_var(upper)}" # , {hex(jump_offset)}
-                case cmds.BreakSwitchCmd():
-                    if indentation > 0:
-                        indentation -= 1
-                    value = f"BreakSwitch"
-                case cmds.EndSwitchCmd():
-                    if indentation > 0:
-                        indentation -= 1
-                    value = f"EndSwitch"
-                case cmds.WhileCmd(is_const, var, jump_offset):
-                    start_indented_block = True
-                    value = f"While{'*' if is_const else '' } {print_expr_or_var(var)}" # , {hex(jump_offset)} )
-                case cmds.BreakCmd():
-                    value = f"Break"
-                case cmds.EndWhileCmd():
-                    if indentation > 0:
-                        indentation -= 1
-                    value = f"EndWhile"
-                case cmds.ReadTableLengthCmd(is_const, arrayt):
-                    value = f"ReadTableLength ( {print_expr_or_var(arrayt)} )"
-                case cmds.ReadTableEntryCmd(is_const, arrayt, index):
-                    value = f"ReadTableEntry ( {print_expr_or_var(arrayt)}, {print_expr_or_var(index)} )"
-                case cmds.ReadTableEntryToVarCmd(is_const, arrayt, index, var):
-                    value = f"ReadTableEntryToVar ( {print_expr_or_var(arrayt)}, {print_expr_or_var(index)}, {print_expr_or_var(var)} )"
-                case cmds.ReadTableEntriesVec2Cmd(is_const, arrayt, index, x, y):
-                    value = f"ReadTableEntriesVec2 ( {print_expr_or_var(arrayt)}, {print_expr_or_var(index)}, {print_expr_or_var(x)}, {print_expr_or_var(y)} )"
-                case cmds.ReadTableEntriesVec3Cmd(is_const, arrayt, index, x, y, z):
-                    value = f"ReadTableEntriesVec3 ( {print_expr_or_var(arrayt)}, {print_expr_or_var(index)}, {print_expr_or_var(x)}, {print_expr_or_var(y)}, {print_expr_or_var(z)} )"
-                case cmds.TableGetIndexCmd(is_const, arrayt, occurance, var):
-                    value = f"TableGetIndex ( {print_expr_or_var(arrayt)}, {print_expr_or_var(occurance)}, {print_expr_or_var(var)} )"
-                case cmds.WaitCompletedCmd(is_const, runtime):
-                    value = f"WaitCompleted{'*' if is_const else '' } {print_expr_or_var(runtime)}"
-                case cmds.WaitWhileCmd(condition):
-                    value = f"WaitWhile {print_expr_or_var(condition)}"
-                case cmds.ToIntCmd(var):
-                    value = f"ToInt {print_expr_or_var(var)}"
-                case cmds.ToFloatCmd(var):
-                    value = f"ToFloat {print_expr_or_var(var)}"
-                case cmds.LoadKSMCmd(var):
-                    value = f"LoadKSM {print_expr_or_var(var)}"
-                case cmds.GetArgCountCmd():
-                    value = f"GetArgCount"
-                case cmds.SetKSMUnkCmd(is_const, destination, source):
-                    value = f"SetKSMUnk{'*' if is_const else ''} {print_expr_or_var(destination)} {print_expr_or_var(source, True)}"
-                case cmds.UnknownCmd(opcode, is_const, args):
-                    value = f"Unk_0x{opcode:x}{'*' if is_const else ' '} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-                case _:
-                    raise Exception()
-            
-            if ': ' in value:
-                result += f"      - {'    ' * indentation}'{value}'\n"
-            else:
-                result += f"      - {'    ' * indentation}{value}\n"
+        return f"{opcode} {label_or_func} Capture ( {captures} )"
+    
+    return print_thread
+
+# how each type of instruction is printed (without quotes), and how it changes the indentation,
+# filled in by instruction_lines the first time it runs because cmds may not be done importing when this module is
+InstructionPrinter = Callable[[FunctionDef, Any], str]
+instruction_printers: dict[type, tuple[int, InstructionPrinter]] = {}
+
+def add_instruction_printers():
+    instruction_printers.update({
+        cmds.ReturnValCmd: (0, lambda fn, inst: f"ReturnVal{'*' if inst.is_const else ' '} {print_expr_or_var(inst.value)}"),
+        cmds.SetCmd: (0, lambda fn, inst: f"Set{'*' if inst.is_const else ' '}  {print_expr_or_var(inst.destination)} {print_expr_or_var(inst.value, True)}"),
+        cmds.CallCmd: (0, lambda fn, inst: f"Call{'*' if inst.is_const else ' '} {print_callee(inst.func)} ( {print_args(inst.args)} )"),
+        cmds.CallAsThreadCmd: (0, lambda fn, inst: f"CallAsThread{'*' if inst.is_const else ' '} {print_callee(inst.func)} ( {print_args(inst.args)} )"),
+        cmds.CallAsChildThreadCmd: (0, lambda fn, inst: f"CallAsChildThread{'*' if inst.is_const else ' '} {print_callee(inst.func)} ( {print_args(inst.args)} )"),
+        cmds.CallVarCmd: (0, lambda fn, inst: f"CallVar{'*' if inst.is_const else ''} {print_expr_or_var(inst.func)} ( {print_args(inst.args)} )"),
+        cmds.ReturnCmd: (DEDENT, lambda fn, inst: "Return"),
+        cmds.GetArgsCmd: (0, lambda fn, inst: f"GetArgs fn:{'self' if inst.func.name == fn.name else inst.func.name} ( {print_args(inst.args)} )"),
+        cmds.IfCmd: (OPENS_BLOCK, lambda fn, inst: f"If {print_expr_or_var(inst.condition)}"),
+        cmds.IfEqualCmd: (OPENS_BLOCK, lambda fn, inst: f"IfEqual ( {print_expr_or_var(inst.var1)}, {print_expr_or_var(inst.var2)} )"),
+        cmds.IfNotEqualCmd: (OPENS_BLOCK, lambda fn, inst: f"IfNotEqual ( {print_expr_or_var(inst.var1)}, {print_expr_or_var(inst.var2)} )"),
+        cmds.ElseCmd: (DEDENT | OPENS_BLOCK, lambda fn, inst: "Else"),
+        cmds.ElseIfCmd: (DEDENT | OPENS_BLOCK, lambda fn, inst: f"ElseIf {print_expr_or_var(inst.condition)}"),
+        cmds.EndIfCmd: (DEDENT, lambda fn, inst: "EndIf"),
+        cmds.GotoLabelCmd: (0, lambda fn, inst: f"GotoLabel {print_expr_or_var(inst.label)}"),
+        cmds.NoopCmd: (0, lambda fn, inst: f"Noop_{hex(inst.opcode)}"),
+        cmds.LabelCmd: (0, print_label_cmd),
+        cmds.ThreadCmd: (OPENS_BLOCK, print_thread_cmd("Thread1")),
+        cmds.Thread2Cmd: (OPENS_BLOCK, print_thread_cmd("Thread2")),
+        cmds.DeleteRuntimeCmd: (0, lambda fn, inst: f"DeleteRuntime{'*' if inst.is_const else ''} {print_expr_or_var(inst.var)}"),
+        cmds.WaitCmd: (0, lambda fn, inst: f"Wait{'*' if inst.is_const else ''} {print_expr_or_var(inst.duration)}"),
+        cmds.WaitMsCmd: (0, lambda fn, inst: f"WaitMs{'*' if inst.is_const else ''} {print_expr_or_var(inst.duration)}"),
+        cmds.SwitchCmd: (OPENS_BLOCK, lambda fn, inst: f"Switch {print_expr_or_var(inst.var)}"),
+        cmds.CaseEqCmd: (OPENS_BLOCK, lambda fn, inst: f"Case{'*' if inst.is_const else ''} == {print_expr_or_var(inst.value)}"),
+        cmds.CaseLteCmd: (OPENS_BLOCK, lambda fn, inst: f"Case{'*' if inst.is_const else ''} <= {print_expr_or_var(inst.value)}"),
+        cmds.CaseRangeCmd: (OPENS_BLOCK, lambda fn, inst: f"CaseRange{'*' if inst.is_const else ''} ( {print_expr_or_var(inst.lower)} to {print_expr_or_var(inst.upper)} )"),
+        cmds.BreakSwitchCmd: (DEDENT, lambda fn, inst: "BreakSwitch"),
+        cmds.EndSwitchCmd: (DEDENT, lambda fn, inst: "EndSwitch"),
+        cmds.WhileCmd: (OPENS_BLOCK, lambda fn, inst: f"While{'*' if inst.is_const else ''} {print_expr_or_var(inst.value)}"),
+        cmds.BreakCmd: (0, lambda fn, inst: "Break"),
+        cmds.EndWhileCmd: (DEDENT, lambda fn, inst: "EndWhile"),
+        cmds.ReadTableLengthCmd: (0, lambda fn, inst: f"ReadTableLength ( {print_expr_or_var(inst.arrayt)} )"),
+        cmds.ReadTableEntryCmd: (0, lambda fn, inst: f"ReadTableEntry ( {print_expr_or_var(inst.arrayt)}, {print_expr_or_var(inst.index)} )"),
+        cmds.ReadTableEntryToVarCmd: (0, lambda fn, inst: f"ReadTableEntryToVar ( {print_expr_or_var(inst.arrayt)}, {print_expr_or_var(inst.index)}, {print_expr_or_var(inst.var)} )"),
+        cmds.ReadTableEntriesVec2Cmd: (0, lambda fn, inst: f"ReadTableEntriesVec2 ( {print_expr_or_var(inst.arrayt)}, {print_expr_or_var(inst.index)}, {print_expr_or_var(inst.x)}, {print_expr_or_var(inst.y)} )"),
+        cmds.ReadTableEntriesVec3Cmd: (0, lambda fn, inst: f"ReadTableEntriesVec3 ( {print_expr_or_var(inst.arrayt)}, {print_expr_or_var(inst.index)}, {print_expr_or_var(inst.x)}, {print_expr_or_var(inst.y)}, {print_expr_or_var(inst.z)} )"),
+        cmds.TableGetIndexCmd: (0, lambda fn, inst: f"TableGetIndex ( {print_expr_or_var(inst.arrayt)}, {print_expr_or_var(inst.occurance)}, {print_expr_or_var(inst.var)} )"),
+        cmds.WaitCompletedCmd: (0, lambda fn, inst: f"WaitCompleted{'*' if inst.is_const else ''} {print_expr_or_var(inst.runtime)}"),
+        cmds.WaitWhileCmd: (0, lambda fn, inst: f"WaitWhile {print_expr_or_var(inst.condition)}"),
+        cmds.ToIntCmd: (0, lambda fn, inst: f"ToInt {print_expr_or_var(inst.variable)}"),
+        cmds.ToFloatCmd: (0, lambda fn, inst: f"ToFloat {print_expr_or_var(inst.variable)}"),
+        cmds.LoadKSMCmd: (0, lambda fn, inst: f"LoadKSM {print_expr_or_var(inst.variable)}"),
+        cmds.GetArgCountCmd: (0, lambda fn, inst: "GetArgCount"),
+        cmds.SetKSMUnkCmd: (0, lambda fn, inst: f"SetKSMUnk{'*' if inst.is_const else ''} {print_expr_or_var(inst.runtime)} {print_expr_or_var(inst.value, True)}"),
+        cmds.UnknownCmd: (0, lambda fn, inst: f"Unk_0x{inst.opcode:x}{'*' if inst.is_const else ' '} ( {print_args(inst.args)} )"),
+    })
+
+def instruction_lines(fn: FunctionDef, instructions: list) -> list[tuple[int, str]]:
+    """The lines of the body for the instructions, without their indentation but with how they change it (see indent_lines)."""
+    lines = []
+    printers = instruction_printers
+    if len(printers) == 0:
+        add_instruction_printers()
+    
+    for inst in instructions:
+        change, print_instruction = printers[type(inst)]
+        value = print_instruction(fn, inst)
+        lines.append((change, f"'{value}'" if ': ' in value else value))
+    
+    return lines
+
+def indent_lines(lines: Iterable[tuple[int, str]]) -> str:
+    out = []
+    start_indented_block = False
+    indentation = 0
+    
+    for change, value in lines:
+        if start_indented_block:
+            start_indented_block = False
+            indentation += 1
+        
+        if change & DEDENT and indentation > 0:
+            indentation -= 1
+        start_indented_block = change & OPENS_BLOCK != 0
+        
+        out.append(f"      - {'    ' * indentation}{value}\n")
     
-    return result
+    return ''.join(out)
+
+def truncation_comment(fn: FunctionDef, truncated_at: int) -> str:
+    left = fn.code_offset + len(fn.code) - truncated_at
+    return f"      # the code ends in the middle of an instruction at 0x{truncated_at:x} ({left} word{'s' if left != 1 else ''} left undecoded)\n"
 
-def print_function_imports(sections: list[bytes], symbol_ids: SymbolIds) -> str:
-    # section 5 (function imports)
-    imports = read_function_imports(sections[5])
+def print_function_body(fn: FunctionDef) -> str:
+    assert fn.instructions is not None
     
+    body = indent_lines(instruction_lines(fn, fn.instructions))
+    if fn.truncated_at is not None:
+        body += truncation_comment(fn, fn.truncated_at)
+    
+    return body
+
+
+def print_function_imports(imports: list[ScriptImport]) -> Iterator[str]:
     if len(imports) == 0:
-        return ""
+        return
     
-    out_str = '\nimports:\n'
+    yield '\nimports:\n'
     
     for fn in imports:
-        symbol_ids.add(fn)
-        out_str += print_function_import(fn)
+        yield print_function_import(fn)
+
+# a function body as printed into the yaml, which is what the memo remembers and the worker processes send back
+@dataclass
+class RenderedBody:
+    body: str
+    # ids of the functions started as Thread/Thread2 by this function,
+    # so the references can be added without decoding it again
+    thread_ids: list[int]
+    thread2_ids: list[int]
+
+def render_function_body(fn: FunctionDef, symbol_ids: SymbolIds) -> RenderedBody:
+    """Decodes and prints the body of fn, leaving the thread references of other functions alone."""
+    with profiling.stage('decode'):
+        decoded = decode_code_range(fn, symbol_ids)
+        fn.instructions, fn.truncated_at = decoded.instructions, decoded.truncated_at
     
-    return out_str
+    return RenderedBody(print_function_body(fn), decoded.thread_ids, decoded.thread2_ids)
+
+# a piece of a long function body, rendered in a worker process while others render the rest of it
+@dataclass
+class RenderedPiece:
+    lines: list[tuple[int, str]]
+    thread_ids: list[int]
+    thread2_ids: list[int]
+    truncated_at: int | None
 
-def print_function_definitions(sections: list[bytes], symbol_ids: SymbolIds) -> str:
-    # section 1 (function definitions)
-    definitions = read_function_definitions(sections[1], sections[7])
+def render_code_range(fn: FunctionDef, symbol_ids: SymbolIds, start: int, stop: int | None, threads: list[int]) -> RenderedPiece:
+    """Decodes and prints a piece of the body of fn (see split_code), leaving fn alone."""
+    with profiling.stage('decode'):
+        decoded = decode_code_range(fn, symbol_ids, start, stop, threads)
     
-    if len(definitions) == 0:
-        return ""
+    return RenderedPiece(instruction_lines(fn, decoded.instructions), decoded.thread_ids, decoded.thread2_ids, decoded.truncated_at)
+
+def join_pieces(fn: FunctionDef, pieces: list[RenderedPiece]) -> RenderedBody:
+    body = indent_lines(line for piece in pieces for line in piece.lines)
+    if pieces[-1].truncated_at is not None:
+        body += truncation_comment(fn, pieces[-1].truncated_at)
     
-    for fn in definitions:
-        symbol_ids.add(fn)
+    return RenderedBody(body, [id for piece in pieces for id in piece.thread_ids], [id for piece in pieces for id in piece.thread2_ids])
+
+def symbol_version(id: int, symbol) -> str:
+    """What goes into a FunctionMemo key for symbol, how it gets printed only depends on its type and what it's called (see symbol_keys)."""
+    return f"{id:x}={type(symbol).__name__}{symbol_keys(symbol)}"
+
+# rendered function bodies are remembered across runs,
+# so an edit to one function doesn't mean re-rendering all the others
+
+class FunctionMemo:
+    """
+    The bodies rendered for one script, kept in a single cache entry named after the script's path.
+    
+    Every body gets remembered, starting with the first time a script is converted,
+    and save replaces the entry with the bodies of this run, so functions that are gone don't stick around.
+    """
+    cache: Cache
+    name: str
+    previous: dict[str, dict]
+    current: dict[str, dict]
+    # symbol_version of everything defined at script level, by id
+    script_symbols: dict[int, str]
+    # the same ids as a set, which intersects with another set without going through all of them
+    script_ids: set[int]
+    
+    def __init__(self, cache: Cache, script_filename: str):
+        self.cache = cache
+        self.name = cache.key(os.path.abspath(script_filename).encode()) + '.memo'
+        self.current = {}
+        self.script_symbols = {}
+        self.script_ids = set()
+        
+        data = cache.read(self.name)
+        self.previous = json.loads(data) if data is not None else {}
+    
+    def add_script_symbols(self, symbol_ids: SymbolIds):
+        """Has to be called with symbol_ids holding everything defined at script level (and nothing else) before key."""
+        self.script_symbols = {id: symbol_version(id, symbol) for id, symbol in symbol_ids.symbols.items()}
+        self.script_ids = set(self.script_symbols)
+    
+    def key(self, fn: FunctionDef) -> str:
+        # every symbol the body can print is looked up by one of its code words, either one of the function's own
+        # or one defined at script level, so those go in with the version of what they resolve to
+        # (words that don't resolve to anything are part of the code already)
+        local = [symbol_version(symbol.id, symbol) for symbol in chain(fn.vars, fn.tables, fn.labels)]
+        words = set(fn.code).difference([symbol.id for symbol in chain(fn.vars, fn.tables, fn.labels)])
+        script = map(self.script_symbols.__getitem__, sorted(words & self.script_ids))
+        
+        labels = [(label.name, label.alias, label.id, label.code_offset) for label in fn.labels]
+        header = (fn.name, fn.id, fn.is_public, fn.field_0xc, fn.return_var, fn.field_0x34, fn.code_offset, labels)
+        
+        return sha256(fn.code.tobytes() + repr(header).encode() + ' '.join(chain(local, script)).encode()).hexdigest()
+    
+    def get(self, key: str) -> RenderedBody | None:
+        entry = self.previous.get(key)
+        if entry is None:
+            return None
+        
+        self.current[key] = entry
+        return RenderedBody(**entry)
+    
+    def put(self, key: str, rendered: RenderedBody):
+        self.current[key] = asdict(rendered)
     
+    def save(self):
+        self.cache.write(self.name, json.dumps(self.current).encode())
+
+def add_local_symbols(fn: FunctionDef, symbol_ids: SymbolIds):
+    for var in fn.vars:
+        symbol_ids.add(var)
+    for table in fn.tables:
+        symbol_ids.add(table)
+    for unk in fn.labels:
+        symbol_ids.add(unk)
+
+def analyze_function_defs(definitions: list[FunctionDef], symbol_ids: SymbolIds):
+    """Decodes every function's code, with symbol_ids holding everything defined at script level (including the functions)."""
     for fn in definitions:
         if fn.code is not None and len(fn.code) > 0:
-            local_symbol_ids = symbol_ids.copy()
-            
-            for var in fn.vars:
-                local_symbol_ids.add(var)
-            for table in fn.tables:
-                local_symbol_ids.add(table)
-            for unk in fn.labels:
-                local_symbol_ids.add(unk)
-            
-            analyze_function_def(fn, local_symbol_ids)
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                with profiling.stage('decode'):
+                    analyze_function_def(fn, symbol_ids)
+
+def print_function_definitions(definitions: list[FunctionDef], symbol_ids: SymbolIds, memo: FunctionMemo | None = None,
+                               render_in_workers: Callable[[list[int]], Iterable[RenderedBody]] | None = None) -> Iterator[str]:
+    """
+    Functions that haven't been decoded yet are decoded along the way (or have their body fetched from memo),
+    so symbol_ids has to hold everything defined at script level in that case.
+    render_in_workers gets the indices of the functions that still have to be decoded and renders them elsewhere
+    (see BodyPool), in which case those functions are left without instructions.
+    """
+    if len(definitions) == 0:
+        return
     
-    out_str = '\ndefinitions:\n'
-    is_first = True
+    if memo is not None:
+        memo.add_script_symbols(symbol_ids)
     
-    for fn in definitions:
-        if not is_first:
-            if out_str.endswith('  \n'):
-                out_str = out_str[:-5] + '\n'
+    bodies: list[str | None] = [None] * len(definitions)
+    rendered: list[RenderedBody | None] = [None] * len(definitions)
+    keys: list[str | None] = [None] * len(definitions)
+    missing: list[int] = []
+    
+    for i, fn in enumerate(definitions):
+        if fn.instructions is None and fn.code is not None and len(fn.code) > 0:
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                
+                if memo is None and render_in_workers is None:
+                    with profiling.stage('decode'):
+                        analyze_function_def(fn, symbol_ids)
+                    continue
+                
+                if memo is not None:
+                    keys[i] = memo.key(fn)
+                    rendered[i] = memo.get(keys[i])
+                    if rendered[i] is not None:
+                        continue
+                
+                if render_in_workers is not None:
+                    missing.append(i)
+                    continue
+                
+                rendered[i] = render_function_body(fn, symbol_ids)
+                memo.put(keys[i], rendered[i])
+    
+    if len(missing) > 0:
+        # results come back in the order they were asked for, no matter which worker finished first
+        for i, body in zip(missing, render_in_workers(missing)):
+            rendered[i] = body
+            if memo is not None:
+                memo.put(keys[i], body)
+    
+    # the references are added in the order decoding the functions one after the other adds them in,
+    # so the output doesn't depend on where the bodies came from
+    for i, fn in enumerate(definitions):
+        if rendered[i] is not None:
+            add_thread_references(fn, rendered[i].thread_ids, rendered[i].thread2_ids, symbol_ids)
+            bodies[i] = rendered[i].body
+    
+    yield '\ndefinitions:\n'
+    
+    # the separator between two definitions depends on how the previous one ended,
+    # so the last piece of each is held back until the next one starts
+    last = None
+    
+    for fn, body in zip(definitions, bodies):
+        if last is not None:
+            if last.endswith('  \n'):
+                yield last[:-5] + '\n'
             else:
-                out_str += '    \n'
+                yield last
+                yield '    \n'
         
-        out_str += print_function_def(fn)
-        is_first = False
-    
-    return out_str
+        last = None
+        for piece in print_function_def(fn, body):
+            if last is not None:
+                yield last
+            last = piece
+    
+    if last is not None:
+        yield last
 
 def function_definitions_from_yaml(function_definitions: list) -> list[FunctionDef]:
     out: list[FunctionDef] = []
@@ -414,15 +752,30 @@ def function_definitions_from_yaml(function_definitions: list) -> list[FunctionD
         else:
             vars = []
         
-        assert 'tables' not in obj, "TODO"
-        assert 'labels' not in obj, "TODO"
+        if 'tables' in obj and obj['tables'] is not None:
+            assert isinstance(obj['tables'], list), "Function tables have to be a list of tables"
+            tables = [table_from_yaml(table_obj) for table_obj in obj['tables']]
+        else:
+            tables = []
         
-        code_offset = 0 # TODO
-        code = array('I', [])
+        if 'labels' in obj and obj['labels'] is not None:
+            assert isinstance(obj['labels'], list), "Function labels have to be a list of labels"
+            labels = [label_from_yaml(label_obj) for label_obj in obj['labels']]
+        else:
+            labels = []
         
-        tables = []
-        labels = []
+        if isinstance(return_var_str, int):
+            return_var = return_var_str
+        else:
+            return_var_var = next((var for var in vars if print_expr_or_var(var) == return_var_str), None)
+            assert return_var_var is not None, f"Function's 'return_var' {return_var_str} isn't one of its variables"
+            return_var = return_var_var.id
+        
+        # code_offset and code are filled in by the assembler
+        code_offset = 0
+        code = array('I', [])
         
+        # functions generated for threads have their body in the function starting the thread
         if 'body' in obj and obj['body'] is not None:
             assert isinstance(obj['body'], list), "Function body has to be a list of instructions"
             body_obj = obj['body']
@@ -430,9 +783,9 @@ def function_definitions_from_yaml(function_definitions: list) -> list[FunctionD
             for line in body_obj:
                 assert isinstance(line, str), "Function body has to be a list of instructions"
         else:
-            raise NotImplementedError()
+            body_obj = None
         
-        out.append(FunctionDef(name, id, is_public, field_0xc, 0, field_0x34, code, code_offset, None, body_obj, vars, tables, labels))
+        out.append(FunctionDef(name, id, is_public, field_0xc, return_var, field_0x34, code, code_offset, None, body_obj, vars, tables, labels))
     
     return out
 
@@ -443,36 +796,36 @@ def write_function_def(fn: FunctionDef) -> bytearray:
     out.append(fn.id)
     out.append(fn.is_public)
     out.append(fn.field_0xc)
-    out.append(0) # code offset and code end will be patched in later
-    out.append(0)
+    out.append(fn.code_offset)
+    out.append(fn.code_offset + len(fn.code))
     out.append(fn.return_var)
     out.append(fn.field_0x34)
     
     if fn.name is not None:
         out.extend(write_string(fn.name))
     
-    if len(fn.vars) > 0:
-        out.append(len(fn.vars))
-        
-        for var in fn.vars:
-            out.extend(write_variable(var))
+    out.append(len(fn.vars))
+    for var in fn.vars:
+        out.extend(write_variable(var))
+    
+    out.append(len(fn.tables))
+    for table in fn.tables:
+        out.extend(write_table(table))
     
-    out.append(0)
-    out.append(0)
+    out.append(len(fn.labels))
+    for label in fn.labels:
+        out.extend(write_label(label))
     
     return bytearray(out)
 
-def parse_function_definitions(input_file: dict, symbol_ids: SymbolIds) -> tuple[list[FunctionDef], bytearray]:
+def parse_function_definitions(input_file: dict, symbol_ids: SymbolIds) -> list[FunctionDef]:
     if 'definitions' not in input_file:
-        return [], bytearray([0, 0, 0, 0])
+        return []
     
     assert isinstance(input_file['definitions'], list)
     definitions = function_definitions_from_yaml(input_file['definitions'])
     
-    out = bytearray(array('I', [len(definitions)]))
-    
     for definition in definitions:
         symbol_ids.add(definition)
-        out.extend(write_function_def(definition))
     
-    return definitions, out
+    return definitions
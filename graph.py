@@ -0,0 +1,363 @@
+"""
+Call and thread graphs over a whole corpus of scripts.
+
+Every function defined in a script is a node, named path:function. Imports are resolved by name to the public functions
+the corpus defines with that name, imports nothing in the corpus defines (the game's own functions) stay nodes of their own
+named fn:name, and scripts loaded with LoadKSM are nodes named ksm:what was loaded.
+
+Edges come from Call, CallAsThread, CallAsChildThread, Thread, Thread2 and LoadKSM, including calls inside expressions,
+each one remembering which kind of instruction it came from. Calls in the body of a Thread that has a function record
+of its own (_function_N_M) are edges of that function, the one starting it only gets the Thread edge.
+They're kept as adjacency arrays (CSR): the edges of node i are targets[starts[i]:starts[i + 1]],
+with the same arrays for the reversed graph, so a graph of tens of thousands of functions is a handful of flat arrays. Graphs can be written to a file and read back without decoding anything.
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+import os
+import struct
+from typing import Any, Iterable
+
+import cmds
+from container import read_input_file, read_ksm_container
+from functions import FunctionDef, add_local_symbols, decode_function_def, nested_code_ranges, own_instructions
+from other_types import Expr, ScriptImport, print_expr_or_var
+from script import read_script
+from util import SymbolIds
+from variables import Var, VarCategory
+from xref import operand_access
+
+class EdgeKind(Enum):
+    Call = 0
+    CallAsThread = 1
+    CallAsChildThread = 2
+    Thread = 3
+    Thread2 = 4
+    LoadKSM = 5
+
+EDGE_KINDS = {
+    cmds.CallCmd: EdgeKind.Call,
+    cmds.CallAsThreadCmd: EdgeKind.CallAsThread,
+    cmds.CallAsChildThreadCmd: EdgeKind.CallAsChildThread,
+    cmds.ThreadCmd: EdgeKind.Thread,
+    cmds.Thread2Cmd: EdgeKind.Thread2,
+    cmds.LoadKSMCmd: EdgeKind.LoadKSM,
+}
+
+ALL_KINDS = frozenset(EdgeKind)
+
+def loaded_script_name(value: Any) -> str:
+    if isinstance(value, Var) and value.category == VarCategory.Const and isinstance(value.user_data, str):
+        return f"ksm:{value.user_data}"
+    
+    # loaded from a variable, all of those end up in the same node
+    return f"ksm:{print_expr_or_var(value)}"
+
+def instruction_calls(inst: Any, out: list[tuple[Any, EdgeKind]]):
+    """(what gets called or loaded, how) for the instruction and the calls in its expressions."""
+    kind = EDGE_KINDS.get(type(inst))
+    
+    if kind is EdgeKind.LoadKSM:
+        out.append((inst.variable, kind))
+    elif kind is not None:
+        out.append((inst.func, kind))
+    
+    for name, _ in operand_access(type(inst)):
+        value = getattr(inst, name)
+        
+        if type(value) is Expr:
+            values = [value]
+        elif type(value) is list:
+            values = value
+        else:
+            continue
+        
+        for expr in values:
+            if type(expr) is Expr:
+                for element in expr.elements:
+                    if type(element) is cmds.CallCmd:
+                        instruction_calls(element, out)
+
+@dataclass
+class ScriptCalls:
+    """What a single script defines and calls, which is all building a graph needs from it."""
+    path: str
+    # name and whether it's public, of every function
+    functions: list[tuple[str, bool]]
+    # (index of the calling function, what's called, how), what's called is either
+    # the index of a function of this script, fn:name for imports or ksm:name for loaded scripts
+    calls: list[tuple[int, int | str, EdgeKind]]
+
+def script_calls(path: str, data: bytes | memoryview) -> ScriptCalls:
+    symbol_ids = SymbolIds()
+    script = read_script(read_ksm_container(data), symbol_ids, analyze=False)
+    
+    indices = {id(fn): i for i, fn in enumerate(script.definitions)}
+    functions = [(print_expr_or_var(fn)[len('fn:'):], fn.is_public != 0) for fn in script.definitions]
+    calls = []
+    
+    for i, (fn, nested) in enumerate(zip(script.definitions, nested_code_ranges(script.definitions))):
+        if len(fn.code) == 0:
+            continue
+        
+        offsets: list[int] = []
+        with symbol_ids.scope():
+            add_local_symbols(fn, symbol_ids)
+            instructions, _, _ = decode_function_def(fn, symbol_ids, offsets)
+        
+        # calls in the body of a Thread with a function record of its own are that function's, the Thread is the edge to it
+        targets: list[tuple[Any, EdgeKind]] = []
+        for n in own_instructions(offsets, nested):
+            instruction_calls(instructions[n], targets)
+        
+        for target, kind in targets:
+            if kind is EdgeKind.LoadKSM:
+                calls.append((i, loaded_script_name(target), kind))
+            elif isinstance(target, FunctionDef):
+                calls.append((i, indices[id(target)], kind))
+            elif isinstance(target, ScriptImport):
+                calls.append((i, f"fn:{target.name}", kind))
+    
+    return ScriptCalls(path, functions, calls)
+
+def file_calls(filename: str) -> ScriptCalls:
+    return script_calls(os.path.abspath(filename), read_input_file(filename, use_mmap=True))
+
+MAGIC = b'KSMG'
+VERSION = 1
+
+class Graph:
+    names: list[str]
+    # node i has the edges starts[i] up to starts[i + 1]
+    starts: array
+    targets: array
+    kinds: array
+    # the same for the reversed edges, what calls each node
+    reverse_starts: array
+    reverse_targets: array
+    reverse_kinds: array
+    nodes: dict[str, int]
+    
+    def __init__(self, names: list[str], edges: Iterable[tuple[int, int, EdgeKind]]):
+        self.names = names
+        self.nodes = {name: i for i, name in enumerate(names)}
+        
+        sources, targets, kinds = array('I'), array('I'), array('B')
+        for source, target, kind in edges:
+            sources.append(source)
+            targets.append(target)
+            kinds.append(kind.value)
+        
+        self.starts, self.targets, self.kinds = self.adjacency(sources, targets, kinds)
+        self.reverse_starts, self.reverse_targets, self.reverse_kinds = self.adjacency(targets, sources, kinds)
+    
+    def adjacency(self, sources: array, targets: array, kinds: array) -> tuple[array, array, array]:
+        # a counting sort of the edges by their source
+        starts = array('I', bytes(4 * (len(self.names) + 1)))
+        for source in sources:
+            starts[source + 1] += 1
+        for i in range(len(self.names)):
+            starts[i + 1] += starts[i]
+        
+        positions = starts[:-1]
+        sorted_targets = array('I', bytes(4 * len(targets)))
+        sorted_kinds = array('B', bytes(len(kinds)))
+        
+        for source, target, kind in zip(sources, targets, kinds):
+            position = positions[source]
+            sorted_targets[position] = target
+            sorted_kinds[position] = kind
+            positions[source] = position + 1
+        
+        return starts, sorted_targets, sorted_kinds
+    
+    def node(self, name: str) -> int:
+        node = self.nodes.get(name)
+        assert node is not None, f"There's no function or script called {name} in the graph"
+        return node
+    
+    def edges(self, node: int, kinds: frozenset[EdgeKind] = ALL_KINDS, reverse: bool = False) -> list[int]:
+        if reverse:
+            starts, targets, edge_kinds = self.reverse_starts, self.reverse_targets, self.reverse_kinds
+        else:
+            starts, targets, edge_kinds = self.starts, self.targets, self.kinds
+        
+        start, end = starts[node], starts[node + 1]
+        if kinds is ALL_KINDS:
+            return targets[start:end].tolist()
+        
+        values = {kind.value for kind in kinds}
+        return [targets[i] for i in range(start, end) if edge_kinds[i] in values]
+    
+    def reachable(self, sources: Iterable[int], kinds: frozenset[EdgeKind] = ALL_KINDS, reverse: bool = False) -> list[int]:
+        """Every node reachable from sources (including them), in the order a breadth first search finds them."""
+        seen = bytearray(len(self.names))
+        order = []
+        
+        for source in sources:
+            if not seen[source]:
+                seen[source] = 1
+                order.append(source)
+        
+        i = 0
+        while i < len(order):
+            for target in self.edges(order[i], kinds, reverse):
+                if not seen[target]:
+                    seen[target] = 1
+                    order.append(target)
+            i += 1
+        
+        return order
+    
+    def callers_of(self, node: int, kinds: frozenset[EdgeKind] = ALL_KINDS, transitive: bool = False) -> list[int]:
+        """The nodes with an edge to node, or with transitive every node that can reach it."""
+        if transitive:
+            return self.reachable([node], kinds, reverse=True)[1:]
+        
+        return list(dict.fromkeys(self.edges(node, kinds, reverse=True)))
+    
+    def strongly_connected_components(self, kinds: frozenset[EdgeKind] = ALL_KINDS) -> list[list[int]]:
+        """
+        Groups of nodes that can all reach each other, callees before their callers.
+        An iterative version of Tarjan's algorithm, so deep call chains don't hit the recursion limit.
+        """
+        count = len(self.names)
+        index = array('i', [-1]) * count
+        lowlink = array('i', [0]) * count
+        on_stack = bytearray(count)
+        stack: list[int] = []
+        components = []
+        next_index = 0
+        
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            
+            # (node, its edges, how many of them have been looked at)
+            work = [(root, self.edges(root, kinds), 0)]
+            index[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = 1
+            
+            while len(work) > 0:
+                node, targets, position = work[-1]
+                
+                if position < len(targets):
+                    work[-1] = (node, targets, position + 1)
+                    target = targets[position]
+                    
+                    if index[target] == -1:
+                        index[target] = lowlink[target] = next_index
+                        next_index += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, self.edges(target, kinds), 0))
+                    elif on_stack[target]:
+                        lowlink[node] = min(lowlink[node], index[target])
+                    continue
+                
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        
+        return components
+    
+    def cycles(self, kinds: frozenset[EdgeKind] = ALL_KINDS) -> list[list[int]]:
+        """The components that are actually recursive: more than one node, or a node calling itself."""
+        return [component for component in self.strongly_connected_components(kinds)
+                if len(component) > 1 or component[0] in self.edges(component[0], kinds)]
+    
+    def write(self, filename: str):
+        names = '\0'.join(self.names).encode()
+        
+        with open(filename, 'wb') as f:
+            f.write(MAGIC + struct.pack('<IIII', VERSION, len(self.names), len(self.targets), len(names)))
+            f.write(names)
+            
+            for values in [self.starts, self.targets, self.kinds, self.reverse_starts, self.reverse_targets, self.reverse_kinds]:
+                f.write(values.tobytes())
+    
+    @classmethod
+    def read(cls, filename: str) -> 'Graph':
+        with open(filename, 'rb') as f:
+            data = f.read()
+        
+        assert data[:4] == MAGIC, f"{filename} isn't a graph file"
+        version, node_count, edge_count, names_length = struct.unpack_from('<IIII', data, 4)
+        assert version == VERSION, f"{filename} was written by a different version of the tool, build it again"
+        
+        graph = cls.__new__(cls)
+        position = 4 + 16
+        
+        graph.names = data[position:position + names_length].decode().split('\0') if node_count > 0 else []
+        graph.nodes = {name: i for i, name in enumerate(graph.names)}
+        position += names_length
+        
+        def take(typecode: str, count: int) -> array:
+            nonlocal position
+            values = array(typecode)
+            values.frombytes(data[position:position + count * values.itemsize])
+            position += count * values.itemsize
+            return values
+        
+        graph.starts, graph.targets, graph.kinds = take('I', node_count + 1), take('I', edge_count), take('B', edge_count)
+        graph.reverse_starts, graph.reverse_targets, graph.reverse_kinds = take('I', node_count + 1), take('I', edge_count), take('B', edge_count)
+        
+        return graph
+
+def build_graph(scripts: Iterable[ScriptCalls]) -> Graph:
+    names: list[str] = []
+    nodes: dict[str, int] = {}
+    
+    def node(name: str) -> int:
+        i = nodes.get(name)
+        if i is None:
+            i = nodes[name] = len(names)
+            names.append(name)
+        return i
+    
+    scripts = list(scripts)
+    public: dict[str, list[int]] = {}
+    
+    # every defined function gets a node first, so imports can be resolved to them
+    script_nodes = []
+    for script in scripts:
+        script_nodes.append([node(f"{script.path}:{name}") for name, _ in script.functions])
+        
+        for (name, is_public), i in zip(script.functions, script_nodes[-1]):
+            if is_public:
+                public.setdefault(f"fn:{name}", []).append(i)
+    
+    edges = []
+    for script, functions in zip(scripts, script_nodes):
+        for caller, target, kind in script.calls:
+            source = functions[caller]
+            
+            if isinstance(target, int):
+                edges.append((source, functions[target], kind))
+            elif target in public:
+                edges.extend((source, callee, kind) for callee in public[target])
+            else:
+                edges.append((source, node(target), kind))
+    
+    return Graph(names, edges)
+
+def build_corpus_graph(filenames: list[str], workers: int | None = 1) -> Graph:
+    if workers == 1:
+        return build_graph(map(file_calls, filenames))
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return build_graph(pool.map(file_calls, filenames, chunksize=4))
@@ -0,0 +1,350 @@
+"""
+Compact binary form of a decoded Script (.ksmi files), for passing scripts between tools
+without paying for generating and parsing yaml every time.
+
+A file is the magic b'KSMI', the format version as a u32 and then the Script as a single value.
+Values are written depth first, each one a tag byte followed by its payload:
+
+    NONE, FALSE, TRUE
+    INT      zigzag varint
+    FLOAT    f64
+    STR      varint byte length, utf-8 (gets the next string index)
+    STR_REF  varint string index of an earlier STR
+    LIST     varint length, then the items
+    WORDS    varint length, then the u32s themselves (function code)
+    OBJECT   type, then the value of each of the type's fields (gets the next object index)
+    REF      varint object index of an earlier OBJECT
+    ENUM     type, zigzag varint value
+
+A type is a varint index into the types seen so far. The first time a type is used its index is the
+number of types seen so far, and its definition follows: its name, and for dataclasses its field names.
+Fields are matched by name when reading, so reordering fields of a class doesn't break older files,
+and fields added since a file was written get their default.
+
+Any object that is referenced from more than one place (a Var used by many instructions,
+functions that start each other as threads) is written once and referred to with REF afterwards,
+so reading a file gives back the same object graph that was written.
+"""
+from array import array
+from dataclasses import MISSING, fields, is_dataclass
+from enum import Enum
+import struct
+from sys import intern
+from typing import Any, Callable
+
+import cmds
+import functions
+import other_types
+import script
+import tables
+import variables
+
+MAGIC = b'KSMI'
+# bump this whenever the encoding changes in a way older readers can't handle
+FORMAT_VERSION = 1
+
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_STR_REF = 6
+TAG_LIST = 7
+TAG_WORDS = 8
+TAG_OBJECT = 9
+TAG_REF = 10
+TAG_ENUM = 11
+
+FLOAT = struct.Struct('<d')
+
+def type_name(cls: type) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+def known_types() -> dict[str, type]:
+    """The classes a file may contain, which is every dataclass and enum of the model."""
+    types = {}
+    
+    for module in [cmds, functions, other_types, script, tables, variables]:
+        for value in vars(module).values():
+            if isinstance(value, type) and value.__module__ == module.__name__ \
+                    and (is_dataclass(value) or issubclass(value, Enum)):
+                types[type_name(value)] = value
+    
+    return types
+
+class Encoder:
+    out: bytearray
+    strings: dict[str, int]
+    # by id(), the objects are all kept alive by the value being encoded
+    objects: dict[int, int]
+    types: dict[type, int]
+    field_names: dict[type, list[str]]
+    
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+        self.objects = {}
+        self.types = {}
+        self.field_names = {}
+    
+    def write_uint(self, n: int):
+        out = self.out
+        while n >= 0x80:
+            out.append(n & 0x7f | 0x80)
+            n >>= 7
+        out.append(n)
+    
+    def write_int(self, n: int):
+        self.write_uint(n << 1 if n >= 0 else (-n << 1) - 1)
+    
+    def write_str(self, string: str):
+        data = string.encode('utf-8')
+        self.write_uint(len(data))
+        self.out += data
+    
+    def write_type(self, cls: type):
+        index = self.types.get(cls)
+        if index is not None:
+            self.write_uint(index)
+            return
+        
+        self.types[cls] = len(self.types)
+        self.write_uint(len(self.types) - 1)
+        self.write_str(type_name(cls))
+        
+        if is_dataclass(cls):
+            names = [field.name for field in fields(cls)]
+            self.field_names[cls] = names
+            
+            self.write_uint(len(names))
+            for name in names:
+                self.write_str(name)
+    
+    def encode(self, root: Any) -> bytes:
+        out = self.out
+        
+        # an explicit stack instead of recursion, chains of functions referencing
+        # each other can go far deeper than python's recursion limit
+        stack = [root]
+        
+        while stack:
+            value = stack.pop()
+            
+            if value is None:
+                out.append(TAG_NONE)
+            elif value is True:
+                out.append(TAG_TRUE)
+            elif value is False:
+                out.append(TAG_FALSE)
+            elif isinstance(value, Enum):
+                out.append(TAG_ENUM)
+                self.write_type(type(value))
+                self.write_int(value.value)
+            elif isinstance(value, int):
+                out.append(TAG_INT)
+                self.write_int(value)
+            elif isinstance(value, float):
+                out.append(TAG_FLOAT)
+                out += FLOAT.pack(value)
+            elif isinstance(value, str):
+                index = self.strings.get(value)
+                if index is not None:
+                    out.append(TAG_STR_REF)
+                    self.write_uint(index)
+                else:
+                    self.strings[value] = len(self.strings)
+                    out.append(TAG_STR)
+                    self.write_str(value)
+            elif isinstance(value, list):
+                out.append(TAG_LIST)
+                self.write_uint(len(value))
+                stack.extend(reversed(value))
+            elif isinstance(value, (array, memoryview)):
+                assert value.itemsize == 4, "Only arrays of words can be encoded"
+                out.append(TAG_WORDS)
+                self.write_uint(len(value))
+                out += value.tobytes()
+            elif is_dataclass(value):
+                index = self.objects.get(id(value))
+                if index is not None:
+                    out.append(TAG_REF)
+                    self.write_uint(index)
+                    continue
+                
+                self.objects[id(value)] = len(self.objects)
+                out.append(TAG_OBJECT)
+                self.write_type(type(value))
+                stack.extend(getattr(value, name) for name in reversed(self.field_names[type(value)]))
+            else:
+                raise TypeError(f"Can't encode {type(value).__name__} values")
+        
+        return bytes(out)
+
+class Decoder:
+    data: memoryview
+    pos: int
+    strings: list[str]
+    objects: list[Any]
+    # (class, field names or None for enums)
+    types: list[tuple[type, list[str] | None]]
+    # what to fill in the fields that were added to a class since the file was written with, by class
+    defaults: dict[type, list[tuple[str, Callable[[], Any]]]]
+    known_types: dict[str, type]
+    
+    def __init__(self, data: bytes | memoryview):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.strings = []
+        self.objects = []
+        self.types = []
+        self.defaults = {}
+        self.known_types = known_types()
+    
+    def read_uint(self) -> int:
+        data = self.data
+        result = 0
+        shift = 0
+        
+        while True:
+            byte = data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7f) << shift
+            
+            if byte < 0x80:
+                return result
+            shift += 7
+    
+    def read_int(self) -> int:
+        n = self.read_uint()
+        return -((n + 1) >> 1) if n & 1 else n >> 1
+    
+    def read_str(self) -> str:
+        length = self.read_uint()
+        string = str(self.data[self.pos:self.pos + length], 'utf-8')
+        self.pos += length
+        return string
+    
+    def read_type(self) -> tuple[type, list[str] | None]:
+        index = self.read_uint()
+        if index < len(self.types):
+            return self.types[index]
+        
+        assert index == len(self.types), "Corrupt intermediate file (bad type index)"
+        
+        name = self.read_str()
+        assert name in self.known_types, f"Intermediate file contains unknown type {name}"
+        cls = self.known_types[name]
+        
+        if issubclass(cls, Enum):
+            names = None
+        else:
+            # the classes are slotted, so fields that were removed since the file was written get skipped (None)
+            current = {field.name for field in fields(cls)}
+            names = [name if name in current else None for name in (self.read_str() for _ in range(self.read_uint()))]
+            
+            added = [field for field in fields(cls) if field.name not in names]
+            if len(added) > 0:
+                for field in added:
+                    assert field.default is not MISSING or field.default_factory is not MISSING, \
+                        f"Intermediate file is missing {name}.{field.name}, which has no default"
+                
+                self.defaults[cls] = [(field.name, field.default_factory if field.default is MISSING else (lambda value=field.default: value))
+                                      for field in added]
+        
+        self.types.append((cls, names))
+        return cls, names
+    
+    def decode(self) -> Any:
+        # the mirror image of Encoder.encode: containers are created as soon as their tag is read,
+        # handed to whatever contains them and then filled in from the stack,
+        # which is also what makes references to objects that are still being filled in work
+        root = []
+        # [container, field names or None for lists, how many items are filled in, how many there are]
+        stack: list[list] = [[root, None, 0, 1]]
+        
+        while stack:
+            frame = stack[-1]
+            if frame[2] == frame[3]:
+                stack.pop()
+                continue
+            
+            tag = self.data[self.pos]
+            self.pos += 1
+            child = None
+            
+            if tag == TAG_NONE:
+                value = None
+            elif tag == TAG_FALSE:
+                value = False
+            elif tag == TAG_TRUE:
+                value = True
+            elif tag == TAG_INT:
+                value = self.read_int()
+            elif tag == TAG_FLOAT:
+                value = FLOAT.unpack_from(self.data, self.pos)[0]
+                self.pos += FLOAT.size
+            elif tag == TAG_STR:
+                # shared with the same names in other scripts read into this process
+                value = intern(self.read_str())
+                self.strings.append(value)
+            elif tag == TAG_STR_REF:
+                value = self.strings[self.read_uint()]
+            elif tag == TAG_LIST:
+                value = []
+                child = [value, None, 0, self.read_uint()]
+            elif tag == TAG_WORDS:
+                length = self.read_uint() * 4
+                value = array('I')
+                value.frombytes(self.data[self.pos:self.pos + length])
+                self.pos += length
+            elif tag == TAG_OBJECT:
+                cls, names = self.read_type()
+                value = cls.__new__(cls)
+                self.objects.append(value)
+                
+                if cls in self.defaults:
+                    for field_name, default in self.defaults[cls]:
+                        object.__setattr__(value, field_name, default())
+                child = [value, names, 0, len(names)]
+            elif tag == TAG_REF:
+                value = self.objects[self.read_uint()]
+            elif tag == TAG_ENUM:
+                cls, _ = self.read_type()
+                value = cls(self.read_int())
+            else:
+                raise ValueError(f"Corrupt intermediate file (unknown tag {tag} at {self.pos - 1})")
+            
+            container, names, filled, _ = frame
+            if names is None:
+                container.append(value)
+            elif names[filled] is not None:
+                # works for frozen dataclasses too
+                object.__setattr__(container, names[filled], value)
+            frame[2] += 1
+            
+            if child is not None:
+                stack.append(child)
+        
+        assert self.pos == len(self.data), "Corrupt intermediate file (trailing data)"
+        return root[0]
+
+def write_intermediate(value: script.Script, out_filename: str):
+    with open(out_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', FORMAT_VERSION))
+        f.write(Encoder().encode(value))
+
+def read_intermediate(filename: str) -> script.Script:
+    with open(filename, 'rb') as f:
+        data = f.read()
+    
+    assert data[:4] == MAGIC, "Not an intermediate (.ksmi) file"
+    
+    version, = struct.unpack_from('<I', data, 4)
+    assert version == FORMAT_VERSION, f"Intermediate file has format version {version}, this tool reads version {FORMAT_VERSION}"
+    
+    value = Decoder(memoryview(data)[8:]).decode()
+    assert isinstance(value, script.Script), "Intermediate file doesn't contain a script"
+    
+    return value
@@ -0,0 +1,176 @@
+"""
+Reading parts of a script without converting all of it, for tools that only need one function or the imports:
+
+    import ksm_file
+
+    ksm = ksm_file.KsmFile.open('script.bin')
+    names = [fn.name for fn in ksm.imports]
+    instructions = ksm.function('main').instructions
+    tenth = ksm.instruction('main', 9)
+
+Opening a file only reads the container header. Every other part is read the first time it's used and kept after that,
+and a function's code is only decoded once that function is asked for.
+A single instruction can be decoded without the ones before it, see instruction(). The file is mapped by default,
+so the parts that are never used are never even read from disk.
+"""
+from functools import cached_property
+from itertools import chain
+from typing import Any
+
+import cmds # makes sure the circular imports between the modules resolve
+from container import read_input_file, read_ksm_container
+from functions import (CodeIndex, FunctionDef, add_local_symbols, add_thread_references, decode_code_range, decode_instruction, index_code,
+                       read_function_definitions)
+from other_types import ScriptImport, read_function_imports
+from script import Script, read_section_0
+from tables import Table, read_table_defs
+from util import SymbolIds
+from variables import Var, VarCategory, add_temp_vars, read_variable_defs
+
+class KsmFile:
+    filename: str | None
+    sections: list[bytes] | list[memoryview]
+    # ids of the functions each decoded function starts as Thread and Thread2, by index in definitions
+    thread_ids: dict[int, tuple[list[int], list[int]]]
+    # where the instructions of the functions instruction() was used on start, by index in definitions
+    code_indices: dict[int, CodeIndex]
+    
+    def __init__(self, sections: list[bytes] | list[memoryview], filename: str | None = None):
+        self.filename = filename
+        self.sections = sections
+        self.thread_ids = {}
+        self.code_indices = {}
+    
+    @classmethod
+    def open(cls, filename: str, use_mmap: bool = True) -> 'KsmFile':
+        return cls(read_ksm_container(read_input_file(filename, use_mmap)), filename)
+    
+    @cached_property
+    def section_0(self) -> int:
+        return read_section_0(self.sections)
+    
+    @cached_property
+    def variables(self) -> tuple[list[Var], list[Var], list[Var]]:
+        """(static variables, constants, global variables), from sections 2, 4 and 6."""
+        return (read_variable_defs(self.sections[2], VarCategory.Static),
+                read_variable_defs(self.sections[4], VarCategory.Const),
+                read_variable_defs(self.sections[6], VarCategory.Global))
+    
+    @property
+    def static_variables(self) -> list[Var]:
+        return self.variables[0]
+    
+    @property
+    def constants(self) -> list[Var]:
+        return self.variables[1]
+    
+    @property
+    def global_variables(self) -> list[Var]:
+        return self.variables[2]
+    
+    @cached_property
+    def imports(self) -> list[ScriptImport]:
+        return read_function_imports(self.sections[5])
+    
+    @cached_property
+    def tables(self) -> list[Table]:
+        # the values of Var tables are looked up among what read_script has read before the tables
+        return read_table_defs(self.sections[3], self.sections[7], self.variable_symbols())
+    
+    @cached_property
+    def definitions(self) -> list[FunctionDef]:
+        """Every function with its variables, tables and labels, their code is only decoded by function() and decode()."""
+        return read_function_definitions(self.sections[1], self.sections[7])
+    
+    @cached_property
+    def function_indices(self) -> dict[str, int]:
+        """Where each named function is in definitions."""
+        return {fn.name: i for i, fn in enumerate(self.definitions) if fn.name is not None}
+    
+    def variable_symbols(self) -> SymbolIds:
+        symbol_ids = SymbolIds()
+        
+        for var in chain(*self.variables):
+            symbol_ids.add(var)
+        add_temp_vars(symbol_ids)
+        
+        for fn in self.imports:
+            symbol_ids.add(fn)
+        
+        return symbol_ids
+    
+    @cached_property
+    def symbol_ids(self) -> SymbolIds:
+        """Everything defined at script level, added in the same order read_script adds it in."""
+        symbol_ids = self.variable_symbols()
+        
+        for table in self.tables:
+            symbol_ids.add(table)
+        for fn in self.definitions:
+            symbol_ids.add(fn)
+        
+        return symbol_ids
+    
+    def function_index(self, name: str) -> int:
+        index = self.function_indices.get(name)
+        assert index is not None, f"There's no function called {name}"
+        
+        return index
+    
+    def function(self, name: str) -> FunctionDef:
+        """The function called name, with its instructions decoded."""
+        return self.decode(self.function_index(name))
+    
+    def instruction(self, name: str, n: int) -> Any:
+        """
+        Instruction n of the function called name. Unless the whole function was decoded already,
+        only that instruction gets decoded (and the Threads it's in the body of, for their captured variables).
+        """
+        index = self.function_index(name)
+        fn = self.definitions[index]
+        
+        if fn.instructions is not None:
+            return fn.instructions[n]
+        
+        code_index = self.code_indices.get(index)
+        if code_index is None:
+            code_index = self.code_indices[index] = index_code(fn.code)
+        
+        assert 0 <= n < len(code_index), f"{name} has {len(code_index)} instructions"
+        
+        symbol_ids = self.symbol_ids
+        with symbol_ids.scope():
+            add_local_symbols(fn, symbol_ids)
+            return decode_instruction(fn, symbol_ids, code_index, n)
+    
+    def decode(self, index: int) -> FunctionDef:
+        """
+        The function at index in definitions, with its instructions decoded.
+        The thread references of other functions are left alone, script adds all of them.
+        """
+        fn = self.definitions[index]
+        
+        if fn.instructions is None and len(fn.code) > 0:
+            symbol_ids = self.symbol_ids
+            
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                decoded = decode_code_range(fn, symbol_ids)
+                fn.instructions, fn.truncated_at = decoded.instructions, decoded.truncated_at
+                self.thread_ids[index] = decoded.thread_ids, decoded.thread2_ids
+        
+        return fn
+    
+    @cached_property
+    def script(self) -> Script:
+        """Everything in the file, with every function decoded, the same as read_script gives."""
+        for i in range(len(self.definitions)):
+            self.decode(i)
+        
+        # in function order no matter which ones were decoded first, like analyze_function_defs does it
+        for i, fn in enumerate(self.definitions):
+            if i in self.thread_ids:
+                add_thread_references(fn, *self.thread_ids[i], self.symbol_ids)
+        
+        return Script(self.section_0, self.static_variables, self.constants, self.global_variables,
+                      self.imports, self.tables, self.definitions)
@@ -1,92 +1,110 @@
 #!/bin/env python3
-from array import array
-from struct import unpack
-from sys import argv
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from glob import glob, has_magic
+import os
+from sys import argv, exit, stderr
+from tempfile import TemporaryFile
+from traceback import format_exception_only
 from typing import TypeVar
 
 import yaml
 
-from cmds import cmd_from_string
-from functions import parse_function_definitions, print_function_definitions, print_function_imports
-from other_types import parse_imports
-from tables import print_tables
+from cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, Cache
+from assembler import assemble_script
+from container import read_input_file, read_ksm_container, write_ksm_container, write_ksm_file
+from functions import FunctionMemo
+from intermediate import read_intermediate, write_intermediate
+import profiling
+from script import BodyPool, Script, read_script, script_from_yaml, script_to_sections, write_script_yaml
+from stream_assembler import StreamingAssembler, read_bodies, read_without_bodies
 from util import SymbolIds
-from variables import VarCategory, parse_variables, write_variables_yaml
 
 T = TypeVar('T')
 
-def read_ksm_container(file: bytes) -> list[bytes]:
-    header = list(unpack('4siiiiiiiiii', file[:0x2c]))
-    assert header[0] == b'KSMR'
-    assert header[1] == 0x10300
-    assert header[10] == 0
+def ksm_to_yaml(filename: str, out_filename: str | None = None, cache: Cache | None = None, use_mmap: bool = False, jobs: int = 1):
+    if out_filename is None:
+        out_filename = filename + '.yaml'
     
-    header[10] = len(file) // 4
+    var_filename = out_filename[:-len('.yaml')] + '.variables.yaml'
     
-    # god python can be so beautiful
-    sections = [file[start * 4:end * 4] for start, end in zip(header[2:], header[3:])]
-    return sections
-
-def print_section_0(sections: list[bytes]) -> str:
-    section = sections[0]
-    arr = array('I', section)
+    with profiling.stage('read input'):
+        input_file = read_input_file(filename, use_mmap)
     
-    assert len(arr) == 3
-    assert arr[0] == 0
-    assert arr[1] == 0
+    if cache is not None:
+        key = cache.key(input_file)
+        
+        if cache.fetch(key + '.yaml', out_filename) and cache.fetch(key + '.variables.yaml', var_filename):
+            return
     
-    out_str = 'section_0:\n'
-    out_str += f"  - {hex(arr[2])} # mysterious number\n"
+    with profiling.stage('read container'):
+        sections = read_ksm_container(input_file)
     
-    return out_str
-
-def ksm_to_yaml(filename: str):
-    with open(filename, 'rb') as f:
-        input_file = f.read()
+    symbol_ids = SymbolIds()
     
-    sections = read_ksm_container(input_file)
+    # the function bodies get decoded while printing, so the ones in the memo don't have to be
+    with profiling.stage('read symbols'):
+        script = read_script(sections, symbol_ids, analyze=False)
+    memo = FunctionMemo(cache, filename) if cache is not None else None
     
-    symbol_ids = SymbolIds()
-    write_variables_yaml(sections, symbol_ids)
+    if jobs > 1:
+        # the workers time what they do themselves, so in here it's only how long waiting for them took
+        with profiling.stage('write yaml'), BodyPool(sections, jobs, script.definitions) as pool:
+            write_script_yaml(script, out_filename, var_filename, symbol_ids, memo, pool.render)
+    else:
+        with profiling.stage('write yaml'):
+            write_script_yaml(script, out_filename, var_filename, symbol_ids, memo)
     
-    # output main yaml
-    main_out_str = print_section_0(sections)
-
-    main_out_str += print_function_imports(sections, symbol_ids)
-    main_out_str += print_tables(sections, symbol_ids)
-    main_out_str += print_function_definitions(sections, symbol_ids)
+    profiling.count_files(read=(filename,), written=(out_filename, var_filename))
     
-    with open(argv[1] + '.yaml', 'w') as f:
-        f.write(main_out_str)
+    if cache is not None:
+        memo.save()
+        cache.store(key + '.variables.yaml', var_filename)
+        cache.store(key + '.yaml', out_filename)
 
-def write_ksm_container(sections: list[bytearray]) -> bytes:
-    section_indices = [2 + len(sections)]
-    for section in sections[:-1]:
-        assert len(section) % 4 == 0
-        section_indices.append(section_indices[-1] + len(section) // 4)
+def ksm_to_intermediate(filename: str, out_filename: str | None = None, cache: Cache | None = None, use_mmap: bool = False):
+    if out_filename is None:
+        out_filename = filename + '.ksmi'
     
-    out_arr = array('I', b'KSMR\0\x03\x01\0')
-    out_arr.extend(section_indices)
+    input_file = read_input_file(filename, use_mmap)
     
-    out = bytearray(out_arr)
-    for section in sections:
-        out.extend(section)
+    if cache is not None:
+        key = cache.key(input_file)
+        
+        if cache.fetch(key + '.ksmi', out_filename):
+            return
     
-    return bytes(out)
+    write_intermediate(read_script(read_ksm_container(input_file)), out_filename)
+    
+    if cache is not None:
+        cache.store(key + '.ksmi', out_filename)
 
-def parse_section_0(input_file: dict) -> bytearray:
-    section_0 = input_file['section_0']
-    assert isinstance(section_0, list), "Section 0 has invalid"
-    assert len(section_0) == 1, "Section 0 has invalid"
-    assert isinstance(section_0[0], int), "Section 0 has invalid"
+def intermediate_to_yaml(filename: str, out_filename: str | None = None):
+    if out_filename is None:
+        out_filename = filename[:-len('.ksmi')] + '.yaml'
+    
+    var_filename = out_filename[:-len('.yaml')] + '.variables.yaml'
     
-    out_arr = array('I', [0, 0, section_0[0]])
-    return bytearray(out_arr)
+    write_script_yaml(read_intermediate(filename), out_filename, var_filename)
 
-def yaml_to_ksm(filename: str):
+def intermediate_to_ksm(filename: str, out_filename: str | None = None):
+    if out_filename is None:
+        if filename.endswith('.bin.ksmi'):
+            out_filename = filename[:-len('.bin.ksmi')] + '_modified.bin'
+        else:
+            out_filename = filename[:-len('.ksmi')] + '.bin'
+    
+    script = read_intermediate(filename)
+    
+    with open(out_filename, 'wb') as f:
+        f.write(write_ksm_container(script_to_sections(script)))
+
+def read_yaml_files(filename: str, bodies: bool = True) -> tuple[dict, dict]:
+    """The main and variables yaml files of a script, without the function bodies (see read_without_bodies) unless bodies."""
     # main input file
-    with open(filename, 'r') as f:
-        input_file = yaml.safe_load(f)
+    with profiling.stage('load yaml'), open(filename, 'r') as f:
+        input_file = yaml.safe_load(f) if bodies else read_without_bodies(f)
     
     assert isinstance(input_file, dict) and 'section_0' in input_file, "Input yaml file has to be a dictionary \
         containing the properties 'section_0' and optionally 'tables' and 'definitions'."
@@ -94,51 +112,358 @@ def yaml_to_ksm(filename: str):
     # var input file
     var_filename = filename[:-len('.yaml')] + '.variables.yaml'
     
-    with open(var_filename, 'r') as f:
+    with profiling.stage('load yaml'), open(var_filename, 'r') as f:
         var_input_file = yaml.safe_load(f)
     
     assert isinstance(var_input_file, dict), "Input variables yaml file has to be a dict."
     
-    sections: dict[int, bytearray] = {}
+    profiling.count_files(read=(filename, var_filename))
+    
+    return input_file, var_input_file
+
+def read_yaml_script(filename: str) -> Script:
+    input_file, var_input_file = read_yaml_files(filename)
+    
     symbol_ids = SymbolIds()
+    with profiling.stage('read symbols'):
+        script = script_from_yaml(input_file, var_input_file, symbol_ids)
+    with profiling.stage('assemble'):
+        assemble_script(script, symbol_ids)
+    
+    return script
+
+def yaml_to_ksm(filename: str, out_filename: str | None = None, stream: bool = False):
+    if out_filename is None:
+        if filename.endswith('.bin.yaml'):
+            out_filename = filename[:-len('.bin.yaml')] + '_modified.bin'
+        else:
+            out_filename = filename + '.bin'
     
-    # section 0
-    sections[0] = parse_section_0(input_file)
-    funcs, sections[1] = parse_function_definitions(input_file, symbol_ids)
-    sections[2] = parse_variables(var_input_file, 'static_variables', VarCategory.Static, symbol_ids)
-    # TODO: tables
-    sections[4] = parse_variables(var_input_file, 'constants', VarCategory.Const, symbol_ids)
-    sections[5] = parse_imports(input_file, symbol_ids)
-    sections[6] = parse_variables(var_input_file, 'global_variables', VarCategory.Global, symbol_ids)
+    if stream:
+        stream_yaml_to_ksm(filename, out_filename)
+        return
     
-    for fn in funcs:
-        assert fn.instruction_strs is not None
-        fn.instructions = [cmd_from_string(line, fn, symbol_ids) for line in fn.instruction_strs]
+    script = read_yaml_script(filename)
     
-    # sections[7] = ...
+    with profiling.stage('write container'), open(out_filename, 'wb') as f:
+        f.write(write_ksm_container(script_to_sections(script)))
     
-    section_list = [sections.get(i, bytearray([0, 0, 0, 0])) for i in range(9)]
+    profiling.count_files(written=(out_filename,))
+
+def stream_yaml_to_ksm(filename: str, out_filename: str):
+    """Like yaml_to_ksm, assembling one function at a time with the code kept in temporary files (see stream_assembler)."""
+    input_file, var_input_file = read_yaml_files(filename, bodies=False)
+    
+    symbol_ids = SymbolIds()
+    with profiling.stage('read symbols'):
+        script = script_from_yaml(input_file, var_input_file, symbol_ids)
     
-    if filename.endswith('.bin.yaml'):
-        out_filename = filename[:-len('.bin.yaml')] + '_modified.bin'
+    with TemporaryFile() as code, TemporaryFile() as records:
+        assembler = StreamingAssembler(script, symbol_ids, code, records)
+        
+        with profiling.stage('assemble'), open(filename, 'r') as f:
+            for fn, body in zip(script.definitions, read_bodies(f), strict=True):
+                assembler.add(fn, body)
+            
+            assembler.finish()
+        
+        with profiling.stage('write container'):
+            write_ksm_file(out_filename, assembler.sections())
+    
+    profiling.count_files(written=(out_filename,))
+
+def yaml_to_intermediate(filename: str, out_filename: str | None = None):
+    if out_filename is None:
+        out_filename = filename[:-len('.yaml')] + '.ksmi'
+    
+    write_intermediate(read_yaml_script(filename), out_filename)
+
+def convert(filename: str, output_format: str | None = None, cache: Cache | None = None, use_mmap: bool = False, jobs: int = 1,
+            stream: bool = False):
+    """
+    Converts a .bin, .yaml or .ksmi file, to yaml, ksmi or bin. Without an output format .yaml files become .bin, everything else yaml.
+    jobs is how many processes decode the functions of a .bin file converted to yaml,
+    stream assembles .yaml files one function at a time (see stream_yaml_to_ksm).
+    """
+    if filename.endswith('.bin'):
+        match output_format:
+            case None | 'yaml':
+                ksm_to_yaml(filename, cache=cache, use_mmap=use_mmap, jobs=jobs)
+            case 'ksmi':
+                ksm_to_intermediate(filename, cache=cache, use_mmap=use_mmap)
+            case _:
+                raise ValueError(f"Can't convert a .bin file to {output_format}")
+    elif filename.endswith('.ksmi'):
+        match output_format:
+            case None | 'yaml':
+                intermediate_to_yaml(filename)
+            case 'bin':
+                intermediate_to_ksm(filename)
+            case _:
+                raise ValueError(f"Can't convert a .ksmi file to {output_format}")
+    elif filename.endswith('.yaml'):
+        match output_format:
+            case None | 'bin':
+                yaml_to_ksm(filename, stream=stream)
+            case 'ksmi':
+                yaml_to_intermediate(filename)
+            case _:
+                raise ValueError(f"Can't convert a .yaml file to {output_format}")
     else:
-        out_filename = filename + '.bin'
+        raise ValueError("Unsupported file type")
+
+def convert_file(filename: str, output_format: str | None = None, cache: Cache | None = None, use_mmap: bool = False) -> str | None:
+    """Converts a single file, returning an error message instead of raising."""
+    try:
+        convert(filename, output_format, cache, use_mmap)
+    except Exception as e:
+        return ''.join(format_exception_only(e)).strip()
     
-    with open(out_filename, 'wb') as f:
-        f.write(write_ksm_container(section_list))
+    return None
+
+def is_batch_input(filename: str, assemble: bool) -> bool:
+    if assemble:
+        return filename.endswith('.yaml') and not filename.endswith('.variables.yaml')
+    else:
+        return filename.endswith('.bin')
+
+def collect_batch_inputs(patterns: list[str], assemble: bool) -> list[str]:
+    filenames: list[str] = []
+    
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                filenames.extend(os.path.join(root, file) for file in sorted(files) if is_batch_input(file, assemble))
+        elif has_magic(pattern):
+            filenames.extend(file for file in sorted(glob(pattern, recursive=True))
+                             if os.path.isfile(file) and is_batch_input(file, assemble))
+        else:
+            filenames.append(pattern)
+    
+    # a file matched by several patterns only gets converted once
+    return list(dict.fromkeys(filenames))
+
+def run_batch(filenames: list[str], workers: int | None, output_format: str | None, cache: Cache | None, use_mmap: bool) -> int:
+    convert = partial(convert_file, output_format=output_format, cache=cache, use_mmap=use_mmap)
+    
+    if workers == 1:
+        results = map(convert, filenames)
+        failures = report_batch_results(filenames, results)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # small chunks keep the ordered output flowing while amortizing the IPC per file
+            chunksize = max(1, min(32, len(filenames) // ((workers or os.cpu_count() or 1) * 4)))
+            results = pool.map(convert, filenames, chunksize=chunksize)
+            failures = report_batch_results(filenames, results)
+    
+    if cache is not None:
+        cache.evict()
+    
+    print(f"{len(filenames) - failures} of {len(filenames)} files converted")
+    return failures
+
+def report_batch_results(filenames: list[str], results) -> int:
+    failures = 0
+    
+    # results come back in input order, no matter which worker finished first
+    for filename, error in zip(filenames, results):
+        if error is None:
+            print(f"ok      {filename}")
+        else:
+            failures += 1
+            print(f"FAILED  {filename}: {error}", file=stderr)
+    
+    return failures
+
+def add_common_arguments(parser: ArgumentParser):
+    parser.add_argument('-f', '--format', choices=['yaml', 'ksmi', 'bin'], default=None,
+                        help="what to convert to, ksmi is a compact binary form of the disassembly for passing it between tools "
+                             "(default: bin for .yaml input, yaml for everything else)")
+    parser.add_argument('--mmap', action='store_true',
+                        help="map .bin files into memory instead of reading them, so only the parts being decoded get loaded")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always disassemble, without reading or writing the disassembly cache")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"where disassembled output is cached (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB',
+                        help="size the cache gets trimmed down to, least recently used files first (default: %(default)s)")
+
+def cache_from_options(options) -> Cache | None:
+    if options.no_cache:
+        return None
+    
+    return Cache(options.cache_dir, options.cache_size * 1024 * 1024)
+
+def batch_main(args: list[str]) -> int:
+    parser = ArgumentParser(prog='main.py batch', description="Convert many KSM scripts or yaml files at once.")
+    parser.add_argument('inputs', nargs='+', metavar='dir | glob | file',
+                        help="directories are searched recursively for .bin files (or .yaml files with --assemble)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--assemble', action='store_true',
+                        help="pick up .yaml files instead of .bin files from directories and globs")
+    add_common_arguments(parser)
+    options = parser.parse_args(args)
+    
+    assert options.workers is None or options.workers > 0, "Worker count has to be positive"
+    
+    filenames = collect_batch_inputs(options.inputs, options.assemble)
+    if len(filenames) == 0:
+        print("No input files found", file=stderr)
+        return 1
+    
+    failures = run_batch(filenames, options.workers, options.format, cache_from_options(options), options.mmap)
+    return 1 if failures > 0 else 0
+
+DEFAULT_INDEX = 'ksm-xref.sqlite'
+
+def index_main(args: list[str]) -> int:
+    # imported here since xref needs this module
+    from xref import XrefIndex
+    
+    parser = ArgumentParser(prog='main.py index', description="Index where the functions, variables and tables of KSM scripts are used, "
+                                                              "updating only the files that changed. Query it with 'main.py xref'.")
+    parser.add_argument('inputs', nargs='+', metavar='dir | glob | file', help="directories are searched recursively for .bin files")
+    parser.add_argument('--db', default=DEFAULT_INDEX, help="the index file (default: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of worker processes decoding files (default: number of CPUs)")
+    options = parser.parse_args(args)
+    
+    assert options.workers is None or options.workers > 0, "Worker count has to be positive"
+    
+    with XrefIndex(options.db) as index:
+        indexed, removed, failures = index.update(collect_batch_inputs(options.inputs, False), options.workers)
+    
+    for filename, error in failures:
+        print(f"FAILED  {filename}: {error}", file=stderr)
+    
+    print(f"{indexed} files indexed, {removed} removed, {len(failures)} failed")
+    return 1 if len(failures) > 0 else 0
+
+def xref_main(args: list[str]) -> int:
+    from xref import Access, XrefIndex
+    
+    parser = ArgumentParser(prog='main.py xref', description="List where symbols are used, from an index built with 'main.py index'.")
+    parser.add_argument('symbol', help="named like in the yaml, e.g. fn:name, Global:name or table:name, * and ? match anything")
+    parser.add_argument('--db', default=DEFAULT_INDEX, help="the index file (default: %(default)s)")
+    parser.add_argument('--access', choices=[access.name.lower() for access in Access],
+                        help="only list places where the symbol is read, written or called")
+    parser.add_argument('--files', action='store_true', help="only list the files")
+    options = parser.parse_args(args)
+    
+    assert os.path.exists(options.db), f"There's no index at {options.db}, build one with 'main.py index'"
+    
+    access = Access[options.access.capitalize()] if options.access is not None else None
+    with XrefIndex(options.db) as index:
+        references = index.query(options.symbol, access)
+    
+    if options.files:
+        for path in dict.fromkeys(path for path, *_ in references):
+            print(path)
+    else:
+        for path, function, offset, access, symbol in references:
+            print(f"{path}  {function}  {offset:#x}  {access.name.lower():<5}  {symbol}")
+    
+    return 0 if len(references) > 0 else 1
+
+DEFAULT_GRAPH = 'ksm-calls.ksmg'
+
+def graph_main(args: list[str]) -> int:
+    from graph import ALL_KINDS, EdgeKind, Graph, build_corpus_graph
+    
+    parser = ArgumentParser(prog='main.py graph', description="Build a call graph of KSM scripts and query it. "
+                                                              "Functions are named path:function, imports nothing defines fn:name.")
+    parser.add_argument('inputs', nargs='*', metavar='dir | glob | file',
+                        help="(re)build the graph from these, directories are searched recursively for .bin files")
+    parser.add_argument('--graph', default=DEFAULT_GRAPH, help="the graph file (default: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="number of worker processes decoding files (default: number of CPUs)")
+    parser.add_argument('--kind', action='append', dest='kinds', choices=[kind.name for kind in EdgeKind],
+                        help="only follow these edges (can be given more than once, default: all)")
+    parser.add_argument('--callers', metavar='NAME', help="list what calls NAME")
+    parser.add_argument('--transitive', action='store_true', help="with --callers, also list what calls those, and so on")
+    parser.add_argument('--reachable', metavar='NAME', help="list everything reachable from NAME")
+    parser.add_argument('--cycles', action='store_true', help="list the groups of functions that call each other")
+    options = parser.parse_args(args)
+    
+    assert options.workers is None or options.workers > 0, "Worker count has to be positive"
+    
+    if len(options.inputs) > 0:
+        graph = build_corpus_graph(collect_batch_inputs(options.inputs, False), options.workers)
+        graph.write(options.graph)
+        print(f"{len(graph.names)} nodes, {len(graph.targets)} edges", file=stderr)
+    else:
+        assert os.path.exists(options.graph), f"There's no graph at {options.graph}, build one by giving the scripts"
+        graph = Graph.read(options.graph)
+    
+    kinds = frozenset(EdgeKind[kind] for kind in options.kinds) if options.kinds is not None else ALL_KINDS
+    
+    if options.callers is not None:
+        for node in graph.callers_of(graph.node(options.callers), kinds, options.transitive):
+            print(graph.names[node])
+    
+    if options.reachable is not None:
+        for node in graph.reachable([graph.node(options.reachable)], kinds)[1:]:
+            print(graph.names[node])
+    
+    if options.cycles:
+        for component in graph.cycles(kinds):
+            print(' '.join(graph.names[node] for node in component))
+    
+    return 0
 
 def main():
-    if len(argv) == 1 or argv[1] == '--help' or argv[1] == '-h':
-        print("Sticker Star KSM Script Dumper")
-        print("Usage: main.py <input file.bin | input file.yaml>")
+    if len(argv) > 1 and argv[1] == 'batch':
+        exit(batch_main(argv[2:]))
+    if len(argv) > 1 and argv[1] == 'index':
+        exit(index_main(argv[2:]))
+    if len(argv) > 1 and argv[1] == 'xref':
+        exit(xref_main(argv[2:]))
+    if len(argv) > 1 and argv[1] == 'graph':
+        exit(graph_main(argv[2:]))
+    
+    parser = ArgumentParser(description="Sticker Star KSM Script Dumper",
+                            epilog="Use 'main.py batch --help' to convert many files at once, "
+                                   "'main.py index --help' and 'main.py xref --help' to find where symbols are used, "
+                                   "'main.py graph --help' for call graphs.")
+    parser.add_argument('input', metavar='input file.bin | input file.yaml | input file.ksmi')
+    add_common_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="decode the functions of a .bin file in this many processes when converting it to yaml, "
+                             "which only pays off for large scripts (default: %(default)s)")
+    parser.add_argument('--stream', action='store_true',
+                        help="assemble a .yaml file one function at a time with the code kept in temporary files, "
+                             "so memory use doesn't grow with the size of the script (at the cost of reading the file twice)")
+    parser.add_argument('--profile', action='store_true',
+                        help="print how long each stage took and how often each instruction was decoded to stderr. "
+                             "Cached output skips most stages, combine it with --no-cache. "
+                             "With -j the stages of the worker processes are added up under 'worker'")
+    parser.add_argument('--profile-format', choices=['table', 'json'], default='table',
+                        help="how --profile prints what it measured (default: %(default)s)")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="also trace allocations for --profile, which makes everything considerably slower")
+    
+    if len(argv) == 1:
+        parser.print_help()
         return
     
-    filename = argv[1]
+    options = parser.parse_args()
+    cache = cache_from_options(options)
     
-    if filename.endswith('.bin'):
-        ksm_to_yaml(filename)
-    elif filename.endswith('.yaml'):
-        yaml_to_ksm(filename)
+    assert options.jobs > 0, "Job count has to be positive"
+    
+    if options.profile or options.profile_memory:
+        profiling.start(options.profile_memory)
+    
+    convert(options.input, options.format, cache, options.mmap, options.jobs, options.stream)
+    
+    profile = profiling.stop()
+    if profile is not None:
+        print(profile.format_json() if options.profile_format == 'json' else profile.format_table(), file=stderr)
+    
+    if cache is not None:
+        cache.evict()
 
 if __name__ ==  '__main__':
     main()
@@ -1,12 +1,14 @@
 from array import array
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Enum
-from itertools import chain
+from itertools import chain, repeat
+from typing import Any, Callable, Iterator
 
 import cmds
 import functions
 from tables import Table
-from util import SymbolIds, read_string, write_string
+from util import BULK_RECORDS, RecordLayout, RecordReader, SymbolIds, write_string
 from variables import Var, VarCategory
 
 # function imports
@@ -20,40 +22,33 @@ class ImportType(Enum):
     Unk2 = 5
     Func = 7
 
-@dataclass
+@dataclass(slots=True)
 class ScriptImport:
     name: str | None
     field_0x4: int # short
     type: ImportType
     id: int
+    
+    symbol_kind = 'fn'
+
+IMPORT_RECORD = RecordLayout('is_named', 'field_0x4', 'type', 'unused1', 'id', 'unused2', 'unused3')
 
-def read_function_imports(section: bytes) -> list[ScriptImport]:
-    arr = enumerate(array('I', section))
+def read_function_imports(section: bytes | memoryview) -> list[ScriptImport]:
+    reader = RecordReader(section)
     
-    count = next(arr)[1]
+    count = reader.word()
     imports = []
     
-    for i, value in arr:
-        field_0x4 = next(arr)[1] & 0xFFFF
-        type = next(arr)[1]
-        next(arr) # unused
-        
-        id = next(arr)[1]
-        next(arr) # unused
-        next(arr) # unused
-        
-        if value == 0xFFFFFFFF:
-            name = read_string(section, i + 8)
-            
-            for _ in range(next(arr)[1]):
-                next(arr)
-        else:
-            assert value == 0
-            name = None
+    if count < BULK_RECORDS:
+        for (_, field_0x4, type, _, id, _, _), name in reader.records(IMPORT_RECORD, count):
+            imports.append(ScriptImport(name, field_0x4 & 0xFFFF, ImportType(type), id))
+    else:
+        names, _, field_0x4s, types, _, ids, _, _ = reader.columns(IMPORT_RECORD, count)
         
-        imports.append(ScriptImport(name, field_0x4, ImportType(type), id))
+        for name, field_0x4, type, id in zip(names, field_0x4s, types, ids):
+            imports.append(ScriptImport(name, field_0x4 & 0xFFFF, ImportType(type), id))
     
-    assert len(imports) == count
+    assert reader.at_end()
     return imports
 
 def write_import(fn: ScriptImport) -> array[int]:
@@ -96,9 +91,9 @@ def function_import_from_yaml(obj: dict) -> ScriptImport:
     
     return ScriptImport(name, field_0x4, type, id)
 
-def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> bytearray:
+def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> list[ScriptImport]:
     if 'imports' not in input_file:
-        return bytearray([0, 0, 0, 0])
+        return []
     
     assert isinstance(input_file['imports'], list), "Script imports have to be a list"
     
@@ -107,37 +102,67 @@ def parse_imports(input_file: dict, symbol_ids: SymbolIds) -> bytearray:
         assert isinstance(obj, dict), "Script import has to be an object"
         imports.append(function_import_from_yaml(obj))
     
-    out = array('I', [len(imports)])
-    
     for fn in imports:
         symbol_ids.add(fn)
-        out.extend(write_import(fn))
     
-    return bytearray(out)
+    return imports
 
 # labels
-@dataclass
+@dataclass(slots=True)
 class Label:
     name: str | None
     alias: str | None
     id: int
     code_offset: int
+    
+    symbol_kind = 'label'
+
+LABEL_RECORD = RecordLayout('is_named', 'id', 'code_offset')
 
-def read_label(arr: enumerate[int], section: bytes) -> Label:
-    offset, value = next(arr)
-    id = next(arr)[1]
-    code_offset = next(arr)[1]
+def read_labels(reader: RecordReader, count: int) -> list[Label]:
+    if count < BULK_RECORDS:
+        return [Label(name, None, id, code_offset) for (_, id, code_offset), name in reader.records(LABEL_RECORD, count)]
     
-    if value == 0xFFFFFFFF:
-        name = read_string(section, offset + 6)
-        
-        for _ in range(next(arr)[1]):
-            next(arr)
+    names, _, ids, code_offsets = reader.columns(LABEL_RECORD, count)
+    return list(map(Label, names, repeat(None), ids, code_offsets))
+
+def write_label(label: Label) -> array[int]:
+    out = array('I')
+    
+    out.append(0xFFFFFFFF if label.name is not None else 0)
+    out.append(label.id)
+    out.append(label.code_offset)
+    
+    if label.name is not None:
+        out.extend(write_string(label.name))
+    
+    return out
+
+def label_from_yaml(obj: dict) -> Label:
+    assert isinstance(obj, dict), "Label has to be an object"
+    
+    if 'name' in obj and obj['name'] is not None:
+        assert isinstance(obj['name'], str), "Label name has to be a string"
+        name = obj['name']
     else:
-        assert value == 0
         name = None
     
-    return Label(name, None, id, code_offset)
+    if 'alias' in obj and obj['alias'] is not None:
+        alias = str(obj['alias'])
+    else:
+        alias = None
+    
+    assert 'id' in obj and isinstance(obj['id'], int), "Label id (required) has to be an integer"
+    id = obj['id']
+    
+    # only matters for labels no Label instruction points at, the others get theirs when assembling
+    if 'code_offset' in obj:
+        assert isinstance(obj['code_offset'], int), "Label code_offset has to be an integer"
+        code_offset = obj['code_offset']
+    else:
+        code_offset = 0
+    
+    return Label(name, alias, id, code_offset)
 
 def print_label(label: Label) -> str:
     out_str = "      - "
@@ -153,7 +178,7 @@ def print_label(label: Label) -> str:
     return out_str
 
 # script expressions
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ExprSymbol:
     label: str
 
@@ -184,7 +209,10 @@ EXPR_SYMBOLS = {
     0x56: ExprSymbol('/'),
 }
 
-@dataclass
+# for writing expressions back out
+EXPR_SYMBOL_CODES = {symbol.label: code for code, symbol in EXPR_SYMBOLS.items()}
+
+@dataclass(slots=True)
 class Expr:
     elements: list['Var | cmds.CallCmd | int'] = field(default_factory=lambda: [])
 
@@ -198,7 +226,7 @@ def read_expr(initial_element: int | None, arr: enumerate[int], symbol_ids: Symb
             break
         
         if value == 0xc:
-            elements.append(cmds.read_call_cmd(arr, symbol_ids, cmds.ReadCmdOptions(0xc, False)))
+            elements.append(cmds.decode_call(arr, symbol_ids, 0))
             continue
         
         if value in EXPR_SYMBOLS:
@@ -209,46 +237,102 @@ def read_expr(initial_element: int | None, arr: enumerate[int], symbol_ids: Symb
     
     return Expr(elements)
 
+# the text of the Vars and Labels printed in a cached_symbol_texts() block, by id(), with every field it was printed from,
+# so a symbol that's been renamed, given an alias or otherwise changed since gets printed again,
+# and the symbol itself, which keeps its id from being reused by another one while it's in here
+SymbolText = tuple['Var | Label', tuple, str]
+symbol_texts: dict[int, SymbolText] | None = None
+
+@contextmanager
+def cached_symbol_texts() -> Iterator[None]:
+    """Has print_expr_or_var remember how it printed each Var and Label until the (outermost) block ends."""
+    global symbol_texts
+    outer = symbol_texts
+    if outer is None:
+        symbol_texts = {}
+    
+    try:
+        yield
+    finally:
+        symbol_texts = outer
+
+def print_cached_symbol(symbol: 'Var | Label', print_symbol: Callable[[Any], str], printed_from: tuple) -> str:
+    """printed_from has to hold everything print_symbol reads from symbol."""
+    cache = symbol_texts
+    if cache is None:
+        return print_symbol(symbol)
+    
+    cached = cache.get(id(symbol))
+    if cached is not None and cached[1] == printed_from:
+        return cached[2]
+    
+    text = print_symbol(symbol)
+    cache[id(symbol)] = (symbol, printed_from, text)
+    return text
+
+def print_var_reference(var: Var) -> str:
+    if var.name is not None:
+        return f"{var.category.name}:{var.name}"
+    elif var.alias is not None:
+        return f"{var.category.name}:{var.alias}"
+    elif var.category == VarCategory.Const and var.user_data is not None:
+        return f"{var.user_data}`" if isinstance(var.user_data, (int, float)) else repr(var.user_data)
+    else:
+        return f"{var.category.name}:0x{var.id:x}"
+
+def print_label_reference(label: Label) -> str:
+    if label.name is not None:
+        return f"label:{label.name}"
+    elif label.alias is not None:
+        return f"label:{label.alias}"
+    else:
+        return f"label:{hex(label.id)}"
+
+def print_table_reference(table: Table) -> str:
+    if table.name is not None:
+        return f"table:{table.name}"
+    else:
+        return f"table:{hex(table.id)}"
+
+def print_expr(expr: Expr, braces_around_expression: bool) -> str:
+    content = ' '.join([print_expr_or_var(x) for x in expr.elements])
+    return f'( {content} )' if braces_around_expression else content
+
+def print_call_expr(call: 'cmds.CallCmd', braces_around_expression: bool) -> str:
+    func = call.func
+    content = f"Call{'*' if call.is_const else ''} {func if isinstance(func, int) else func.name} ( {', '.join([print_expr_or_var(x) for x in call.args])} )"
+    return f'( {content} )' if braces_around_expression else content
+
+def print_function_reference(fn: 'ScriptImport | functions.FunctionDef', _) -> str:
+    return f"fn:{fn.name}"
+
+# how print_expr_or_var prints each type of value, given whether to put braces around expressions
+ExprPrinter = Callable[[Any, bool], str]
+EXPR_PRINTERS: dict[type, ExprPrinter] = {
+    Var: lambda var, _: print_cached_symbol(var, print_var_reference, (var.name, var.alias, var.category, var.user_data, var.id)),
+    Expr: print_expr,
+    ExprSymbol: lambda symbol, _: symbol.label,
+    Label: lambda label, _: print_cached_symbol(label, print_label_reference, (label.name, label.alias, label.id)),
+    Table: lambda table, _: print_table_reference(table),
+    ScriptImport: print_function_reference,
+    int: lambda n, _: f"?0x{n:x}",
+}
+
+def find_expr_printer(value_type: type) -> ExprPrinter | None:
+    """
+    The printer for a type that isn't in EXPR_PRINTERS yet, which is then added for it: CallCmd and FunctionDef
+    (which cmds and functions only define after importing this module), and subclasses of the types that are in there.
+    """
+    printers = chain([(cmds.CallCmd, print_call_expr), (functions.FunctionDef, print_function_reference)], EXPR_PRINTERS.items())
+    printer = next((printer for printed_type, printer in printers if issubclass(value_type, printed_type)), None)
+    
+    if printer is not None:
+        EXPR_PRINTERS[value_type] = printer
+    return printer
+
 def print_expr_or_var(value, braces_around_expression = False) -> str:
-    match value:
-        case Expr(elements):
-            content = ' '.join(print_expr_or_var(x) for x in elements)
-            if braces_around_expression:
-                return f'( {content} )'
-            else:
-                return content
-        case ExprSymbol(label):
-            return label
-        case Var(name, alias, category, id, data_type, flags, user_data):
-            if name is not None:
-                return f"{category.name}:{name}"
-            elif alias is not None:
-                return f"{category.name}:{alias}"
-            elif category == VarCategory.Const and user_data is not None:
-                return f"{user_data}`" if isinstance(user_data, (int, float)) else repr(user_data)
-            else:
-                return f"{category.name}:0x{id:x}"
-        case ScriptImport(name) | functions.FunctionDef(name):
-            return f"fn:{name}"
-        case Label(name, alias, id):
-            if name is not None:
-                return f"label:{name}"
-            elif alias is not None:
-                return f"label:{alias}"
-            else:
-                return f"label:{hex(id)}"
-        case Table(name, id):
-            if name is not None:
-                return f"table:{name}"
-            else:
-                return f"table:{hex(id)}"
-        case cmds.CallCmd(is_const, func, args):
-            content = f"Call{'*' if is_const else ''} {func if isinstance(func, int) else func.name} ( {', '.join(print_expr_or_var(x) for x in args)} )"
-            if braces_around_expression:
-                return f'( {content} )'
-            else:
-                return content
-        case int(n):
-            return f"?0x{n:x}"
-        case _:
-            raise Exception(f"Unknown thing {repr(value)}")
+    printer = EXPR_PRINTERS.get(type(value)) or find_expr_printer(type(value))
+    if printer is None:
+        raise Exception(f"Unknown thing {repr(value)}")
+    
+    return printer(value, braces_around_expression)
@@ -0,0 +1,240 @@
+"""
+Timing and counters for --profile.
+
+Nothing gets measured unless a Profile is active: stage() hands out a shared no-op context manager otherwise,
+and analyze_function_def only swaps in the counting decoders when it finds an active Profile,
+so all it costs when profiling is off is a check per stage and per function.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+import json
+import os
+from time import perf_counter
+import tracemalloc
+from typing import Any
+
+import cmds
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    # including the stages nested in it
+    seconds: float = 0.0
+    self_seconds: float = 0.0
+    # bytes, only with trace_memory, allocated is what's still allocated when the stage ends
+    allocated: int = 0
+    peak: int = 0
+
+@dataclass
+class Frame:
+    name: str
+    start: float
+    nested_seconds: float = 0.0
+    start_memory: int = 0
+    peak: int = 0
+
+@dataclass
+class Counters:
+    """What a Profile measured, without the decoders, so it can be sent back from a worker process."""
+    stages: dict[str, StageStats]
+    opcode_counts: Counter
+    opcode_seconds: dict[int, float]
+
+class Profile:
+    # stages are named by their path, e.g. 'write yaml > decode'
+    stages: dict[str, StageStats]
+    stack: list[Frame]
+    opcode_counts: Counter
+    opcode_seconds: defaultdict
+    bytes_in: int
+    bytes_out: int
+    trace_memory: bool
+    # cmds.DECODERS, counting and timing every instruction
+    decoders: dict
+    
+    def __init__(self, trace_memory: bool = False):
+        self.stages = {}
+        self.stack = []
+        self.opcode_counts = Counter()
+        self.opcode_seconds = defaultdict(float)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.trace_memory = trace_memory
+        self.decoders = {word: self.timed(word, decoder) for word, decoder in cmds.DECODERS.items()}
+    
+    def timed(self, word: int, decoder: 'cmds.Decoder') -> 'cmds.Decoder':
+        counts = self.opcode_counts
+        seconds = self.opcode_seconds
+        
+        def decode(arr, symbol_ids, offset):
+            start = perf_counter()
+            try:
+                return decoder(arr, symbol_ids, offset)
+            finally:
+                seconds[word] += perf_counter() - start
+                counts[word] += 1
+        
+        return decode
+    
+    def read_unknown_cmd(self, arr: enumerate[int], symbol_ids, opcode: int, is_const: bool) -> 'cmds.UnknownCmd':
+        word = opcode | 0x100 if is_const else opcode
+        start = perf_counter()
+        
+        try:
+            return cmds.read_unknown_cmd(arr, symbol_ids, opcode, is_const)
+        finally:
+            self.opcode_seconds[word] += perf_counter() - start
+            self.opcode_counts[word] += 1
+    
+    @contextmanager
+    def stage(self, name: str):
+        if len(self.stack) > 0:
+            name = f"{self.stack[-1].name} > {name}"
+        
+        # created up front so stages are listed in the order they start, outer ones first
+        stats = self.stages.setdefault(name, StageStats())
+        frame = Frame(name, 0.0)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self.stack) > 0:
+                # resetting the peak for this stage would lose the one of the stage it's in
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            frame.start_memory = current
+        
+        self.stack.append(frame)
+        frame.start = perf_counter()
+        
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - frame.start
+            self.stack.pop()
+            
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.self_seconds += seconds - frame.nested_seconds
+            
+            if len(self.stack) > 0:
+                self.stack[-1].nested_seconds += seconds
+            
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, frame.peak)
+                stats.allocated += current - frame.start_memory
+                stats.peak = max(stats.peak, peak - frame.start_memory)
+                
+                if len(self.stack) > 0:
+                    self.stack[-1].peak = max(self.stack[-1].peak, peak)
+    
+    def counters(self) -> Counters:
+        return Counters(self.stages, self.opcode_counts, dict(self.opcode_seconds))
+    
+    def add(self, counters: Counters):
+        """Adds what another Profile measured, stages it has too just get their numbers added up (or the larger peak)."""
+        for name, other in counters.stages.items():
+            stats = self.stages.setdefault(name, StageStats())
+            stats.calls += other.calls
+            stats.seconds += other.seconds
+            stats.self_seconds += other.self_seconds
+            stats.allocated += other.allocated
+            stats.peak = max(stats.peak, other.peak)
+        
+        self.opcode_counts.update(counters.opcode_counts)
+        for word, seconds in counters.opcode_seconds.items():
+            self.opcode_seconds[word] += seconds
+    
+    def opcodes(self) -> list[tuple[str, int, float]]:
+        """(name, count, seconds) of every instruction decoded, the most time consuming first."""
+        rows = []
+        
+        for word, count in self.opcode_counts.items():
+            opcode = word & 0xfffffeff
+            layout = cmds.LAYOUTS.get(opcode)
+            name = layout.mnemonic if layout is not None else f"Unk_{opcode:x}"
+            
+            if word & 0x100:
+                name += '*'
+            
+            rows.append((f"{name} ({word:#x})", count, self.opcode_seconds[word]))
+        
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+    
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'stages': {name: asdict(stats) for name, stats in self.stages.items()},
+            'opcodes': [{'name': name, 'count': count, 'seconds': seconds} for name, count, seconds in self.opcodes()],
+        }
+    
+    def format_table(self) -> str:
+        lines = [f"{self.bytes_in} bytes in, {self.bytes_out} bytes out", ""]
+        
+        header = f"{'stage':<36} {'calls':>7} {'total ms':>10} {'self ms':>10}"
+        if self.trace_memory:
+            header += f" {'kept KiB':>10} {'peak KiB':>10}"
+        lines.append(header)
+        
+        for name, stats in self.stages.items():
+            line = f"{name:<36} {stats.calls:>7} {stats.seconds * 1e3:>10.2f} {stats.self_seconds * 1e3:>10.2f}"
+            if self.trace_memory:
+                line += f" {stats.allocated / 1024:>10.1f} {stats.peak / 1024:>10.1f}"
+            lines.append(line)
+        
+        opcodes = self.opcodes()
+        if len(opcodes) > 0:
+            lines += ["", f"{'instruction':<36} {'count':>7} {'total ms':>10} {'us each':>10}"]
+            
+            for name, count, seconds in opcodes:
+                lines.append(f"{name:<36} {count:>7} {seconds * 1e3:>10.2f} {seconds / count * 1e6:>10.2f}")
+        
+        return '\n'.join(lines)
+    
+    def format_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+active: Profile | None = None
+
+NOT_PROFILING = nullcontext()
+
+def start(trace_memory: bool = False) -> Profile:
+    global active
+    
+    if trace_memory:
+        tracemalloc.start()
+    
+    active = Profile(trace_memory)
+    return active
+
+def stop() -> Profile | None:
+    global active
+    profile, active = active, None
+    
+    if profile is not None and profile.trace_memory:
+        tracemalloc.stop()
+    
+    return profile
+
+def stage(name: str):
+    """Times what runs inside it as a stage of the active Profile, if there is one."""
+    if active is None:
+        return NOT_PROFILING
+    
+    return active.stage(name)
+
+def add(counters: Counters):
+    """Adds what a worker process measured to the active Profile, if there is one."""
+    if active is None:
+        return
+    
+    active.add(counters)
+
+def count_files(read: tuple[str, ...] = (), written: tuple[str, ...] = ()):
+    """Adds the size of the files to the bytes in and out of the active Profile, if there is one."""
+    if active is None:
+        return
+    
+    active.bytes_in += sum(os.path.getsize(filename) for filename in read)
+    active.bytes_out += sum(os.path.getsize(filename) for filename in written)
@@ -0,0 +1,270 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import chain
+from typing import Callable, Iterable, Iterator
+
+from code_parser import parse_table_values
+from functions import (FunctionDef, FunctionMemo, RenderedBody, RenderedPiece, add_local_symbols, analyze_function_defs, index_code, join_pieces,
+                       parse_function_definitions, print_function_definitions, print_function_imports, read_function_definitions,
+                       render_code_range, render_function_body, split_code, write_function_def)
+from other_types import ScriptImport, cached_symbol_texts, parse_imports, read_function_imports, write_import
+import profiling
+from tables import Table, parse_tables, print_tables, read_table_defs, write_table, write_table_values
+from util import SymbolIds, words
+from variables import Var, VarCategory, add_temp_vars, parse_variables, print_variables, read_variables, write_variable
+
+@dataclass(slots=True)
+class Script:
+    """Everything decoded from a script, which both the yaml and the intermediate (.ksmi) files are written from."""
+    section_0: int
+    static_variables: list[Var]
+    constants: list[Var]
+    global_variables: list[Var]
+    imports: list[ScriptImport]
+    tables: list[Table]
+    definitions: list[FunctionDef]
+
+def read_section_0(sections: list[bytes]) -> int:
+    arr = words(sections[0])
+    
+    assert len(arr) == 3
+    assert arr[0] == 0
+    assert arr[1] == 0
+    
+    return arr[2]
+
+def print_section_0(section_0: int) -> str:
+    out_str = 'section_0:\n'
+    out_str += f"  - {hex(section_0)} # mysterious number\n"
+    
+    return out_str
+
+def parse_section_0(input_file: dict) -> int:
+    section_0 = input_file['section_0']
+    assert isinstance(section_0, list), "Section 0 has invalid"
+    assert len(section_0) == 1, "Section 0 has invalid"
+    assert isinstance(section_0[0], int), "Section 0 has invalid"
+    
+    return section_0[0]
+
+def read_script(sections: list[bytes], symbol_ids: SymbolIds | None = None, analyze: bool = True) -> Script:
+    """
+    Reads every section of a script into a Script. With analyze=False the function bodies are left undecoded,
+    symbol_ids then has to be kept around for decoding them later (print_function_definitions does that).
+    """
+    if symbol_ids is None:
+        symbol_ids = SymbolIds()
+    
+    section_0 = read_section_0(sections)
+    static_variables, constants, global_variables = read_variables(sections, symbol_ids)
+    
+    # section 5 (function imports)
+    imports = read_function_imports(sections[5])
+    for fn in imports:
+        symbol_ids.add(fn)
+    
+    # section 3
+    tables = read_table_defs(sections[3], sections[7], symbol_ids)
+    for table in tables:
+        symbol_ids.add(table)
+    
+    # section 1 (function definitions)
+    definitions = read_function_definitions(sections[1], sections[7])
+    for fn in definitions:
+        symbol_ids.add(fn)
+    
+    if analyze:
+        analyze_function_defs(definitions, symbol_ids)
+    
+    return Script(section_0, static_variables, constants, global_variables, imports, tables, definitions)
+
+# the script each worker process of a BodyPool decodes functions from
+worker_script: tuple[Script, SymbolIds] | None = None
+# None unless the process the workers work for is profiling, in which case they profile what they do too,
+# tracing allocations if this is True
+worker_trace_memory: bool | None = None
+
+# functions with more words of code than this are split into pieces of about this size, which get rendered by different workers
+PIECE_WORDS = 1 << 15
+
+# (index of the function, start, stop, thread starts) of a piece, or just the index for a whole function
+BodyTask = int | tuple[int, int, int | None, list[int]]
+
+def init_body_worker(sections: list[bytes], trace_memory: bool | None):
+    global worker_script, worker_trace_memory
+    
+    symbol_ids = SymbolIds()
+    worker_script = read_script(sections, symbol_ids, analyze=False), symbol_ids
+    worker_trace_memory = trace_memory
+
+def render_bodies(tasks: list[BodyTask]) -> tuple[list[RenderedBody | RenderedPiece], profiling.Counters | None]:
+    script, symbol_ids = worker_script
+    bodies = []
+    
+    if worker_trace_memory is not None:
+        profiling.start(worker_trace_memory)
+    
+    with profiling.stage('worker'), cached_symbol_texts():
+        for task in tasks:
+            fn = script.definitions[task if isinstance(task, int) else task[0]]
+            
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                
+                if isinstance(task, int):
+                    bodies.append(render_function_body(fn, symbol_ids))
+                else:
+                    bodies.append(render_code_range(fn, symbol_ids, *task[1:]))
+    
+    profile = profiling.stop()
+    return bodies, profile.counters() if profile is not None else None
+
+class BodyPool:
+    """
+    Decodes and renders function bodies of a script in worker processes, for print_function_definitions.
+    Every worker reads the script's symbols once when it starts, after that only indices and rendered bodies get sent around.
+    Very long functions are split into pieces (see split_code), so they don't keep a single worker busy while the others wait.
+    When profiling, what the workers measured gets added to the active Profile as it comes in, their stages under 'worker'.
+    """
+    jobs: int
+    executor: ProcessPoolExecutor
+    definitions: list[FunctionDef]
+    
+    def __init__(self, sections: list[bytes] | list[memoryview], jobs: int, definitions: list[FunctionDef]):
+        self.jobs = jobs
+        self.definitions = definitions
+        # mapped sections can't be sent to other processes
+        trace_memory = profiling.active.trace_memory if profiling.active is not None else None
+        self.executor = ProcessPoolExecutor(jobs, initializer=init_body_worker, initargs=([bytes(section) for section in sections], trace_memory))
+    
+    def render(self, indices: list[int]) -> Iterable[RenderedBody]:
+        tasks: list[BodyTask] = []
+        
+        for i in indices:
+            fn = self.definitions[i]
+            
+            if len(fn.code) > PIECE_WORDS:
+                tasks.extend((i, start, stop, threads) for start, stop, threads in split_code(index_code(fn.code), PIECE_WORDS))
+            else:
+                tasks.append(i)
+        
+        # a few chunks per worker so one with slow functions doesn't hold up the rest
+        size = max(1, len(tasks) // (self.jobs * 4))
+        chunks = [tasks[start:start + size] for start in range(0, len(tasks), size)]
+        results = (body for bodies in self.rendered(chunks) for body in bodies)
+        pieces: list[RenderedPiece] = []
+        
+        for task, body in zip(tasks, results):
+            if isinstance(task, int):
+                yield body
+                continue
+            
+            # the last piece of a function runs until the end of its code
+            pieces.append(body)
+            if task[2] is None:
+                yield join_pieces(self.definitions[task[0]], pieces)
+                pieces = []
+    
+    def rendered(self, chunks: list[list[BodyTask]]) -> Iterator[list[RenderedBody | RenderedPiece]]:
+        for bodies, counters in self.executor.map(render_bodies, chunks):
+            if counters is not None:
+                profiling.add(counters)
+            yield bodies
+    
+    def __enter__(self) -> 'BodyPool':
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.executor.shutdown()
+
+def write_script_yaml(script: Script, out_filename: str, var_filename: str,
+                      symbol_ids: SymbolIds | None = None, memo: FunctionMemo | None = None,
+                      render_in_workers: Callable[[list[int]], Iterable[RenderedBody]] | None = None):
+    with open(var_filename, 'w', encoding='utf-8') as f:
+        f.writelines(print_variables(script.static_variables, script.constants, script.global_variables))
+    
+    with open(out_filename, 'w') as f, cached_symbol_texts():
+        f.write(print_section_0(script.section_0))
+        f.writelines(print_function_imports(script.imports))
+        f.writelines(print_tables(script.tables))
+        f.writelines(print_function_definitions(script.definitions, symbol_ids if symbol_ids is not None else SymbolIds(), memo,
+                                                render_in_workers))
+
+def script_from_yaml(input_file: dict, var_input_file: dict, symbol_ids: SymbolIds | None = None) -> Script:
+    """
+    Reads a script back from its yaml files, in the same order read_script defines the symbols in.
+    The function bodies are left as text (instruction_strs) for assemble_script.
+    """
+    if symbol_ids is None:
+        symbol_ids = SymbolIds()
+    
+    section_0 = parse_section_0(input_file)
+    
+    static_variables = parse_variables(var_input_file, 'static_variables', VarCategory.Static, symbol_ids)
+    constants = parse_variables(var_input_file, 'constants', VarCategory.Const, symbol_ids)
+    global_variables = parse_variables(var_input_file, 'global_variables', VarCategory.Global, symbol_ids)
+    add_temp_vars(symbol_ids)
+    
+    imports = parse_imports(input_file, symbol_ids)
+    tables = parse_tables(input_file, symbol_ids)
+    definitions = parse_function_definitions(input_file, symbol_ids)
+    
+    # now that everything they can refer to is defined
+    for table in tables:
+        parse_table_values(table, symbol_ids)
+    
+    for fn in definitions:
+        with symbol_ids.scope():
+            add_local_symbols(fn, symbol_ids)
+            for table in fn.tables:
+                parse_table_values(table, symbol_ids)
+    
+    return Script(section_0, static_variables, constants, global_variables, imports, tables, definitions)
+
+def write_list_section(items: list, write_item) -> bytearray:
+    out = bytearray(array('I', [len(items)]))
+    
+    for item in items:
+        # some writers return arrays of words, others bytearrays
+        out += write_item(item)
+    
+    return out
+
+def write_code_section(script: Script) -> bytearray:
+    """
+    Lays out the function code and table data at the offsets they were read from.
+    Words that belong to neither (there usually aren't any) come out as 0.
+    """
+    # the first word is never used by anything, the code offsets point at the word before the code
+    out = array('I', [0])
+    
+    # the tables go first so they can't overwrite code when they overlap it, which those inside functions
+    # (whose values are never read) could
+    local_tables = (table for fn in script.definitions for table in fn.tables)
+    placed = chain(((table.start_offset, write_table_values(table)) for table in chain(script.tables, local_tables)),
+                   ((fn.code_offset + 1, fn.code) for fn in script.definitions))
+    
+    for start, data in placed:
+        if len(data) == 0:
+            continue
+        
+        end = start + len(data)
+        if end > len(out):
+            out.frombytes(bytes((end - len(out)) * 4))
+        
+        out[start:end] = array('I', data)
+    
+    return bytearray(out)
+
+def script_to_sections(script: Script) -> list[bytearray]:
+    return [
+        bytearray(array('I', [0, 0, script.section_0])),
+        write_list_section(script.definitions, write_function_def),
+        write_list_section(script.static_variables, write_variable),
+        write_list_section(script.tables, write_table),
+        write_list_section(script.constants, write_variable),
+        write_list_section(script.imports, write_import),
+        write_list_section(script.global_variables, write_variable),
+        write_code_section(script),
+    ]
@@ -0,0 +1,249 @@
+"""
+Assembles a script from yaml one function definition at a time, so memory use doesn't grow with the size of the script.
+
+The main yaml file is read twice with PyYAML's event API instead of being loaded all at once:
+the first pass reads everything but the function bodies, which get skipped without being composed,
+so every symbol a body can refer to (functions further down included) is defined before the first one is assembled.
+The second pass composes the bodies one by one, and each is assembled as soon as its definition ends.
+
+The code and the function records are written to temporary files along the way and copied into the container at the end.
+Records that depend on something only known later get written again then:
+those of functions with tables (which are placed after all the code) and of functions a thread further down has its body in.
+"""
+from array import array
+from itertools import chain
+from os import SEEK_END
+from typing import Any, BinaryIO, Iterator
+
+import yaml
+from yaml.events import MappingEndEvent, MappingStartEvent, SequenceEndEvent, SequenceStartEvent
+
+from assembler import CodeWriter, ThreadFunctions, assemble_function, place_tables
+from functions import FUNCTION_RECORD, FunctionDef, write_function_def
+from other_types import write_import
+from script import Script, write_list_section
+from tables import write_table, write_table_values
+from util import SymbolIds
+from variables import write_variable
+
+def read_value(loader: yaml.SafeLoader) -> Any:
+    """Composes and constructs the node the loader is at, like safe_load would."""
+    return loader.construct_document(loader.compose_node(None, None))
+
+def skip_value(loader: yaml.SafeLoader):
+    """Skips the node the loader is at, without composing it."""
+    depth = 0
+    
+    while True:
+        event = loader.get_event()
+        
+        if isinstance(event, (MappingStartEvent, SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (MappingEndEvent, SequenceEndEvent)):
+            depth -= 1
+        
+        if depth == 0:
+            return
+
+def mapping_keys(loader: yaml.SafeLoader) -> Iterator[Any]:
+    """The keys of the mapping the loader is at, the value of each has to be read or skipped before asking for the next key."""
+    loader.get_event()
+    
+    while not loader.check_event(MappingEndEvent):
+        yield read_value(loader)
+    
+    loader.get_event()
+
+def sequence_items(loader: yaml.SafeLoader, read_item) -> Iterator[Any]:
+    loader.get_event()
+    
+    while not loader.check_event(SequenceEndEvent):
+        yield read_item(loader)
+    
+    loader.get_event()
+
+def document_keys(loader: yaml.SafeLoader) -> Iterator[Any]:
+    """The keys of the mapping the (first) document consists of."""
+    loader.get_event()
+    assert loader.check_event(yaml.DocumentStartEvent), "Input yaml file has to be a dictionary"
+    loader.get_event()
+    assert loader.check_event(MappingStartEvent), "Input yaml file has to be a dictionary"
+    
+    yield from mapping_keys(loader)
+
+def read_definition_header(loader: yaml.SafeLoader) -> Any:
+    # anything other than a mapping is left for function_definitions_from_yaml to complain about
+    if not loader.check_event(MappingStartEvent):
+        return read_value(loader)
+    
+    header = {}
+    
+    for key in mapping_keys(loader):
+        if key == 'body' and loader.check_event(SequenceStartEvent):
+            skip_value(loader)
+            # only the second pass needs the actual body, until then it only matters that there is one
+            header[key] = []
+        else:
+            header[key] = read_value(loader)
+    
+    return header
+
+def read_definition_body(loader: yaml.SafeLoader) -> Any:
+    if not loader.check_event(MappingStartEvent):
+        skip_value(loader)
+        return None
+    
+    body = None
+    
+    for key in mapping_keys(loader):
+        if key == 'body':
+            body = read_value(loader)
+        else:
+            skip_value(loader)
+    
+    return body
+
+def read_without_bodies(stream) -> dict:
+    """What yaml.safe_load reads from a main yaml file, except that function bodies are left empty."""
+    loader = yaml.SafeLoader(stream)
+    input_file = {}
+    
+    try:
+        for key in document_keys(loader):
+            if key == 'definitions' and loader.check_event(SequenceStartEvent):
+                input_file[key] = list(sequence_items(loader, read_definition_header))
+            else:
+                input_file[key] = read_value(loader)
+    finally:
+        loader.dispose()
+    
+    return input_file
+
+def read_bodies(stream) -> Iterator[Any]:
+    """The body of every function definition of a main yaml file, in order (None for those without one)."""
+    loader = yaml.SafeLoader(stream)
+    
+    try:
+        for key in document_keys(loader):
+            if key == 'definitions' and loader.check_event(SequenceStartEvent):
+                yield from sequence_items(loader, read_definition_body)
+            else:
+                skip_value(loader)
+    finally:
+        loader.dispose()
+
+# where the end of the code is in a function record
+CODE_END_FIELD = FUNCTION_RECORD.fields.index('code_end')
+
+class StreamingAssembler:
+    """
+    Assembles the functions of a script read by read_without_bodies one after the other (see add),
+    writing the code to code and the function records to records as it goes. The code of functions that are done is dropped.
+    """
+    script: Script
+    symbol_ids: SymbolIds
+    writer: CodeWriter
+    threads: ThreadFunctions
+    code: BinaryIO
+    records: BinaryIO
+    # by id() of the function, since their code isn't kept
+    code_ends: dict[int, int]
+    record_positions: dict[int, int]
+    # functions whose record has to be written again by finish
+    outdated: dict[int, FunctionDef]
+    
+    def __init__(self, script: Script, symbol_ids: SymbolIds, code: BinaryIO, records: BinaryIO):
+        """symbol_ids has to hold everything defined at script level, like for assemble_script."""
+        self.script = script
+        self.symbol_ids = symbol_ids
+        self.writer = CodeWriter()
+        self.threads = ThreadFunctions(script.definitions)
+        self.code = code
+        self.records = records
+        self.code_ends = {}
+        self.record_positions = {}
+        self.outdated = {}
+        
+        records.write(array('I', [len(script.definitions)]))
+    
+    def add(self, fn: FunctionDef, body: Any):
+        """Assembles the next function of the script, body being what read_bodies read for it."""
+        if body is not None:
+            assert isinstance(body, list) and all(isinstance(line, str) for line in body), \
+                "Function body has to be a list of instructions"
+            
+            fn.instruction_strs = body
+            assemble_function(fn, self.writer, self.symbol_ids, self.threads)
+            # still not None, so threads know it has a body of its own
+            fn.instruction_strs = []
+            
+            for placed in chain([fn], self.writer.thread_functions):
+                self.code_ends[id(placed)] = placed.code_offset + len(placed.code)
+                placed.code = array('I')
+                placed.instructions = None
+                
+                if id(placed) in self.record_positions:
+                    self.outdated[id(placed)] = placed
+            
+            self.code.write(self.writer.flush())
+        
+        # functions without a body get their code once a thread claims them (or at the end if none does)
+        if len(fn.tables) > 0 or body is None and id(fn) not in self.code_ends:
+            self.outdated[id(fn)] = fn
+        
+        self.record_positions[id(fn)] = self.records.tell()
+        self.records.write(self.function_record(fn))
+    
+    def function_record(self, fn: FunctionDef) -> array:
+        record = array('I')
+        record.frombytes(write_function_def(fn))
+        record[CODE_END_FIELD] = self.code_ends.get(id(fn), fn.code_offset)
+        
+        return record
+    
+    def finish(self):
+        """After every function has been added, places the tables and fills in what was left open."""
+        self.code.write(self.writer.flush())
+        code_length = self.writer.offset + 1
+        
+        # functions without a body that no thread claimed
+        for fn in self.threads.unclaimed:
+            fn.code_offset = self.writer.offset
+        
+        place_tables(self.script, code_length)
+        
+        for key, fn in self.outdated.items():
+            self.records.seek(self.record_positions[key])
+            self.records.write(self.function_record(fn))
+        
+        self.records.seek(0, SEEK_END)
+        
+        # the same as write_code_section does, later tables overwrite the end of earlier ones if it sticks out
+        end = code_length
+        
+        for table in chain(self.script.tables, (table for fn in self.script.definitions for table in fn.tables)):
+            if table.start_offset > end:
+                self.code.write(bytes((table.start_offset - end) * 4))
+                end = table.start_offset
+            
+            data = write_table_values(table)
+            self.code.seek(table.start_offset * 4)
+            self.code.write(data)
+            
+            end = max(end, table.start_offset + len(data))
+            self.code.seek(end * 4)
+    
+    def sections(self) -> list[bytearray | BinaryIO]:
+        """Like script_to_sections, but with records and code for the function definitions and code sections."""
+        script = self.script
+        
+        return [
+            bytearray(array('I', [0, 0, script.section_0])),
+            self.records,
+            write_list_section(script.static_variables, write_variable),
+            write_list_section(script.tables, write_table),
+            write_list_section(script.constants, write_variable),
+            write_list_section(script.imports, write_import),
+            write_list_section(script.global_variables, write_variable),
+            self.code,
+        ]
@@ -1,8 +1,9 @@
 from array import array
 from dataclasses import dataclass
 from enum import Enum
+from typing import Iterator
 
-from util import SymbolIds, read_string
+from util import RecordLayout, RecordReader, SymbolIds, byte_view, words, write_string
 from variables import Var, VarCategory
 
 class TableDataType(Enum):
@@ -11,7 +12,7 @@ class TableDataType(Enum):
     Float = 2
     Byte = 3
 
-@dataclass
+@dataclass(slots=True)
 class Table:
     name: str | None
     id: int
@@ -20,78 +21,99 @@ class Table:
     start_offset: int
     datatype2: int
     values: list
+    
+    symbol_kind = 'table'
 
-def read_table_values(section: bytes, tables: list[Table], symbol_ids: SymbolIds) -> list[Table]:
+def read_table_values(section: bytes | memoryview, tables: list[Table], symbol_ids: SymbolIds) -> list[Table]:
+    section_words = words(section)
+    section_bytes = byte_view(section)
+    
     for table in tables:
         # ?? 
-        table.datatype2 = array('I', section[table.start_offset * 4 : table.start_offset * 4 + 4])[0]
+        table.datatype2 = section_words[table.start_offset]
         
-        start = (table.start_offset * 4) + 4
+        start = table.start_offset + 1
         match table.data_type:
             case TableDataType.Var:
-                end = start + (table.length * 4)
-                section_slice = section[start : end]
-                arr = enumerate(array('I', section_slice))
-                for _, val in arr:
+                for val in section_words[start : start + table.length]:
                     val = symbol_ids.get(val)
                     table.values.append(val)
             case TableDataType.Int:
-                end = start + (table.length * 4)
-                section_slice = section[start : end]
-                arr = enumerate(array('I', section_slice))
-                for _, val in arr:
-                    table.values.append(val)
+                table.values.extend(section_words[start : start + table.length])
             case TableDataType.Float:
-                end = start + (table.length * 4)
-                section_slice = section[start : end]
-                arr = enumerate(array('f', section_slice))
-                for _, val in arr:
-                    table.values.append(val)
+                table.values.extend(section_bytes[start * 4 : (start + table.length) * 4].cast('f'))
             case TableDataType.Byte:
-                end = start + table.length
-                section_slice = section[start : end]
-                arr = enumerate(array('B', section_slice))
-                for _, val in arr:
-                    table.values.append(val)
+                table.values.extend(section_bytes[start * 4 : start * 4 + table.length])
             case _:
                 raise Exception(f"Unknown table data type {table.data_type}")
     
     return tables
 
-def read_table(arr: enumerate[int], section: bytes):
-    offset, value = next(arr)
-    id = next(arr)[1]
-    type_int = next(arr)[1]
-    length = next(arr)[1]
-    start_offset = next(arr)[1]
-    
-    data_type = TableDataType(type_int)
+TABLE_RECORD = RecordLayout('is_named', 'id', 'data_type', 'length', 'start_offset')
+
+def read_tables(reader: RecordReader, count: int) -> list[Table]:
+    tables = []
     
-    if value == 0xFFFFFFFF:
-        name = read_string(section, offset + 6)
-        
-        for _ in range(next(arr)[1]):
-            next(arr)
-    else:
-        assert value == 0
-        name = None
+    for (_, id, type_int, length, start_offset), name in reader.records(TABLE_RECORD, count):
+        tables.append(Table(name, id, TableDataType(type_int), length, start_offset, 0, []))
     
-    return Table(name, id, data_type, length, start_offset, 0, [])
+    return tables
 
-def read_table_defs(section: bytes, code_section: bytes, symbol_ids: SymbolIds) -> list[Table]:
-    arr = enumerate(array('I', section))
+def read_table_defs(section: bytes | memoryview, code_section: bytes | memoryview, symbol_ids: SymbolIds) -> list[Table]:
+    reader = RecordReader(section)
     
-    count = next(arr)[1]
-    tables = []
-    
-    for _ in range(count):
-        tables.append(read_table(arr, section))
+    count = reader.word()
+    tables = read_tables(reader, count)
     
     tables = read_table_values(code_section, tables, symbol_ids)
     
-    assert next(arr, None) == None
+    assert reader.at_end()
     return tables
 
+def write_table(table: Table) -> array[int]:
+    out = array('I')
+    
+    out.append(0xFFFFFFFF if table.name is not None else 0)
+    out.append(table.id)
+    out.append(table.data_type.value)
+    out.append(table.length)
+    out.append(table.start_offset)
+    
+    if table.name is not None:
+        out.extend(write_string(table.name))
+    
+    return out
+
+def table_size(table: Table) -> int:
+    """How many words the table's data takes up in the code section."""
+    if table.data_type == TableDataType.Byte:
+        return 1 + (table.length + 3) // 4
+    
+    return 1 + table.length
+
+def write_table_values(table: Table) -> array[int]:
+    """The table's data as it's stored in the code section (at start_offset)."""
+    out = array('I', [table.datatype2])
+    
+    match table.data_type:
+        case TableDataType.Var:
+            out.extend(val if isinstance(val, int) else val.id for val in table.values)
+        case TableDataType.Int:
+            out.extend(val & 0xFFFFFFFF for val in table.values)
+        case TableDataType.Float:
+            out.frombytes(array('f', table.values).tobytes())
+        case TableDataType.Byte:
+            data = bytes(table.values)
+            out.frombytes(data + bytes(-len(data) % 4))
+        case _:
+            raise Exception(f"Unknown table data type {table.data_type}")
+    
+    # values that aren't known (like those of tables inside functions) are left as 0
+    if len(out) < table_size(table):
+        out.extend([0] * (table_size(table) - len(out)))
+    
+    return out
+
 def print_var(var: Var):
     if var.name is not None:
         return f"{var.category.name}:{var.name}"
@@ -113,25 +135,72 @@ def print_table(table: Table, indentation_level: int = 1) -> str:
 {indent}  start_offset: {hex(table.start_offset)}\n"""
 
     if table.values is not None and len(table.values) > 0:
-        text += f"{indent}  values:\n"
+        lines = [text, f"{indent}  values:\n"]
         
         for val in table.values:
-            text += f"{indent}    - {print_var(val) if isinstance(val, Var) else val}\n"
+            lines.append(f"{indent}    - {print_var(val) if isinstance(val, Var) else val}\n")
+        
+        text = ''.join(lines)
     
     return text
 
 
-def print_tables(sections: list[bytes], symbol_ids: SymbolIds) -> str:
-    # section 3
-    tables = read_table_defs(sections[3], sections[7], symbol_ids)
-        
-    if len(tables) == 0:
-        return ''
+def table_from_yaml(obj: dict) -> Table:
+    """The values of Var tables are left as they were written, they're symbols that can only be looked up later."""
+    assert isinstance(obj, dict), "Table has to be an object"
+    
+    # print_table writes the name of unnamed tables as None
+    if 'name' in obj and obj['name'] is not None and obj['name'] != 'None':
+        name = str(obj['name'])
+    else:
+        name = None
+    
+    assert 'id' in obj and isinstance(obj['id'], int), "Table id (required) has to be an integer"
+    id = obj['id']
+    
+    assert 'data_type' in obj and obj['data_type'] in TableDataType.__members__, \
+        f"Table data_type (required) has to be one of {', '.join(TableDataType.__members__)}"
+    data_type = TableDataType[obj['data_type']]
+    
+    assert 'length' in obj and isinstance(obj['length'], int), "Table length (required) has to be an integer"
+    length = obj['length']
+    
+    datatype2 = obj.get('datatype2', 0)
+    assert isinstance(datatype2, int), "Table datatype2 has to be an integer"
     
-    out_str = '\ntables:'
+    start_offset = obj.get('start_offset', 0)
+    assert isinstance(start_offset, int), "Table start_offset has to be an integer"
+    
+    values = obj.get('values') or []
+    assert isinstance(values, list), "Table values have to be a list"
+    
+    match data_type:
+        case TableDataType.Int | TableDataType.Byte:
+            values = [int(val) for val in values]
+        case TableDataType.Float:
+            # yaml doesn't read floats like 1e-05 as numbers
+            values = [float(val) for val in values]
+    
+    return Table(name, id, data_type, length, start_offset, datatype2, values)
 
+def parse_tables(input_file: dict, symbol_ids: SymbolIds) -> list[Table]:
+    if 'tables' not in input_file or input_file['tables'] is None:
+        return []
+    
+    assert isinstance(input_file['tables'], list), "Script tables have to be a list"
+    tables = [table_from_yaml(obj) for obj in input_file['tables']]
+    
     for table in tables:
         symbol_ids.add(table)
-        out_str += '\n' + print_table(table)
     
-    return out_str
+    return tables
+
+def print_tables(tables: list[Table]) -> Iterator[str]:
+    if len(tables) == 0:
+        return
+    
+    yield '\ntables:'
+
+    for table in tables:
+        yield '\n'
+        yield print_table(table)
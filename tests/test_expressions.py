@@ -0,0 +1,61 @@
+"""
+Expressions have to come back out of the assembler as the same words they were decoded from,
+including ones that aren't well formed, since the decoder doesn't hold expressions to any grammar.
+"""
+from array import array
+
+import pytest
+
+import main # makes sure the circular imports between the modules resolve
+import cmds
+from functions import FunctionDef, instruction_lines
+from other_types import EXPR_SYMBOL_CODES
+from util import SymbolIds
+from variables import Var, VarCategory
+
+A = Var('a', None, VarCategory.Global, 0x100, 0, 0, 0)
+B = Var('b', None, VarCategory.Global, 0x101, 0, 0, 0)
+
+# expressions by their elements, symbols given by their label, all of which print_expr_or_var prints
+MALFORMED = [
+    [A, '*', '-', B],
+    [A, B],
+    [A, '(', B, ')'],
+    ['next_function', A],
+    ['(', A],
+    [A, '+'],
+    ['-'],
+]
+
+WELL_FORMED = [
+    [A, '+', B, '*', A],
+    ['+', A],
+    ['(', ')'],
+    ['(', A, '||', B, ')', '&&', '(', '-', B, ')'],
+]
+
+def expression_words(elements: list) -> list[int]:
+    return [EXPR_SYMBOL_CODES[element] if isinstance(element, str) else element.id for element in elements] + [0x40]
+
+def roundtrip(elements: list) -> tuple[array, array]:
+    symbol_ids = SymbolIds()
+    for var in [A, B]:
+        symbol_ids.add(var)
+    
+    fn = FunctionDef('f', 0x200, 0, 0, 0, 0, array('I'), 0, None, None, [], [], [])
+    symbol_ids.add(fn)
+    
+    # an If, whose condition is written without brackets around it, and whose jump is left at 0 by the assembler too
+    words = array('I', [0x18, *expression_words(elements), 0, 0, 0])
+    inst = cmds.DECODERS[words[0]](enumerate(words[1:]), symbol_ids, words[0])
+    
+    lines = instruction_lines(fn, [inst])
+    out = array('I')
+    cmds.write_cmd(cmds.cmd_from_string(lines[0][1].strip("'"), fn, symbol_ids), out)
+    
+    return words, out
+
+@pytest.mark.parametrize('elements', MALFORMED + WELL_FORMED)
+def test_expressions_reassemble_to_the_same_words(elements):
+    words, out = roundtrip(elements)
+    assert out.tobytes() == words.tobytes()
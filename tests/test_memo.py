@@ -0,0 +1,40 @@
+"""ksm_to_yaml has to write the same yaml with the function memo as without, remembering every body from the first conversion on."""
+import json
+
+import main # makes sure the circular imports between the modules resolve
+from benchmarks.corpus import CorpusOptions, generate
+from cache import Cache
+from functions import FunctionMemo
+from main import ksm_to_yaml
+
+def convert(path, cache: Cache | None) -> str:
+    # the cached yaml itself would skip the memo
+    if cache is not None:
+        for entry in (path.parent / 'cache').glob('*/*.yaml'):
+            entry.unlink()
+    
+    ksm_to_yaml(str(path), cache=cache)
+    
+    return (path.parent / (path.name + '.yaml')).read_text()
+
+def test_memo_is_filled_on_the_first_run(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    script = tmp_path / 'script.bin'
+    script.write_bytes(generate(CorpusOptions(functions=30, seed=1)))
+    
+    expected = convert(script, None)
+    
+    assert convert(script, cache) == expected
+    memo = FunctionMemo(cache, str(script))
+    assert len(memo.previous) > 0
+    
+    # the second run finds every body in the memo, so it remembers the same ones again
+    assert convert(script, cache) == expected
+    assert json.loads(cache.read(memo.name)) == memo.previous
+    
+    # a different script at the same path only reuses the bodies that are still the same
+    script.write_bytes(generate(CorpusOptions(functions=30, seed=2)))
+    expected = convert(script, None)
+    
+    assert convert(script, cache) == expected
+    assert json.loads(cache.read(memo.name)).keys() != memo.previous.keys()
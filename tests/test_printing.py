@@ -0,0 +1,26 @@
+"""print_expr_or_var has to print the same thing with cached_symbol_texts as without, even for symbols changed in between."""
+import main # makes sure the circular imports between the modules resolve
+from other_types import Label, cached_symbol_texts, print_expr_or_var
+from variables import Var, VarCategory
+
+def test_changed_vars_are_printed_again():
+    var = Var(None, None, VarCategory.Const, 0x5, 0, 0, 3)
+    
+    with cached_symbol_texts():
+        assert print_expr_or_var(var) == "3`"
+        var.user_data = 4
+        assert print_expr_or_var(var) == "4`"
+        var.category = VarCategory.Global
+        assert print_expr_or_var(var) == "Global:0x5"
+        var.alias = '1'
+        assert print_expr_or_var(var) == "Global:1"
+        var.name = 'foo'
+        assert print_expr_or_var(var) == "Global:foo"
+
+def test_changed_labels_are_printed_again():
+    label = Label(None, None, 0x10, 0)
+    
+    with cached_symbol_texts():
+        assert print_expr_or_var(label) == "label:0x10"
+        label.alias = 'a'
+        assert print_expr_or_var(label) == "label:a"
@@ -0,0 +1,20 @@
+"""--profile has to count the same instructions whether the functions are decoded in this process or in worker processes."""
+import main # makes sure the circular imports between the modules resolve
+from benchmarks.corpus import CorpusOptions, generate
+from main import ksm_to_yaml
+import profiling
+
+def profile(path, jobs: int) -> profiling.Profile:
+    profiling.start()
+    ksm_to_yaml(str(path), jobs=jobs)
+    return profiling.stop()
+
+def test_workers_are_profiled(tmp_path):
+    script = tmp_path / 'script.bin'
+    script.write_bytes(generate(CorpusOptions(functions=30, seed=1)))
+    
+    alone = profile(script, 1)
+    workers = profile(script, 2)
+    
+    assert workers.stages['worker > decode'].calls == alone.stages['write yaml > decode'].calls
+    assert workers.opcode_counts == alone.opcode_counts
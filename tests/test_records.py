@@ -0,0 +1,39 @@
+"""RecordReader.columns has to read the same records as RecordReader.records, whatever the fields look like."""
+from array import array
+from random import Random
+
+import pytest
+
+from util import RecordLayout, RecordReader, write_string
+
+LAYOUT = RecordLayout('is_named', 'id', 'value')
+
+def make_section(rnd: Random, count: int, named_every: int) -> bytes:
+    out = array('I', [count])
+    
+    for i in range(count):
+        # fields that look like the start of a named record, on their own or straddling two fields
+        value = rnd.choice([i, 0xFFFFFFFF, 0xFFFFFF00, 0x00FFFFFF])
+        
+        if rnd.randrange(named_every) == 0:
+            out.extend([0xFFFFFFFF, i, value])
+            out.extend(write_string(f"record_{i}"))
+        else:
+            out.extend([0, i, value])
+    
+    return out.tobytes()
+
+@pytest.mark.parametrize('named_every', [1, 3, 50, 10000])
+def test_columns_are_the_records(named_every: int):
+    rnd = Random(named_every)
+    section = make_section(rnd, 500, named_every)
+    
+    reader = RecordReader(section)
+    records = reader.records(LAYOUT, reader.word())
+    assert reader.at_end()
+    
+    reader = RecordReader(section)
+    names, *columns = reader.columns(LAYOUT, reader.word())
+    assert reader.at_end()
+    
+    assert list(zip(zip(*columns), names)) == records
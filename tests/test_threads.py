@@ -0,0 +1,57 @@
+"""The body of a Thread with a function record of its own belongs to that function only, not also to the one starting it."""
+from collections import defaultdict
+
+import main # makes sure the circular imports between the modules resolve
+from benchmarks.corpus import CorpusOptions, generate
+from cmds import LAYOUTS
+from columns import InstructionColumns
+from container import read_ksm_container
+from functions import add_local_symbols, decode_function_def
+from graph import instruction_calls, script_calls
+from script import read_script
+from util import SymbolIds
+from xref import script_references
+
+DATA = generate(CorpusOptions(functions=40, seed=3))
+
+def test_columns_have_every_instruction_once():
+    symbol_ids = SymbolIds()
+    script = read_script(read_ksm_container(DATA), symbol_ids, analyze=False)
+    table = InstructionColumns.from_script(script, symbol_ids)
+    
+    assert any(fn.name.startswith('_') for fn in script.definitions)
+    assert len(set(table.offsets)) == len(table)
+    
+    for i in range(len(table)):
+        fn = table.functions[table.function_of(i)]
+        assert fn.code_offset <= table.offsets[i] < fn.code_offset + len(fn.code)
+        # the columns and the decoded instruction have to agree on what's where
+        assert type(table.instruction(i)) is LAYOUTS[table.opcodes[i]].cmd
+
+def test_references_are_in_the_innermost_function():
+    functions = defaultdict(set)
+    
+    for _, _, function, offset, _ in script_references(DATA):
+        functions[offset].add(function)
+    
+    assert all(len(names) == 1 for names in functions.values())
+
+def test_calls_are_edges_of_the_innermost_function():
+    # the functions that aren't Thread bodies have every instruction once between them
+    symbol_ids = SymbolIds()
+    script = read_script(read_ksm_container(DATA), symbol_ids, analyze=False)
+    targets = []
+    
+    for fn in script.definitions:
+        if not fn.name.startswith('_'):
+            with symbol_ids.scope():
+                add_local_symbols(fn, symbol_ids)
+                instructions, _, _ = decode_function_def(fn, symbol_ids)
+            
+            for inst in instructions:
+                instruction_calls(inst, targets)
+    
+    calls = script_calls('script', DATA)
+    
+    assert any(calls.functions[i][0].startswith('_') for i, _, _ in calls.calls)
+    assert len(calls.calls) == len(targets)
@@ -1,11 +1,155 @@
 from array import array
+from contextlib import contextmanager
+from itertools import repeat
 from math import ceil
-from typing import Any
+import re
+from struct import Struct
+from sys import intern
+from typing import Any, Iterator
 
-def read_string(section: bytes, offset_words: int) -> str:
-    buffer = section[offset_words * 4:]
-    bytelen = buffer.index(0)
-    return str(buffer[:bytelen], 'utf-8')
+def words(section: bytes | memoryview | array) -> memoryview:
+    """View a section as 32-bit words without copying it."""
+    view = memoryview(section)
+    return view if view.format == 'I' else view.cast('B').cast('I')
+
+def byte_view(section: bytes | memoryview | array) -> memoryview:
+    """View a section as bytes without copying it."""
+    view = memoryview(section)
+    return view if view.format == 'B' else view.cast('B')
+
+class StringTable:
+    """
+    Decodes the strings stored in a section, each one only once.
+    
+    Strings are stored as their length in words followed by the null-padded string,
+    so decoding one never has to look further than its own words.
+    The results are interned, since the same names show up all over a script.
+    """
+    strings: dict[int, str]
+    
+    def __init__(self, section: bytes | memoryview):
+        self.words = words(section)
+        self.bytes = byte_view(section)
+        self.strings = {}
+    
+    def get(self, offset_words: int) -> str:
+        string = self.strings.get(offset_words)
+        
+        if string is None:
+            word_len = self.words[offset_words - 1]
+            buffer = self.bytes[offset_words * 4:(offset_words + word_len) * 4].tobytes()
+            bytelen = buffer.index(0)
+            
+            string = intern(str(buffer[:bytelen], 'utf-8'))
+            self.strings[offset_words] = string
+        
+        return string
+
+class RecordLayout:
+    """
+    A record made of fixed 32-bit fields, the first of which says whether it's named.
+    
+    Named records start with 0xFFFFFFFF instead of 0
+    and have the name appended after the fixed fields.
+    """
+    fields: tuple[str, ...]
+    
+    def __init__(self, *fields: str):
+        self.fields = fields
+        self.size = len(fields)
+        self.struct = Struct(f'={len(fields)}I')
+
+# the first word of a named record
+NAMED_RECORD = re.compile(b'\xff\xff\xff\xff')
+# below this many records, reading them as columns costs more than it saves
+BULK_RECORDS = 16
+
+class RecordReader:
+    """Reads the records of a section, decoding each record's fixed fields at once."""
+    offset: int
+    
+    def __init__(self, section: bytes | memoryview):
+        self.words = words(section)
+        self.bytes = byte_view(section)
+        self.strings = StringTable(section)
+        self.offset = 0
+    
+    def word(self) -> int:
+        value = self.words[self.offset]
+        self.offset += 1
+        return value
+    
+    def string(self) -> str:
+        word_len = self.word()
+        value = self.strings.get(self.offset)
+        self.offset += word_len
+        return value
+    
+    def at_end(self) -> bool:
+        return self.offset == len(self.words)
+    
+    def record(self, layout: RecordLayout) -> tuple[tuple[int, ...], str | None]:
+        offset = self.offset
+        fields = layout.struct.unpack_from(self.bytes, offset * 4)
+        offset += layout.size
+        
+        if fields[0] == 0xFFFFFFFF:
+            name = self.strings.get(offset + 1)
+            offset += 1 + self.words[offset]
+        else:
+            assert fields[0] == 0
+            name = None
+        
+        self.offset = offset
+        return fields, name
+    
+    def records(self, layout: RecordLayout, count: int) -> list[tuple[tuple[int, ...], str | None]]:
+        return [self.record(layout) for _ in range(count)]
+    
+    def columns(self, layout: RecordLayout, count: int) -> tuple[list[str | None], list[int], ...]:
+        """
+        Reads count records one after the other like records, but returns the names and then every field
+        as a column (list) of its own. Apart from the names the records all have the same size,
+        so the fields of a run of unnamed records and the named one after it are copied out of the section in one go.
+        That only pays off for sections with more than a handful of records (see BULK_RECORDS).
+        """
+        names: list[str | None] = []
+        # the fields of every record one after the other
+        fields: list[int] = []
+        size = layout.size
+        words = self.words
+        search = NAMED_RECORD.search
+        
+        while len(names) < count:
+            start = self.offset
+            
+            if words[start] != 0:
+                end = start + size
+            else:
+                # where the next named record starts, which is the first 0xFFFFFFFF that's at the start of a record
+                stop = (start + (count - len(names)) * size) * 4
+                match = search(self.bytes, start * 4, stop)
+                
+                while match is not None and (match.start() % 4 != 0 or (match.start() // 4 - start) % size != 0):
+                    match = search(self.bytes, match.start() + 1, stop)
+                
+                if match is None:
+                    fields.extend(words[start:stop // 4])
+                    names.extend(repeat(None, (stop // 4 - start) // size))
+                    self.offset = stop // 4
+                    break
+                
+                end = match.start() // 4 + size
+                names.extend(repeat(None, (end - size - start) // size))
+            
+            fields.extend(words[start:end])
+            names.append(self.strings.get(end + 1))
+            self.offset = end + 1 + words[end]
+        
+        columns = [fields[i::size] for i in range(size)]
+        assert columns[0].count(0) + columns[0].count(0xFFFFFFFF) == count
+        
+        return names, *columns
 
 def write_string(value: str) -> array[int]:
     int_len = ceil((len(value) + 1) / 4)
@@ -16,36 +160,126 @@ def write_string(value: str) -> array[int]:
     out.extend(array('I', name_bytes))
     return out
 
+# marks entries that didn't exist before a scope defined them
+_UNDEFINED = object()
+
+def symbol_keys(value) -> list[tuple[Any, Any]]:
+    """
+    The (kind, name) pairs a symbol can be referred to by in the yaml,
+    e.g. ('fn', 'foo') for fn:foo, or (VarCategory.Global, 'bar') for Global:bar.
+    Unnamed constants are written as their value, so their name is (type, value), e.g. (int, 5) for 5`.
+    """
+    kind = getattr(value, 'symbol_kind', None)
+    if kind is None:
+        return []
+    
+    keys = []
+    
+    if value.name is not None:
+        keys.append((kind, value.name))
+    
+    alias = getattr(value, 'alias', None)
+    if alias is not None:
+        keys.append((kind, alias))
+    
+    const_value = getattr(value, 'const_value', None)
+    if const_value is not None:
+        keys.append((kind, const_value))
+    
+    return keys
+
 class SymbolIds:
-    layers: list[dict]
+    """
+    Maps ids to the symbols they refer to, in nested scopes.
+    
+    All scopes share a single dict, so a lookup is one dict access no matter how deep the scopes go.
+    Instead of a dict per scope, each pushed scope logs the entries it overwrote and popping it restores them,
+    which makes entering a scope free and leaving it cost only as much as what was defined in it.
     
-    def __init__(self, *, layers: list[dict] | None = None):
-        self.layers = layers if layers is not None else [{}]
+    Symbols are also indexed by their names, which is what the assembler looks them up by.
+    """
+    symbols: dict[int, Any]
+    names: dict[tuple[Any, Any], Any]
+    scopes: list[list[tuple[dict, Any, Any]]]
+    # pop() doesn't leave scopes entered through scope()
+    floor: int
+    
+    def __init__(self):
+        self.symbols = {}
+        self.names = {}
+        self.scopes = []
+        self.floor = 0
     
     def get(self, id: int) -> Any:
-        for layer in reversed(self.layers):
-            if id in layer:
-                return layer[id]
-        
-        return id
+        return self.symbols.get(id, id)
+    
+    def find(self, kind, name) -> Any | None:
+        """Looks up a symbol by name or alias, kind is 'fn', 'label', 'table' or a VarCategory."""
+        return self.names.get((kind, name))
     
     def add(self, value, *, id = None):
-        self.layers[-1][id if id is not None else value.id] = value
+        if id is None:
+            id = value.id
+        
+        previous = self.symbols.get(id)
+        if previous is not None:
+            # the names of whatever was defined with this id before go away with it
+            for key in symbol_keys(previous):
+                if self.names.get(key) is previous:
+                    self.set(self.names, key, _UNDEFINED)
+        
+        self.set(self.symbols, id, value)
+        
+        for key in symbol_keys(value):
+            self.set(self.names, key, value)
+    
+    def set(self, mapping: dict, key, value):
+        if self.scopes:
+            self.scopes[-1].append((mapping, key, mapping.get(key, _UNDEFINED)))
+        
+        if value is _UNDEFINED:
+            del mapping[key]
+        else:
+            mapping[key] = value
     
     def push(self):
-        self.layers.append({})
+        self.scopes.append([])
     
     def pop(self):
-        if len(self.layers) > 1:
-            self.layers.pop()
+        if len(self.scopes) > self.floor:
+            self.restore(self.scopes.pop())
     
-    def copy(self):
-        return SymbolIds(layers=[layer.copy() for layer in self.layers])
+    def restore(self, overwritten: list[tuple[dict, Any, Any]]):
+        for mapping, key, value in reversed(overwritten):
+            if value is _UNDEFINED:
+                del mapping[key]
+            else:
+                mapping[key] = value
     
-    def flat(self) -> dict:
-        out = dict()
-        
-        for layer in self.layers:
-            out = out | layer
+    @contextmanager
+    def scope(self):
+        """Pushes a scope that lasts until the end of the with block, no matter how many times pop() gets called."""
+        self.push()
+        floor, self.floor = self.floor, len(self.scopes)
         
+        try:
+            yield self
+        finally:
+            while len(self.scopes) >= self.floor:
+                self.restore(self.scopes.pop())
+            
+            self.floor = floor
+    
+    def copy(self) -> 'SymbolIds':
+        out = SymbolIds()
+        out.symbols = self.symbols.copy()
+        out.names = self.names.copy()
+        # the logs have to point at the copied dicts
+        replacements = {id(self.symbols): out.symbols, id(self.names): out.names}
+        out.scopes = [[(replacements[id(mapping)], key, value) for mapping, key, value in scope] for scope in self.scopes]
+        out.floor = self.floor
         return out
+    
+    def flat(self) -> dict:
+        """All symbols that are currently visible. This is the live dict, don't modify it."""
+        return self.symbols
@@ -2,12 +2,12 @@ from array import array
 from ctypes import c_int
 from dataclasses import dataclass
 from enum import Enum
+from itertools import chain
 import struct
-from sys import argv
 from types import NoneType
-from typing import Any
+from typing import Any, Iterator
 
-from util import SymbolIds, read_string, write_string
+from util import RecordLayout, RecordReader, SymbolIds, write_string
 
 class VarCategory(Enum):
     # script binary scope
@@ -32,7 +32,7 @@ VAR_TYPE_NAMES = {
     0xe: 'Uninitialized',
 }
 
-@dataclass
+@dataclass(slots=True)
 class Var:
     name: str | None
     alias: str | None
@@ -42,54 +42,53 @@ class Var:
     data_type: int
     flags: int
     user_data: int | str
+    
+    @property
+    def symbol_kind(self) -> VarCategory:
+        # variables are referred to by their category, e.g. Global:foo
+        return self.category
+    
+    @property
+    def const_value(self) -> tuple[type, int | float | str] | None:
+        # unnamed constants are written as their value (5`, 1.5`, 'text') instead
+        if self.category == VarCategory.Const and self.name is None and self.alias is None and self.user_data is not None:
+            return type(self.user_data), self.user_data
+        
+        return None
 
-def read_variable(arr: enumerate[int], section: bytes, category: VarCategory) -> Var:
-    offset, value = next(arr)
-    id = next(arr)[1]
-    raw_status = next(arr)[1]
+VAR_RECORD = RecordLayout('is_named', 'id', 'status', 'user_data')
+
+def read_variable(reader: RecordReader, category: VarCategory) -> Var:
+    (_, id, raw_status, raw_user_data), name = reader.record(VAR_RECORD)
     
     status = raw_status & 0xffffff
     flags = raw_status >> 24
     
     if status == 0:
         # bitwise convert int to float
-        user_data = struct.unpack('!f', struct.pack('!I', next(arr)[1]))[0]
+        user_data = struct.unpack('!f', struct.pack('!I', raw_user_data))[0]
     elif status == 1:
         # convert u32 to s32
-        user_data = c_int(next(arr)[1]).value
-    else:
-        user_data = next(arr)[1]
-    
-    if value == 0xFFFFFFFF:
-        name = read_string(section, offset + 5)
-        
-        for _ in range(next(arr)[1]):
-            next(arr)
+        user_data = c_int(raw_user_data).value
     else:
-        assert value == 0
-        name = None
+        user_data = raw_user_data
     
     if status == 3:
         assert user_data == 0
-        j, word_len = next(arr)
-        
-        user_data = read_string(section, j + 1)
-        
-        for _ in range(word_len):
-            next(arr)
+        user_data = reader.string()
     
     return Var(name, None, category, id, status, flags, user_data)
 
-def read_variable_defs(section: bytes, category: VarCategory) -> list[Var]:
-    arr = enumerate(array('I', section))
+def read_variable_defs(section: bytes | memoryview, category: VarCategory) -> list[Var]:
+    reader = RecordReader(section)
     
-    count = next(arr)[1]
+    count = reader.word()
     variables = []
     
     for _ in range(count):
-        variables.append(read_variable(arr, section, category))
+        variables.append(read_variable(reader, category))
     
-    assert next(arr, None) == None
+    assert reader.at_end()
     return variables
 
 def write_variable(var: Var) -> array[int]:
@@ -106,7 +105,8 @@ def write_variable(var: Var) -> array[int]:
         # string
         out.append(0)
     else:
-        out.append(int(var.user_data))
+        # signed ints are stored as their two's complement
+        out.append(int(var.user_data) & 0xFFFFFFFF)
     
     if var.name is not None:
         out.extend(write_string(var.name))
@@ -199,46 +199,20 @@ def var_from_yaml(var: Any, category: VarCategory) -> Var:
     
     return Var(name, alias, category, id, data_type, flags, content)
 
-def write_variables_yaml(sections: list[bytes], symbol_ids: SymbolIds):
-    # section 2
-    variables = read_variable_defs(sections[2], VarCategory.Static)
-    
-    var_str = 'static_variables:\n'
-    prev_status = None
-    for var in variables:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
-        
-        prev_status = var.data_type
-        symbol_ids.add(var)
-        var_str += print_var(var)
-    
-    # section 4
+def read_variables(sections: list[bytes], symbol_ids: SymbolIds) -> tuple[list[Var], list[Var], list[Var]]:
+    # sections 2, 4 and 6
+    static_variables = read_variable_defs(sections[2], VarCategory.Static)
     constants = read_variable_defs(sections[4], VarCategory.Const)
-    
-    var_str += '\nconstants:\n'
-    prev_status = None
-    for var in constants:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
-        
-        prev_status = var.data_type
-        symbol_ids.add(var)
-        var_str += print_var(var)
-    
-    # section 6
     global_variables = read_variable_defs(sections[6], VarCategory.Global)
     
-    var_str += '\nglobal_variables:\n'
-    prev_status = None
-    for var in global_variables:
-        if prev_status != None and var.data_type != prev_status:
-            var_str += '  \n'
-        
-        prev_status = var.data_type
+    for var in chain(static_variables, constants, global_variables):
         symbol_ids.add(var)
-        var_str += print_var(var)
     
+    add_temp_vars(symbol_ids)
+    
+    return static_variables, constants, global_variables
+
+def add_temp_vars(symbol_ids: SymbolIds):
     # temporary variables (defined implicitly)
     for i in range(20):
         var = Var(None, f"{i:X}", VarCategory.TempVar, 0x10000100 | i, 0, 0, 0)
@@ -249,24 +223,36 @@ def write_variables_yaml(sections: list[bytes], symbol_ids: SymbolIds):
         # good for passing previously uninitialized variables as out vars to a function
         var = Var(None, f"{i:X}", VarCategory.ClearTempVar, 0x10000400 | i, 0, 0, 0)
         symbol_ids.add(var)
+
+def print_variable_group(variables: list[Var]) -> Iterator[str]:
+    prev_status = None
+    for var in variables:
+        if prev_status != None and var.data_type != prev_status:
+            yield '  \n'
+        
+        prev_status = var.data_type
+        yield print_var(var)
+
+def print_variables(static_variables: list[Var], constants: list[Var], global_variables: list[Var]) -> Iterator[str]:
+    yield 'static_variables:\n'
+    yield from print_variable_group(static_variables)
     
-    with open(argv[1] + '.variables.yaml', 'w', encoding='utf-8') as f:
-        f.write(var_str)
+    yield '\nconstants:\n'
+    yield from print_variable_group(constants)
+    
+    yield '\nglobal_variables:\n'
+    yield from print_variable_group(global_variables)
 
-def parse_variables(var_input_file: dict, category_key: str, category: VarCategory, symbol_ids: SymbolIds) -> bytearray:
+def parse_variables(var_input_file: dict, category_key: str, category: VarCategory, symbol_ids: SymbolIds) -> list[Var]:
     if category_key in var_input_file and var_input_file[category_key] is not None:
         assert isinstance(var_input_file[category_key], list), f"{category.name} variables have to be a list"
         
         vars_obj = var_input_file[category_key]
         vars = [var_from_yaml(var_obj, category) for var_obj in vars_obj]
         
-        out = array('I')
-        out.append(len(vars))
-        
         for var in vars:
             symbol_ids.add(var)
-            out.extend(write_variable(var))
         
-        return bytearray(out)
+        return vars
     else:
-        return bytearray([0, 0, 0, 0])
\ No newline at end of file
+        return []
\ No newline at end of file
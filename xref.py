@@ -0,0 +1,306 @@
+"""
+Index of where the symbols of a corpus of scripts are used, for questions like which scripts call an import,
+or which functions write a global, without disassembling everything again.
+
+The index is an sqlite database. For every instruction operand that is a function (defined or imported),
+a variable or a table, it keeps the file, the function and the offset of the instruction,
+and whether the symbol gets called, written or read there. Symbols are named like in the yaml (fn:name, Global:name, table:name).
+
+Updating the index only decodes files whose size or modification time changed since they were indexed
+(and whose content actually changed), and drops files that no longer exist.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from enum import Enum
+from hashlib import sha256
+import os
+import sqlite3
+from traceback import format_exception_only
+from typing import Any, Iterator
+
+from cache import TOOL_VERSION
+import cmds
+from container import read_input_file, read_ksm_container
+from functions import FunctionDef, add_local_symbols, decode_function_def, nested_code_ranges, own_instructions
+from other_types import Expr, ScriptImport, print_expr_or_var
+from script import read_script
+from tables import Table
+from util import SymbolIds
+from variables import Var
+
+# bump this whenever what gets indexed changes, indices written by older versions get rebuilt
+INDEX_VERSION = 2
+
+class Access(Enum):
+    Read = 0
+    Write = 1
+    Call = 2
+
+# operands that are written or called by an instruction, everything else is read
+WRITTEN_OPERANDS = {
+    cmds.SetCmd: ('destination',),
+    cmds.ToIntCmd: ('variable',),
+    cmds.ToFloatCmd: ('variable',),
+    cmds.ReadTableEntryToVarCmd: ('var',),
+    cmds.ReadTableEntriesVec2Cmd: ('x', 'y'),
+    cmds.ReadTableEntriesVec3Cmd: ('x', 'y', 'z'),
+    cmds.TableGetIndexCmd: ('var',),
+    cmds.GetArgsCmd: ('args',),
+}
+
+CALLED_OPERANDS = {
+    cmds.CallCmd: ('func',),
+    cmds.CallAsThreadCmd: ('func',),
+    cmds.CallAsChildThreadCmd: ('func',),
+    cmds.CallVarCmd: ('func',),
+    cmds.ThreadCmd: ('func',),
+    cmds.Thread2Cmd: ('func',),
+}
+
+# (operand name, access) of every operand, by instruction type
+OPERAND_ACCESS: dict[type, list[tuple[str, Access]]] = {}
+
+def operand_access(cmd: type) -> list[tuple[str, Access]]:
+    operands = OPERAND_ACCESS.get(cmd)
+    
+    if operands is None:
+        operands = []
+        
+        for cmd_field in fields(cmd):
+            if cmd_field.name in WRITTEN_OPERANDS.get(cmd, ()):
+                operands.append((cmd_field.name, Access.Write))
+            elif cmd_field.name in CALLED_OPERANDS.get(cmd, ()):
+                operands.append((cmd_field.name, Access.Call))
+            else:
+                operands.append((cmd_field.name, Access.Read))
+        
+        OPERAND_ACCESS[cmd] = operands
+    
+    return operands
+
+SYMBOL_TYPES = {ScriptImport, FunctionDef, Var, Table}
+
+def operand_references(value: Any, access: Access, out: list[tuple[Any, Access]]):
+    # checking the exact type is a lot faster than matching class patterns, which adds up over millions of operands
+    value_type = type(value)
+    
+    if value_type in SYMBOL_TYPES:
+        out.append((value, access))
+    elif value_type is Expr:
+        for element in value.elements:
+            element_type = type(element)
+            
+            if element_type in SYMBOL_TYPES:
+                out.append((element, Access.Read))
+            elif element_type is cmds.CallCmd:
+                # calls inside expressions
+                instruction_references(element, out)
+    elif value_type is list:
+        for item in value:
+            operand_references(item, access, out)
+
+def instruction_references(inst: Any, out: list[tuple[Any, Access]]):
+    for name, access in operand_access(type(inst)):
+        operand_references(getattr(inst, name), access, out)
+
+# (symbol, kind, function, instruction offset, access)
+Reference = tuple[str, str, str, int, Access]
+
+def script_references(data: bytes | memoryview) -> Iterator[Reference]:
+    """
+    Every reference to a function, variable or table in the code of a script.
+    References in the body of a Thread that has a function record of its own are only that function's.
+    """
+    symbol_ids = SymbolIds()
+    script = read_script(read_ksm_container(data), symbol_ids, analyze=False)
+    
+    for fn, nested in zip(script.definitions, nested_code_ranges(script.definitions)):
+        if len(fn.code) == 0:
+            continue
+        
+        offsets = []
+        with symbol_ids.scope():
+            add_local_symbols(fn, symbol_ids)
+            instructions, _, _ = decode_function_def(fn, symbol_ids, offsets)
+        
+        function = print_expr_or_var(fn)[len('fn:'):]
+        # (name, kind) by id of the symbol, only kept for one function,
+        # since the captured variables of threads are copies that go away with the instructions
+        names: dict[int, tuple[str, str]] = {}
+        
+        for n in own_instructions(offsets, nested):
+            offset = offsets[n]
+            references = []
+            instruction_references(instructions[n], references)
+            
+            for symbol, access in references:
+                name = names.get(id(symbol))
+                if name is None:
+                    kind = symbol.category.name if type(symbol) is Var else symbol.symbol_kind
+                    name = names[id(symbol)] = print_expr_or_var(symbol), kind
+                
+                yield name[0], name[1], function, offset, access
+
+def file_references(filename: str) -> tuple[str | None, list[Reference], str | None]:
+    """(digest of the file, its references, None), or (None, [], error message) when the file can't be read."""
+    try:
+        data = read_input_file(filename, use_mmap=True)
+        return sha256(data).hexdigest(), list(script_references(data)), None
+    except Exception as e:
+        return None, [], ''.join(format_exception_only(e)).strip()
+
+SCHEMA = """
+create table if not exists meta (key text primary key, value integer);
+create table if not exists files (id integer primary key, path text unique, size integer, mtime_ns integer, digest text);
+create table if not exists functions (id integer primary key, file integer, name text);
+create table if not exists symbols (id integer primary key, name text unique, kind text);
+create table if not exists refs (symbol integer, function integer, offset integer, access integer);
+create index if not exists refs_symbol on refs (symbol);
+create index if not exists refs_function on refs (function);
+create index if not exists functions_file on functions (file);
+"""
+
+class XrefIndex:
+    db: sqlite3.Connection
+    
+    def __init__(self, filename: str):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+        
+        # the decoders are part of what gets indexed too
+        versions = {('index_version', INDEX_VERSION), ('tool_version', TOOL_VERSION)}
+        if set(self.db.execute("select key, value from meta")) != versions:
+            self.clear()
+            self.db.execute("delete from meta")
+            self.db.executemany("insert into meta values (?, ?)", versions)
+            self.db.commit()
+    
+    def close(self):
+        self.db.close()
+    
+    def __enter__(self) -> 'XrefIndex':
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def clear(self):
+        for table in ['files', 'functions', 'symbols', 'refs']:
+            self.db.execute(f"delete from {table}")
+    
+    def remove_file(self, file_id: int):
+        self.db.execute("delete from refs where function in (select id from functions where file = ?)", (file_id,))
+        self.db.execute("delete from functions where file = ?", (file_id,))
+        self.db.execute("delete from files where id = ?", (file_id,))
+    
+    def symbol_id(self, name: str, kind: str) -> int:
+        self.db.execute("insert or ignore into symbols (name, kind) values (?, ?)", (name, kind))
+        return self.db.execute("select id from symbols where name = ?", (name,)).fetchone()[0]
+    
+    def add_file(self, path: str, stat: os.stat_result, digest: str, references: list[Reference]):
+        file_id = self.db.execute("insert into files (path, size, mtime_ns, digest) values (?, ?, ?, ?)",
+                                  (path, stat.st_size, stat.st_mtime_ns, digest)).lastrowid
+        
+        function_ids: dict[str, int] = {}
+        symbol_ids: dict[str, int] = {}
+        rows = []
+        
+        for symbol, kind, function, offset, access in references:
+            function_id = function_ids.get(function)
+            if function_id is None:
+                function_id = self.db.execute("insert into functions (file, name) values (?, ?)", (file_id, function)).lastrowid
+                function_ids[function] = function_id
+            
+            symbol_id = symbol_ids.get(symbol)
+            if symbol_id is None:
+                symbol_id = symbol_ids[symbol] = self.symbol_id(symbol, kind)
+            
+            rows.append((symbol_id, function_id, offset, access.value))
+        
+        self.db.executemany("insert into refs values (?, ?, ?, ?)", rows)
+    
+    def stale_files(self, filenames: list[str]) -> list[tuple[str, os.stat_result]]:
+        """The files that aren't indexed, or have a different size or modification time than when they were."""
+        stale = []
+        
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            stat = os.stat(path)
+            row = self.db.execute("select size, mtime_ns from files where path = ?", (path,)).fetchone()
+            
+            if row is None or row != (stat.st_size, stat.st_mtime_ns):
+                stale.append((path, stat))
+        
+        return stale
+    
+    def update(self, filenames: list[str], workers: int | None = 1) -> tuple[int, int, list[tuple[str, str]]]:
+        """
+        Indexes the files that changed since they were last indexed, and forgets about indexed files that are gone.
+        Returns how many files got (re)indexed, how many were removed and (file, error) for every file that couldn't be read,
+        which keep whatever they were indexed with before.
+        """
+        stale = self.stale_files(filenames)
+        
+        if workers == 1:
+            results = map(file_references, [path for path, _ in stale])
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = pool.map(file_references, [path for path, _ in stale], chunksize=4)
+        
+        indexed = 0
+        failures = []
+        
+        for (path, stat), (digest, references, error) in zip(stale, results):
+            if error is not None:
+                failures.append((path, error))
+                continue
+            
+            row = self.db.execute("select id, digest from files where path = ?", (path,)).fetchone()
+            
+            if row is not None and row[1] == digest:
+                # only touched, the references are still the same
+                self.db.execute("update files set size = ?, mtime_ns = ? where id = ?", (stat.st_size, stat.st_mtime_ns, row[0]))
+                continue
+            
+            if row is not None:
+                self.remove_file(row[0])
+            
+            self.add_file(path, stat, digest, references)
+            indexed += 1
+        
+        if workers != 1:
+            pool.shutdown()
+        
+        removed = [id for id, path in self.db.execute("select id, path from files") if not os.path.exists(path)]
+        for id in removed:
+            self.remove_file(id)
+        
+        # symbols nobody refers to anymore
+        self.db.execute("delete from symbols where id not in (select distinct symbol from refs)")
+        self.db.commit()
+        
+        return indexed, len(removed), failures
+    
+    def query(self, pattern: str, access: Access | None = None) -> list[tuple[str, str, int, Access, str]]:
+        """
+        (file, function, instruction offset, access, symbol) of every reference to the symbols matching pattern,
+        which is a name like in the yaml (fn:name, Global:name, table:name) that can contain * and ? wildcards.
+        """
+        sql = """
+            select files.path, functions.name, refs.offset, refs.access, symbols.name
+            from symbols
+            join refs on refs.symbol = symbols.id
+            join functions on functions.id = refs.function
+            join files on files.id = functions.file
+            where symbols.name glob ?
+        """
+        parameters: list = [pattern]
+        
+        if access is not None:
+            sql += " and refs.access = ?"
+            parameters.append(access.value)
+        
+        sql += " order by files.path, functions.id, refs.offset"
+        
+        return [(path, function, offset, Access(access), symbol)
+                for path, function, offset, access, symbol in self.db.execute(sql, parameters)]